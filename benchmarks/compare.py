@@ -0,0 +1,53 @@
+'''
+Compares two result files of benchmarks.suite (or benchmarks.loadtest).
+
+Usage: python -m benchmarks.compare BASELINE.json CANDIDATE.json
+           [--threshold PERCENT]
+
+Prints the time ratio of every result present in both files; with
+--threshold, exits with status 1 if any result got slower by more than
+PERCENT.
+'''
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return {row['name']: row for row in json.load(f)['results']}
+
+
+def compare(baseline, candidate):
+    rows = []
+    for name, row in baseline.items():
+        other = candidate.get(name)
+        if other is None or not row['seconds']:
+            continue
+        rows.append(dict(name=name, baseline=row['seconds'],
+                         candidate=other['seconds'],
+                         ratio=other['seconds'] / row['seconds']))
+    return rows
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument('baseline')
+    args.add_argument('candidate')
+    args.add_argument('--threshold', type=float, default=None)
+    args = args.parse_args(argv)
+    rows = compare(load(args.baseline), load(args.candidate))
+    slower = []
+    for row in rows:
+        change = (row['ratio'] - 1) * 100
+        print(f"{row['baseline'] * 1e6:12.1f} {row['candidate'] * 1e6:12.1f}"
+              f" {change:+7.1f}%  {row['name']}")
+        if args.threshold is not None and change > args.threshold:
+            slower.append(row['name'])
+    if slower:
+        print(f'slower than threshold: {", ".join(slower)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
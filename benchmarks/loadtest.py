@@ -0,0 +1,282 @@
+'''
+In-process load test of CatchallView endpoints: a Pyramid app configured with
+includeme_factory is driven through WSGI by a pool of threads, without
+network, on a SQLite file seeded by benchmarks.model.
+
+Usage: python -m benchmarks.loadtest [--threads N] [--requests N]
+           [--warmup N] [--mix get=40,list=30,insert=10,update=15,delete=5]
+           [--roots N] [--depth N] [--fanout N] [--cycles F] [--seed N]
+           [--output FILE]
+
+Reports throughput, latency percentiles and SQL statements per request, by
+request kind and overall, and the peak RSS of the process. Result rows carry
+`name` and `seconds` (mean latency) and can be compared with
+benchmarks.compare.
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import simplejson
+import sqlalchemy
+import transaction
+import zope.sqlalchemy
+from pyramid.config import Configurator
+from pyramid.request import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from py_liant.pyramid import CatchallView, includeme_factory
+
+from . import model
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+MIX = 'get=40,list=30,insert=10,update=15,delete=5'
+
+PROFILES = dict(tree='*children(*children)', links='+link,*linked,-blob')
+
+GETS = ['node@{id}', 'node@{id}:tree', 'node@{id}:*children(+link),-blob',
+        'node@{id}:links', 'node@{id}:*children(*children(+link,-blob))']
+
+LISTS = ['node?kind=branch&pageSize=20&order=value+desc',
+         'node[0:20]:*children?active=true&value_gt=500000',
+         'node:links?score_lt=0.5&pageSize=50&page=1',
+         'node?name_like=node+1%25&order=created']
+
+
+def make_app(engine, settings=None, **kwargs):
+    # kwargs are passed to includeme_factory
+    session_factory = sessionmaker(bind=engine)
+
+    def dbsession(request):
+        session = session_factory()
+        zope.sqlalchemy.register(session,
+                                 transaction_manager=transaction.manager)
+
+        def finished(request):
+            transaction.abort()
+            session.close()
+        request.add_finished_callback(finished)
+        return session
+
+    config = Configurator(settings=settings or {})
+    config.include(includeme_factory(base_class=model.Base, **kwargs))
+    config.add_request_method(dbsession, 'dbsession', reify=True)
+    config.add_route('catchall', '/api/{catchall:.*}')
+    config.add_view(CatchallView, attr='process', renderer='json',
+                    route_name='catchall', catchall={
+                        'node': dict(cls=model.Node, profiles=PROFILES)})
+    return config.make_wsgi_app()
+
+
+class StatementCounter:
+    # statements executed by the current thread
+    def __init__(self, engine):
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.local.count = self.get() + 1
+
+    def get(self):
+        return getattr(self.local, 'count', 0)
+
+
+class Scenario:
+    '''
+    Generates requests of each kind; ids come from the seeded rows and, for
+    deletes, from rows inserted during the run.
+    '''
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.inserted = deque()
+        self.counter = itertools.count()
+
+    def request(self, kind, rng):
+        if kind == 'delete':
+            try:
+                return 'DELETE', f'/api/node@{self.inserted.popleft()}', None
+            except IndexError:
+                kind = 'insert'
+        if kind == 'get':
+            path = rng.choice(GETS).format(id=rng.randint(1, self.nodes))
+            return 'GET', f'/api/{path}', None
+        if kind == 'list':
+            return 'GET', f'/api/{rng.choice(LISTS)}', None
+        if kind == 'insert':
+            data = model.payload(1, 2, seed=rng.randrange(1000000))
+            return 'POST', '/api/node', dict(node=data)
+        if kind == 'update':
+            data = dict(name=f'updated {next(self.counter)}',
+                        value=rng.randrange(1000000))
+            return 'POST', f'/api/node@{rng.randint(1, self.nodes)}', \
+                dict(node=data)
+        raise ValueError(f'unknown request kind {kind!r}')
+
+    def completed(self, kind, method, response):
+        if method == 'POST' and kind in ('insert', 'delete'):
+            self.inserted.append(response.json['node']['id'])
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, weight = item.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, fraction):
+    # values sorted
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_rss():
+    # bytes
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def summarize(name, samples, wall):
+    latencies = sorted(sample[1] for sample in samples)
+    count = len(samples)
+    return dict(
+        name=name, count=count,
+        errors=sum(1 for sample in samples if sample[2] >= 400),
+        seconds=sum(latencies) / count if count else None,
+        p50=percentile(latencies, 0.50), p95=percentile(latencies, 0.95),
+        p99=percentile(latencies, 0.99),
+        statements_per_request=sum(sample[3] for sample in samples) / count
+        if count else None,
+        requests_per_second=count / wall if wall else None)
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='py_liant_loadtest')
+    path = os.path.join(directory, 'loadtest.sqlite')
+    engine = create_engine(
+        f'sqlite:///{path}', poolclass=QueuePool, pool_size=args.threads,
+        connect_args=dict(check_same_thread=False, timeout=30))
+    model.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        nodes = model.populate(session, roots=args.roots, depth=args.depth,
+                               fanout=args.fanout, cycles=args.cycles,
+                               seed=args.seed)
+    app = make_app(engine)
+    statements = StatementCounter(engine)
+    scenario = Scenario(nodes)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+
+    def call(kind, rng):
+        method, url, body = scenario.request(kind, rng)
+        request = Request.blank(url, method=method)
+        if body is not None:
+            request.body = simplejson.dumps(body).encode()
+            request.content_type = 'application/json'
+        before = statements.get()
+        start = time.perf_counter()
+        try:
+            response = request.get_response(app)
+            status = response.status_code
+        except Exception:
+            # unhandled view errors count as failed requests
+            response, status = None, 500
+        latency = time.perf_counter() - start
+        if status == 200:
+            scenario.completed(kind, method, response)
+        return kind, latency, status, statements.get() - before
+
+    def worker(index, count):
+        rng = random.Random(args.seed * 1000 + index)
+        return [call(kind, rng)
+                for kind in rng.choices(kinds, weights, k=count)]
+
+    try:
+        worker(-1, args.warmup)
+        per_thread = [args.requests // args.threads +
+                      (1 if i < args.requests % args.threads else 0)
+                      for i in range(args.threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            samples = list(itertools.chain.from_iterable(
+                pool.map(worker, range(args.threads), per_thread)))
+        wall = time.perf_counter() - start
+    finally:
+        engine.dispose()
+        os.remove(path)
+        os.rmdir(directory)
+
+    results = [summarize(kind, [s for s in samples if s[0] == kind], wall)
+               for kind in kinds]
+    results.append(summarize('all', samples, wall))
+    return dict(
+        meta=dict(python=platform.python_version(),
+                  implementation=platform.python_implementation(),
+                  sqlalchemy=sqlalchemy.__version__,
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  config=dict(threads=args.threads, requests=args.requests,
+                              warmup=args.warmup, mix=mix, roots=args.roots,
+                              depth=args.depth, fanout=args.fanout,
+                              cycles=args.cycles, seed=args.seed),
+                  nodes=nodes),
+        wall_seconds=wall, peak_rss=peak_rss(), results=results)
+
+
+def parse_args(argv=None):
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument('--threads', type=int, default=4)
+    args.add_argument('--requests', type=int, default=2000)
+    args.add_argument('--warmup', type=int, default=100)
+    args.add_argument('--mix', default=MIX)
+    args.add_argument('--roots', type=int, default=20)
+    args.add_argument('--depth', type=int, default=3)
+    args.add_argument('--fanout', type=int, default=4)
+    args.add_argument('--cycles', type=float, default=0.1)
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--output', default=None)
+    return args.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    print(f"{results['wall_seconds']:.2f}s wall, peak RSS "
+          f"{(results['peak_rss'] or 0) / 2 ** 20:.1f} MiB", file=sys.stderr)
+    for row in results['results']:
+        if not row['count']:
+            continue
+        print(f"{row['name']:>8} {row['count']:6d} req {row['errors']:4d} err"
+              f" {row['requests_per_second']:8.1f} req/s"
+              f"  p50 {row['p50'] * 1000:7.2f}ms p95 {row['p95'] * 1000:7.2f}"
+              f"ms p99 {row['p99'] * 1000:7.2f}ms"
+              f" {row['statements_per_request']:5.1f} sql/req",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
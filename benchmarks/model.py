@@ -0,0 +1,145 @@
+'''
+Synthetic model and data generator for the benchmarks.
+
+Node rows form `roots` trees of the given `depth` and `fanout`; a `cycles`
+fraction of the nodes also links to a random node (Node.link and its
+Node.linked backref), so the loaded object graph contains cycles and repeated
+objects, which the encoder writes as `_ref`s.
+'''
+import enum
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import (Boolean, Column, Date, DateTime, Float, ForeignKey,
+                        Integer, Interval, LargeBinary, Numeric, Text,
+                        create_engine)
+from sqlalchemy.orm import (Session, backref, declarative_base, joinedload,
+                            relationship, selectinload)
+
+from py_liant.enum import PythonEnum
+from py_liant.monkeypatch import patch_sqlalchemy_base_class
+
+Base = declarative_base()
+
+
+class Kind(enum.Enum):
+    root = 'root'
+    branch = 'branch'
+    leaf = 'leaf'
+
+
+class Node(Base):
+    __tablename__ = 'node'
+    id = Column(Integer, primary_key=True)
+    parent_id = Column(ForeignKey('node.id'), index=True)
+    link_id = Column(ForeignKey('node.id'), index=True)
+    name = Column(Text)
+    kind = Column(PythonEnum(Kind))
+    value = Column(Integer)
+    score = Column(Float)
+    amount = Column(Numeric(12, 2))
+    active = Column(Boolean)
+    created = Column(DateTime)
+    day = Column(Date)
+    ttl = Column(Interval)
+    blob = Column(LargeBinary)
+
+    # apply_changes resolves class or callable relationship arguments
+    children = relationship(
+        lambda: Node, foreign_keys=[parent_id],
+        backref=backref('parent', remote_side=[id]))
+    # links may form cycles with the trees; they are written by a separate
+    # UPDATE
+    link = relationship(
+        lambda: Node, foreign_keys=[link_id], remote_side=[id],
+        post_update=True,
+        backref=backref('linked', foreign_keys=[link_id]))
+
+
+patch_sqlalchemy_base_class(Base)
+
+# sample input for coerce_value, by column
+COERCE_INPUT = dict(
+    value='123456', score='0.125', amount='1234.50', active='true',
+    created='2020-01-02T03:04:05', day='2020-01-02', kind='branch',
+    name='some text', blob='AAECAwQFBgcICQ==')
+
+
+def make_node(rng, i, kind):
+    return Node(
+        name=f'node {i}', kind=kind, value=rng.randrange(1000000),
+        score=rng.random(), amount=Decimal(rng.randrange(100000)) / 100,
+        active=bool(i % 2), created=datetime(2020, 1, 1) + timedelta(
+            seconds=i), day=date(2020, 1, 1) + timedelta(days=i % 365),
+        ttl=timedelta(minutes=i % 60), blob=bytes(
+            rng.getrandbits(8) for _ in range(16)))
+
+
+def graph_size(roots, depth, fanout):
+    return roots * sum(fanout ** level for level in range(depth + 1))
+
+
+def populate(session, roots=10, depth=3, fanout=4, cycles=0.1, seed=0):
+    # returns the number of nodes created
+    rng = random.Random(seed)
+    nodes = []
+
+    def _tree(level):
+        kind = Kind.root if level == 0 else \
+            Kind.leaf if level == depth else Kind.branch
+        node = make_node(rng, len(nodes), kind)
+        nodes.append(node)
+        if level < depth:
+            node.children = [_tree(level + 1) for _ in range(fanout)]
+        return node
+
+    session.add_all([_tree(0) for _ in range(roots)])
+    for node in nodes:
+        if rng.random() < cycles:
+            node.link = rng.choice(nodes)
+    session.commit()
+    return len(nodes)
+
+
+def setup(**kwargs):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+    count = populate(session, **kwargs)
+    session.close()
+    return engine, count
+
+
+def graph_options(depth):
+    # loads the whole trees, and the links at every level
+    ret = [joinedload(Node.link)]
+    path = None
+    for level in range(depth):
+        path = selectinload(Node.children) if path is None \
+            else path.selectinload(Node.children)
+        ret.extend((path, path.joinedload(Node.link)))
+    return ret
+
+
+def load_graph(session, depth):
+    return session.query(Node).filter(Node.parent_id.is_(None)) \
+        .options(*graph_options(depth)).all()
+
+
+def payload(depth, fanout, seed=0):
+    # JSON input for a new tree, as decoded by JSONDecoder
+    rng = random.Random(seed)
+    counter = iter(range(1000000000))
+
+    def _node(level):
+        i = next(counter)
+        ret = dict(name=f'node {i}', kind='leaf' if level == depth
+                   else 'branch', value=rng.randrange(1000000),
+                   score=rng.random(), amount=str(rng.randrange(100000) / 100),
+                   active=bool(i % 2), created='2020-01-02T03:04:05',
+                   day='2020-01-02', blob='AAECAwQFBgcICQ==')
+        if level < depth:
+            ret['children'] = [_node(level + 1) for _ in range(fanout)]
+        return ret
+    return _node(0)
@@ -0,0 +1,53 @@
+'''
+Compares the pyparsing route grammar with the hand-written parser.
+
+Usage: python -m benchmarks.parser [--number N] [--output FILE]
+'''
+import argparse
+import json
+import sys
+import timeit
+
+from py_liant import fast_parser, parser
+
+ROUTES = [
+    'parent',
+    'parent@1',
+    'parent@1:*children',
+    'parent!father@1,2/children!girl[0:10]:full',
+    'parent[0:50]:with_children:-blob,*children(+blob,*second_parent)',
+    'parent:!father(*father_data),!mother(*mother_data(+a,-b,*c(+d)))',
+]
+
+
+def run(number=2000):
+    results = []
+    for route in ROUTES:
+        row = dict(route=route)
+        for name, module in (('pyparsing', parser), ('fast', fast_parser)):
+            seconds = min(timeit.repeat(lambda: module.parse_route(route),
+                                        number=number, repeat=3))
+            row[name] = seconds / number * 1e6
+        row['speedup'] = row['pyparsing'] / row['fast']
+        results.append(row)
+    return dict(unit='us/parse', number=number, results=results)
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument('--number', type=int, default=2000)
+    args.add_argument('--output', default=None)
+    args = args.parse_args(argv)
+    results = run(args.number)
+    for row in results['results']:
+        print(f"{row['pyparsing']:10.1f} {row['fast']:8.1f} "
+              f"{row['speedup']:6.1f}x  {row['route']}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
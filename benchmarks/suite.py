@@ -0,0 +1,190 @@
+'''
+Benchmarks JSONEncoder, JSONDecoder, apply_changes, coerce_value and the
+route and hints parsers on in-memory SQLite, with the synthetic model and
+data of benchmarks.model.
+
+Usage: python -m benchmarks.suite [--roots N] [--depth N] [--fanout N]
+           [--cycles F] [--repeat N] [--only NAME,...] [--output FILE]
+
+Every result row has a unique `name` and `seconds`, the best time of one
+operation over the repeats; compare runs with benchmarks.compare.
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+import simplejson
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from py_liant.fast_parser import parse_hints, parse_route
+from py_liant.json_decoder import JSONDecoder
+from py_liant.json_encoder import JSONEncoder
+from py_liant.monkeypatch import coerce_value
+from py_liant.pyramid import CatchallPredicate
+
+from . import model
+from .parser import ROUTES
+
+HINTS = [
+    '*children',
+    '+link,-blob,-ttl',
+    '*children(*children(+link,-blob)),*linked',
+    '*children(*children(*children(*children(+link(+parent))))),+parent',
+]
+
+
+def best(func, repeat, number=1):
+    # best seconds per call
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def encode(graph, sort=False):
+    encoder = JSONEncoder(base_type=model.Base, sort=sort,
+                          check_circular=False)
+    return encoder.encode(graph), encoder.counter
+
+
+def bench_encoder(engine, args):
+    rows = []
+    with Session(engine) as session:
+        graph = model.load_graph(session, args.depth)
+        for sort in (False, True):
+            body, objects = encode(graph, sort)
+            seconds = best(lambda: encode(graph, sort), args.repeat)
+            rows.append(dict(
+                name='encoder_sorted' if sort else 'encoder',
+                seconds=seconds, objects=objects, bytes=len(body),
+                objects_per_second=objects / seconds,
+                mb_per_second=len(body) / seconds / 1e6))
+    return rows
+
+
+def bench_decoder(engine, args):
+    with Session(engine) as session:
+        body, objects = encode(model.load_graph(session, args.depth))
+    seconds = best(lambda: JSONDecoder().decode(body), args.repeat)
+    return [dict(name='decoder', seconds=seconds, objects=objects,
+                 refs=body.count('"_ref"'), bytes=len(body),
+                 mb_per_second=len(body) / seconds / 1e6)]
+
+
+def bench_apply_changes(engine, args):
+    shapes = dict(wide=(1, args.fanout ** args.depth),
+                  deep=(args.fanout ** args.depth, 1),
+                  tree=(args.depth, args.fanout))
+    rows = []
+    with Session(engine) as session:
+        for shape, (depth, fanout) in shapes.items():
+            body = simplejson.dumps(model.payload(depth, fanout))
+            objects = model.graph_size(1, depth, fanout)
+            if shape == 'deep':
+                # apply_changes recurses once per level
+                limit = sys.getrecursionlimit()
+                sys.setrecursionlimit(max(limit, depth * 20 + 1000))
+            times = []
+            for _ in range(args.repeat):
+                data = JSONDecoder().decode(body)
+                obj = model.Node()
+                with session.no_autoflush:
+                    session.add(obj)
+                    start = time.perf_counter()
+                    obj.apply_changes(data, for_update=False)
+                    times.append(time.perf_counter() - start)
+                session.rollback()
+            seconds = min(times)
+            rows.append(dict(name=f'apply_changes_{shape}', seconds=seconds,
+                             objects=objects, depth=depth, fanout=fanout,
+                             us_per_object=seconds / objects * 1e6))
+    return rows
+
+
+def bench_coerce_value(engine, args):
+    rows = []
+    for key, value in model.COERCE_INPUT.items():
+        column = model.Node.__table__.c[key]
+        seconds = best(lambda: coerce_value(model.Node, column, value),
+                       args.repeat, number=2000)
+        rows.append(dict(name=f'coerce_value_{key}', seconds=seconds,
+                         type=repr(column.type), input=value))
+    return rows
+
+
+def bench_parser(engine, args):
+    rows = []
+    for i, route in enumerate(ROUTES):
+        rows.append(dict(name=f'parse_route_{i}', route=route,
+                         seconds=best(lambda: parse_route(route),
+                                      args.repeat, number=1000)))
+    for i, hints in enumerate(HINTS):
+        parsed = parse_hints(hints)
+        rows.append(dict(name=f'parse_hints_{i}', hints=hints,
+                         seconds=best(lambda: parse_hints(hints),
+                                      args.repeat, number=1000)))
+        rows.append(dict(name=f'get_hints_{i}', hints=hints, seconds=best(
+            lambda: CatchallPredicate.get_hints(parsed, model.Node),
+            args.repeat, number=200)))
+    return rows
+
+
+BENCHMARKS = dict(encoder=bench_encoder, decoder=bench_decoder,
+                  apply_changes=bench_apply_changes,
+                  coerce_value=bench_coerce_value, parser=bench_parser)
+
+
+def run(args):
+    engine, nodes = model.setup(roots=args.roots, depth=args.depth,
+                                fanout=args.fanout, cycles=args.cycles,
+                                seed=args.seed)
+    only = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = []
+    try:
+        for name in only:
+            results.extend(BENCHMARKS[name](engine, args))
+    finally:
+        engine.dispose()
+    return dict(
+        meta=dict(python=platform.python_version(),
+                  implementation=platform.python_implementation(),
+                  sqlalchemy=sqlalchemy.__version__,
+                  simplejson=simplejson.__version__,
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  config=dict(roots=args.roots, depth=args.depth,
+                              fanout=args.fanout, cycles=args.cycles,
+                              seed=args.seed, repeat=args.repeat),
+                  nodes=nodes),
+        results=results)
+
+
+def parse_args(argv=None):
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument('--roots', type=int, default=10)
+    args.add_argument('--depth', type=int, default=3)
+    args.add_argument('--fanout', type=int, default=4)
+    args.add_argument('--cycles', type=float, default=0.1)
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--repeat', type=int, default=5)
+    args.add_argument('--only', default=None,
+                      help=f'comma separated, from {", ".join(BENCHMARKS)}')
+    args.add_argument('--output', default=None)
+    return args.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    for row in results['results']:
+        print(f"{row['seconds'] * 1e6:12.1f} us  {row['name']}",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
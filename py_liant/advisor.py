@@ -0,0 +1,197 @@
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Mapper, RelationshipProperty, Session
+
+log = logging.getLogger(__name__)
+
+_environ_key = 'py_liant.load_advisor'
+
+
+def _path(path):
+    # relationship path of a loader path as ((key, hint op), ...); collections
+    # are suggested as selectin loads, scalars as joined loads
+    return tuple((item.key, '*' if item.uselist else '+') for item in path.path
+                 if isinstance(item, RelationshipProperty))
+
+
+def path_text(path):
+    return '.'.join(key for key, op in path)
+
+
+def format_hints(paths):
+    # hints (hints_parser syntax) eagerly loading all given paths
+    tree = dict()
+    for path in paths:
+        node = tree
+        for key, op in path:
+            node = node.setdefault((key, op), dict())
+
+    def _render(node):
+        return ','.join(
+            f'{op}{key}' + (f'({_render(children)})' if children else '')
+            for (key, op), children in sorted(node.items()))
+    return _render(tree)
+
+
+class _RequestLoads:
+    def __init__(self, verb):
+        self.verb = verb
+        # path of the lazy load whose rows are being loaded and its loader
+        # path, which may be included in the loaded instances' load_path
+        self.prefix = self.loader = ()
+        # relationship path of each instance loaded during the request
+        self.paths = dict()
+        # [queries, rows] by path
+        self.lazy = dict()
+        self.lazy_loaded = set()
+        # eager loaded collections, taken when serialization starts
+        self.eager = None
+        self.serialized = set()
+
+    def snapshot_eager(self):
+        self.eager = {(state, key) for state in self.paths
+                      for key, prop in state.mapper.relationships.items()
+                      if prop.uselist and key in state.dict and
+                      (state, key) not in self.lazy_loaded}
+
+
+def record_serialized(request, obj, value):
+    # called by JSONEncoder for every object it serializes
+    loads = request.environ.get(_environ_key)
+    if loads is None:
+        return
+    if loads.eager is None:
+        loads.snapshot_eager()
+    state = inspect(obj)
+    relationships = state.mapper.relationships
+    loads.serialized.update((state, key) for key in value
+                            if key in relationships)
+
+
+class LoadAdvisor:
+    '''
+    Records the lazy loads issued while views with `load_advisor` set handle
+    a request (serialization included), grouped by route verb and
+    relationship path, and suggests hints loading them eagerly. Collections
+    loaded eagerly but left out of the JSON output are reported as well.
+
+    Call listen() once; results are available from report(), suggestions()
+    and unused_eager() and each request with findings logs a line.
+    '''
+
+    def __init__(self, logger=log, target=Session):
+        self.logger = logger
+        self.target = target
+        self._info_key = f'py_liant.load_advisor.{id(self)}'
+        self._lock = threading.Lock()
+        self.lazy = dict()
+        self.unused = dict()
+
+    def listen(self):
+        event.listen(self.target, 'do_orm_execute', self._execute)
+        event.listen(Mapper, 'load', self._load)
+
+    def remove(self):
+        event.remove(self.target, 'do_orm_execute', self._execute)
+        event.remove(Mapper, 'load', self._load)
+
+    def start(self, request, verb):
+        session = getattr(request.dbsession, 'sync_session',
+                          request.dbsession)
+        if self._info_key in session.info:
+            return
+        loads = session.info[self._info_key] = _RequestLoads(verb)
+        request.environ[_environ_key] = loads
+        request.add_finished_callback(
+            lambda request: self.finish(session, loads))
+
+    def _load(self, target, context):
+        loads = context.session.info.get(self._info_key)
+        if loads is not None:
+            state = inspect(target)
+            path = _path(state.load_path)
+            if loads.loader and path[:len(loads.loader)] == loads.loader:
+                path = path[len(loads.loader):]
+            loads.paths.setdefault(state, loads.prefix + path)
+
+    def _execute(self, orm_execute_state):
+        loads = orm_execute_state.session.info.get(self._info_key)
+        parent = orm_execute_state.lazy_loaded_from
+        if loads is None or parent is None:
+            return None
+        loader = _path(orm_execute_state.loader_strategy_path)
+        path = loads.paths.get(parent, _path(parent.load_path)) + loader[-1:]
+        loads.lazy_loaded.add((parent, loader[-1][0]))
+        # rows are loaded while freezing, so they get the lazy load's path
+        previous = loads.prefix, loads.loader
+        loads.prefix, loads.loader = path, loader
+        try:
+            frozen = orm_execute_state.invoke_statement().freeze()
+        finally:
+            loads.prefix, loads.loader = previous
+        counters = loads.lazy.setdefault(path, [0, 0])
+        counters[0] += 1
+        counters[1] += len(frozen.data)
+        return frozen()
+
+    def finish(self, session, loads):
+        session.info.pop(self._info_key, None)
+        unused = set()
+        if loads.eager is not None:
+            unused = {loads.paths[state] + ((key, '*'),)
+                      for state, key in loads.eager
+                      if (state, key) not in loads.serialized}
+        with self._lock:
+            for path, (queries, rows) in loads.lazy.items():
+                stats = self.lazy.setdefault(
+                    (loads.verb, path), dict(queries=0, rows=0, requests=0))
+                stats['queries'] += queries
+                stats['rows'] += rows
+                stats['requests'] += 1
+            for path in unused:
+                key = (loads.verb, path)
+                self.unused[key] = self.unused.get(key, 0) + 1
+        if loads.lazy:
+            self.logger.info(
+                '%s: %d lazy loads (%d rows) on %s; suggested hints: %s',
+                loads.verb, sum(_[0] for _ in loads.lazy.values()),
+                sum(_[1] for _ in loads.lazy.values()),
+                ', '.join(sorted(map(path_text, loads.lazy))),
+                format_hints(loads.lazy))
+        if unused:
+            self.logger.info('%s: eager loads never serialized: %s',
+                             loads.verb,
+                             ', '.join(sorted(map(path_text, unused))))
+
+    def report(self):
+        # lazy loads by verb and path, most queries first
+        with self._lock:
+            items = list(self.lazy.items())
+        return sorted((dict(verb=verb, path=path_text(path),
+                            hint=format_hints([path]), **stats)
+                       for (verb, path), stats in items),
+                      key=lambda _: (-_['queries'], _['verb'], _['path']))
+
+    def suggestions(self):
+        # hints by verb, eagerly loading everything that was lazy loaded
+        with self._lock:
+            keys = list(self.lazy)
+        paths = dict()
+        for verb, path in keys:
+            paths.setdefault(verb, []).append(path)
+        return {verb: format_hints(items) for verb, items in paths.items()}
+
+    def unused_eager(self):
+        with self._lock:
+            items = list(self.unused.items())
+        return sorted((dict(verb=verb, path=path_text(path), requests=count)
+                       for (verb, path), count in items),
+                      key=lambda _: (_['verb'], _['path']))
+
+    def reset(self):
+        with self._lock:
+            self.lazy.clear()
+            self.unused.clear()
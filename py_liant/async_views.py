@@ -0,0 +1,220 @@
+from time import perf_counter
+
+from sqlalchemy.orm.exc import NoResultFound, StaleDataError
+from sqlalchemy.orm.util import AliasedClass
+
+from pyramid.httpexceptions import HTTPConflict, HTTPNotFound, HTTPOk
+
+from .metrics import count_seconds, metrics, request_verb, rows_returned
+from .monkeypatch import _polymorphic_constructor
+from .parallel import count_statement
+from .pyramid import CatchallView, CRUDView, VersionCheckError
+
+# Views built on SQLAlchemy's AsyncSession: request.dbsession is expected to
+# be an AsyncSession and view methods are coroutines, to be awaited by an
+# asyncio capable host. Queries are still built with the (sessionless) Query
+# API so filters, orderings, hints and profiles work unchanged; they are
+# executed as statements on the async session. Code that relies on lazy
+# loading (object getters, apply_changes) runs through AsyncSession.run_sync.
+# Writes are committed on the session itself instead of transaction.manager.
+
+
+class AsyncCRUDView(CRUDView):
+    @property
+    def dbsession(self):
+        return self.request.dbsession
+
+    def get_base_query(self):
+        return self.dbsession.sync_session.query(self.target_type)
+
+    async def get_one_from_query(self, query):
+        query = query.filter(self.context_filter, self.identity_filter)
+        result = await self.dbsession.execute(query.statement)
+        return result.unique().scalar_one()
+
+    async def get_by_id(self, update_lock=False):
+        try:
+            query = self.get_identity_base()
+            if update_lock:
+                if isinstance(self.target_type, AliasedClass):
+                    query = query.with_for_update(of=self.target_type)
+                else:
+                    query = query.with_for_update()
+            return await self.get_one_from_query(query)
+        except NoResultFound:
+            raise HTTPNotFound()
+
+    async def count(self, query):
+        start = perf_counter()
+        count = await self.dbsession.scalar(count_statement(query))
+        if metrics.enabled:
+            count_seconds.observe(perf_counter() - start, ('sequential',))
+        return count
+
+    def get_search_query(self, query=None):
+        # returns the filtered query (used for counting) and the ordered,
+        # paged query for the results
+        if query is None:
+            query = self.get_list_base().filter(self.context_filter)
+        query = query.filter(*self.query_filters)
+        pager = self.pager_slice
+
+        items_query = query
+        if self.use_subquery_after_filter:
+            subquery = query.subquery()
+            self.accept_order = dict(subquery.c)
+            items_query = self.dbsession.sync_session.query(*subquery.c)
+
+        order_clauses = self.order_clauses
+        if order_clauses is not None:
+            items_query = items_query.order_by(None).order_by(*order_clauses)
+        if pager:
+            items_query = items_query.slice(pager.start, pager.stop)
+        return query, items_query
+
+    async def get_search_results(self, query=None):
+        query, items_query = self.get_search_query(query)
+        count = await self.count(query)
+        result = await self.dbsession.execute(items_query.statement)
+        if items_query.is_single_entity:
+            items = result.unique().scalars().all()
+        else:
+            items = result.all()
+        return items, count
+
+    async def get(self):
+        return {self.target_name: await self.get_by_id()}
+
+    async def list(self):
+        items, count = await self.get_search_results()
+        if metrics.enabled:
+            rows_returned.observe(len(items), (request_verb(self.request),))
+        return dict(items=items, total=count)
+
+    async def aggregate(self):
+        result = await self.dbsession.execute(
+            self.get_aggregate_query().statement)
+        return dict(items=[row._asdict() for row in result])
+
+    async def list_stream(self):
+        # like list, but items is an async iterable reading from a server
+        # side cursor; encode with JSONEncoder.aiterencode
+        query, items_query = self.get_search_query()
+        count = await self.count(query)
+        result = await self.dbsession.stream(items_query.statement)
+        if items_query.is_single_entity:
+            result = result.unique().scalars()
+        return dict(items=result, total=count)
+
+    async def apply_changes(self, obj, data, for_update=True):
+        # relationship reconciliation loads collections lazily, so the whole
+        # operation runs in the session's greenlet
+        def _apply(session):
+            with session.no_autoflush:
+                CRUDView.apply_changes(self, obj, data, for_update)
+        await self.dbsession.run_sync(_apply)
+
+    async def commit(self, obj=None):
+        # obj (the result of a write) is refreshed before the commit and
+        # keeps its state through it
+        if obj is None:
+            await self.dbsession.commit()
+            return
+        await self.dbsession.run_sync(
+            lambda session: self.refresh_result(obj))
+        with self.keep_loaded(self.dbsession.sync_session):
+            await self.dbsession.commit()
+
+    async def update(self):
+        try:
+            try:
+                old = await self.get_by_id(update_lock=self.update_lock)
+                values = self.sanitize_input()
+                try:
+                    await self.apply_changes(old, values, True)
+                except VersionCheckError as ex:
+                    raise HTTPConflict(str(ex))
+                await self.commit(old)
+            except BaseException:
+                await self.dbsession.rollback()
+                raise
+        except StaleDataError as ex:
+            raise HTTPConflict(str(ex))
+        return old
+
+    async def insert(self):
+        values = self.sanitize_input()
+        obj = _polymorphic_constructor(self.target_type, values)
+        try:
+            self.dbsession.add(obj)
+            await self.apply_changes(obj, values, False)
+            await self.commit(obj)
+        except BaseException:
+            await self.dbsession.rollback()
+            raise
+        return {self.target_name: obj}
+
+    async def delete(self):
+        try:
+            old = await self.get_by_id()
+            await self.dbsession.delete(old)
+            await self.commit()
+        except BaseException:
+            await self.dbsession.rollback()
+            raise
+        return HTTPOk()
+
+    async def bulk_delete(self, query):
+        # query is built on the session's sync_session; objects deleted one
+        # by one may load their relationships
+        return await self.dbsession.run_sync(
+            lambda session: CRUDView.bulk_delete(self, query))
+
+
+class AsyncCatchallView(AsyncCRUDView, CatchallView):
+    # the query comes from CatchallPredicate, built on the async session's
+    # sync_session
+
+    def get_base_query(self):
+        return self.query
+
+    async def get_one_from_query(self, query):
+        if self.getter is None:
+            raise HTTPNotFound()
+        query = query.filter(*self.query_filters)
+        order_clauses = self.order_clauses
+        if order_clauses is not None:
+            query = query.order_by(None).order_by(*order_clauses)
+        return await self.dbsession.run_sync(
+            lambda session: self.getter(query.with_session(session)))
+
+    async def delete_list(self):
+        if not self.allow_list_delete or self.slicer is not None:
+            raise HTTPNotFound()
+        query = self.delete_list_query()
+        try:
+            count = await self.bulk_delete(query)
+            await self.commit()
+        except BaseException:
+            await self.dbsession.rollback()
+            raise
+        return dict(deleted=count)
+
+    async def process(self):
+        if self.request.method == 'GET':
+            if self.getter is not None:
+                return await self.get()
+            if self.is_aggregate:
+                if self.slicer is not None:
+                    raise HTTPNotFound()
+                return await self.aggregate()
+            return await self.list()
+        elif self.request.method == 'POST':
+            if self.getter is not None:
+                return await self.update()
+            return await self.insert()
+        elif self.request.method == 'DELETE':
+            if self.getter is None:
+                return await self.delete_list()
+            return await self.delete()
+        raise HTTPNotFound()
@@ -0,0 +1,98 @@
+import io
+
+from pyramid.httpexceptions import HTTPBadRequest, HTTPException, HTTPNotFound
+from pyramid.request import Request
+
+from . import advisor, replicas
+from .pyramid import CatchallPredicate, CatchallView
+
+# Batched catchall reads. The body is a JSON array of catchall routes with
+# optional query strings, e.g. ["order@12:*lines", "customer@3",
+# "country?pageSize=300"]; they run in order through `view_class` on the
+# request's session (and so in one read transaction; with a replica_router,
+# on one replica session) and the response holds
+# their results in the same order. The results are encoded together, so an
+# entity appearing in several of them is written once and referenced with
+# `_ref` elsewhere.
+#
+# Usage:
+#     class ApiBatch(BatchView):
+#         targets = {'order': Order, 'customer': Customer}
+#
+#     config.add_route('batch', '/api/_batch')
+#     config.add_view(ApiBatch, attr='process', route_name='batch',
+#                     request_method='POST', renderer='json')
+
+
+class BatchView:
+    # catchall targets, as given to the catchall view predicate
+    targets = None
+    view_class = CatchallView
+    max_requests = 20
+    # per-request state kept in the environ by the view's helpers, shared by
+    # the whole batch: the replica session and the load advisor's records
+    shared_environ = (replicas._environ_key, advisor._environ_key)
+
+    def __init__(self, request):
+        self.request = request
+        self.context = request.context
+
+    @classmethod
+    def predicate(cls):
+        # one predicate per subclass; it keeps the parsed routes' query plans
+        predicate = cls.__dict__.get('_predicate')
+        if predicate is None:
+            predicate = CatchallPredicate(cls.targets, None)
+            cls._predicate = predicate
+        return predicate
+
+    def subrequest(self, route):
+        # a GET on `route` with the caller's environ and headers, so that the
+        # identity, client address and tenant (py_liant.tenant) carry over
+        path, _, query = route.partition('?')
+        environ = dict(self.request.environ)
+        for key in list(environ):
+            # values parsed from the caller's request
+            if key.startswith('webob.') or key == 'py_liant.catchall':
+                del environ[key]
+        environ.update(REQUEST_METHOD='GET', PATH_INFO='/' + path.lstrip('/'),
+                       QUERY_STRING=query, CONTENT_LENGTH='0',
+                       **{'wsgi.input': io.BytesIO()})
+        environ.pop('CONTENT_TYPE', None)
+        request = Request(environ)
+        request.registry = self.request.registry
+        request.dbsession = self.request.dbsession
+        request.context = self.context
+        request.matchdict = dict(catchall=request.path_info[1:])
+        # sessions opened for the sub-request are used until the batch is
+        # encoded, so they are closed when the caller's request finishes
+        request.add_finished_callback = self.request.add_finished_callback
+        return request
+
+    def run(self, route):
+        request = self.subrequest(route)
+        if not self.predicate()(self.context, request):
+            raise HTTPNotFound()
+        try:
+            return self.view_class(request).process()
+        finally:
+            # the next sub-requests copy them from the caller's environ
+            for key in self.shared_environ:
+                if key in request.environ:
+                    self.request.environ.setdefault(key, request.environ[key])
+
+    def process(self):
+        routes = self.request.json
+        if not isinstance(routes, list) or \
+                not all(isinstance(route, str) for route in routes):
+            raise HTTPBadRequest('expected an array of routes')
+        if len(routes) > self.max_requests:
+            raise HTTPBadRequest(
+                f'at most {self.max_requests} requests per batch')
+        results = []
+        for route in routes:
+            try:
+                results.append(dict(status=200, body=self.run(route)))
+            except HTTPException as ex:
+                results.append(dict(status=ex.code, error=ex.title))
+        return dict(results=results)
@@ -0,0 +1,241 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session
+
+
+class LRUCache:
+    '''
+    Bounded mapping with least-recently-used eviction and an optional
+    time-to-live (in seconds) for its entries.
+    '''
+    hits = 0
+    misses = 0
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self._evicted(key, value)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None \
+            else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                self._evicted(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            _, value = self._data.pop(key)
+            self._evicted(key, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evicted(self, key, value):
+        # hook for subclasses, called with the lock held
+        pass
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, tags=()):
+        pass
+
+    @abstractmethod
+    def invalidate(self, tags):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class _TaggedLRUCache(LRUCache):
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.tags = dict()
+        # entries and their tag index change together
+        self._lock = threading.RLock()
+
+    def set_tagged(self, key, value, tags):
+        with self._lock:
+            self.set(key, (value, tags))
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.tags.clear()
+
+    def _evicted(self, key, value):
+        for tag in value[1]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+
+
+class MemoryCacheBackend(CacheBackend):
+    '''
+    In-process cache backend; entries are evicted in LRU order once `maxsize`
+    is reached and expire after `ttl` seconds.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self._cache = _TaggedLRUCache(maxsize, ttl)
+
+    def get(self, key):
+        value = self._cache.get(key)
+        return None if value is None else value[0]
+
+    def set(self, key, value, tags=()):
+        self._cache.set_tagged(key, value, tuple(tags))
+
+    def invalidate(self, tags):
+        self._cache.invalidate(tags)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def class_tag(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+class ResultCache:
+    '''
+    Cache for CRUDView listing results. Entries hold the primary keys of the
+    page being returned together with the total count and are tagged with the
+    listed class; committing a session that inserted, updated or deleted
+    instances of a class drops all entries tagged with it (or any of its
+    base classes).
+    '''
+    hits = 0
+    misses = 0
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None \
+            else MemoryCacheBackend()
+        self._info_key = f'py_liant.result_cache.{id(self)}'
+
+    @staticmethod
+    def make_key(*parts):
+        return repr(parts)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, classes):
+        self.backend.set(key, value, [class_tag(inspect(cls).class_)
+                                      for cls in classes])
+
+    def invalidate(self, classes):
+        self.backend.invalidate([class_tag(cls) for cls in classes])
+
+    def listen(self, target=Session):
+        event.listen(target, 'after_flush', self._after_flush)
+        event.listen(target, 'after_bulk_update', self._after_bulk)
+        event.listen(target, 'after_bulk_delete', self._after_bulk)
+        event.listen(target, 'after_commit', self._after_commit)
+        event.listen(target, 'after_soft_rollback', self._after_rollback)
+
+    def _pending(self, session):
+        return session.info.setdefault(self._info_key, set())
+
+    def _after_flush(self, session, flush_context):
+        pending = self._pending(session)
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            pending.update(m.class_ for m in
+                           inspect(type(obj)).iterate_to_root())
+
+    def _after_bulk(self, context):
+        self._pending(context.session).update(
+            m.class_ for m in context.mapper.iterate_to_root())
+
+    def _after_commit(self, session):
+        pending = session.info.pop(self._info_key, None)
+        if pending:
+            self.invalidate(pending)
+
+    def _after_rollback(self, session, previous_transaction):
+        # a savepoint rolling back keeps what the enclosing transaction
+        # flushed before it
+        if not previous_transaction.nested:
+            session.info.pop(self._info_key, None)
+
+
+class StatementCacheStats:
+    '''
+    Counts how statements executed on an engine used SQLAlchemy's compiled
+    statement cache: `hits`, `misses` and `uncached` (textual statements,
+    caching disabled or statements without a cache key).
+    '''
+
+    def __init__(self):
+        self.hits = self.misses = self.uncached = 0
+
+    def listen(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._execute)
+
+    def _execute(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        cache_hit = getattr(context, 'cache_hit', None)
+        if cache_hit is CACHE_HIT:
+            self.hits += 1
+        elif cache_hit is CACHE_MISS:
+            self.misses += 1
+        else:
+            self.uncached += 1
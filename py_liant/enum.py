@@ -1,20 +1,64 @@
 import re
-from sqlalchemy.types import SchemaType, TypeDecorator, Enum
+from sqlalchemy.types import SchemaType, SmallInteger, TypeDecorator, Enum
 
 
-def EnumAttrs(name, schema=None):
+def EnumAttrs(name, schema=None, codes=None):
+    # codes: stable SmallInteger code by member name, for
+    # PythonEnum(..., storage='smallint')
     def f(cls):
         if schema is not None:
             cls.__db_schema = schema
+        if codes is not None:
+            cls.__db_codes = dict(codes)
         cls.__db_name = name
         return cls
     return f
 
 
+def enum_codes(enum_class):
+    # declared codes by member, validated
+    codes = getattr(enum_class, "__db_codes", None)
+    if codes is None:
+        raise ValueError(f'{enum_class!r} declares no codes, see EnumAttrs')
+    members = {m.name for m in enum_class}
+    if set(codes) != members:
+        raise ValueError(f'codes of {enum_class!r} must cover exactly its '
+                         f'members {sorted(members)!r}')
+    if len(set(codes.values())) != len(codes):
+        raise ValueError(f'duplicate codes in {enum_class!r}')
+    if not all(-32768 <= code <= 32767 for code in codes.values()):
+        raise ValueError(f'codes of {enum_class!r} must fit a smallint')
+    return {m: codes[m.name] for m in enum_class}
+
+
 class PythonEnum(TypeDecorator, SchemaType):
+    '''
+    Stores members of `enum_class` by name in an Enum column or, with
+    storage='smallint', by the codes declared through EnumAttrs.
+    '''
     impl = Enum
+    storages = ('enum', 'smallint')
+    # cache keys are made of enum_class and storage
+    cache_ok = True
 
-    def __init__(self, enum_class, **kw):
+    def __init__(self, enum_class, storage='enum', **kw):
+        if storage not in self.storages:
+            raise ValueError(f'unknown storage {storage!r}')
+        self.storage = storage
+        self.enum_class = enum_class
+        self._kw = kw
+        if storage == 'smallint':
+            codes = enum_codes(enum_class)
+            # codes by member and member name; members by code, in a list
+            # when the codes are small non-negative integers
+            self._codes = dict(codes)
+            self._codes.update((m.name, code) for m, code in codes.items())
+            self._members = {code: m for m, code in codes.items()}
+            if min(codes.values()) >= 0 and max(codes.values()) < 1024:
+                self._members = [self._members.get(code)
+                                 for code in range(max(codes.values()) + 1)]
+            self.impl = SmallInteger()
+            return
         if hasattr(enum_class, "__db_name") and 'name' not in kw:
             kw['name'] = getattr(enum_class, "__db_name")
         if hasattr(enum_class, "__db_schema") and 'schema' not in kw:
@@ -25,26 +69,75 @@ class PythonEnum(TypeDecorator, SchemaType):
                                          enum_class.__name__)
         self.impl = Enum(*(m.name for m in enum_class), **kw)
         # super().__init__(*(m.name for m in enum_class), **kw)
-        self._enum_class = enum_class
 
     def process_bind_param(self, value, dialect):
-        if isinstance(value, self._enum_class):
+        if self.storage == 'smallint':
+            if value is None or type(value) is int:
+                return value
+            try:
+                # members and member names
+                return self._codes[value]
+            except KeyError:
+                raise ValueError(
+                    f'{value!r} is not a member of {self.enum_class!r}')
+        if isinstance(value, self.enum_class):
             return value.name
         return value
 
     def process_result_value(self, value, dialect):
         if value is not None:
-            return self._enum_class[value]
+            if self.storage == 'smallint':
+                if type(self._members) is list:
+                    member = self._members[value] \
+                        if 0 <= value < len(self._members) else None
+                else:
+                    member = self._members.get(value)
+                if member is None:
+                    raise LookupError(
+                        f'{value!r} is not a code of {self.enum_class!r}')
+                return member
+            return self.enum_class[value]
 
     @property
     def python_type(self):
-        return self._enum_class
+        return self.enum_class
 
     def copy(self):
-        return PythonEnum(self._enum_class)
+        return PythonEnum(self.enum_class, self.storage, **self._kw)
 
     def _set_table(self, table, column):
-        self.impl._set_table(table, column)
+        if self.storage == 'enum':
+            self.impl._set_table(table, column)
 
     def __repr__(self):
+        if self.storage == 'smallint':
+            return f'PythonEnum({self.enum_class.__name__}, ' \
+                "storage='smallint')"
         return repr(self.impl)
+
+
+def smallint_migration(table, column, enum_class, schema=None,
+                       reverse=False):
+    '''
+    PostgreSQL statement converting `column` of `table` between the named
+    enum storage and the SmallInteger codes declared for `enum_class`
+    (reverse=True converts back to the enum type); run it from a migration,
+    e.g. op.execute(smallint_migration('fact', 'kind', Kind)).
+    '''
+    from sqlalchemy.dialects import postgresql
+    preparer = postgresql.dialect().identifier_preparer
+    target = preparer.quote(table)
+    if schema is not None:
+        target = f'{preparer.quote_schema(schema)}.{target}'
+    name = preparer.quote(column)
+    codes = enum_codes(enum_class)
+    if reverse:
+        type_name = preparer.format_type(PythonEnum(enum_class).impl)
+        cases = ' '.join(f"WHEN {code} THEN '{m.name}'"
+                         for m, code in codes.items())
+        return f'ALTER TABLE {target} ALTER COLUMN {name} TYPE {type_name} ' \
+            f'USING (CASE {name} {cases} END)::{type_name}'
+    cases = ' '.join(f"WHEN '{m.name}' THEN {code}"
+                     for m, code in codes.items())
+    return f'ALTER TABLE {target} ALTER COLUMN {name} TYPE smallint ' \
+        f'USING CASE {name}::text {cases} END'
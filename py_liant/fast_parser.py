@@ -0,0 +1,199 @@
+import re
+
+# Hand-written equivalent of the pyparsing grammar in py_liant.parser; it
+# returns the same structures as parser.parse_route and parser.parse_hints.
+# Like pyparsing it expands tabs, skips whitespace before every token and
+# never backtracks into an optional element that matched.
+
+_whitespace = re.compile(r'[ \n\r]*')
+_fieldname = re.compile(r'[A-Za-z][A-Za-z0-9_]*')
+_pkey = re.compile(r'[A-Za-z0-9_\- ]+')
+_integer = re.compile(r'[\-0-9][0-9]*')
+
+
+class ParseError(ValueError):
+    def __init__(self, value, pos, expected):
+        super().__init__(value, pos, expected)
+        self.value, self.pos, self.expected = value, pos, expected
+
+    def __str__(self):
+        return f'Expected {self.expected} at char {self.pos} in ' \
+            f'{self.value!r}'
+
+
+class _Parser:
+    def __init__(self, value):
+        if '\t' in value:
+            value = value.expandtabs()
+        self.value = value
+        self.pos = 0
+
+    def fail(self, expected):
+        raise ParseError(self.value, self.pos, expected)
+
+    def skip(self):
+        self.pos = _whitespace.match(self.value, self.pos).end()
+
+    def literal(self, char):
+        # consumes char (after whitespace) if present
+        self.skip()
+        if self.value.startswith(char, self.pos):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.literal(char):
+            self.fail(repr(char))
+
+    def token(self, regex, expected):
+        self.skip()
+        match = regex.match(self.value, self.pos)
+        if match is None:
+            self.fail(expected)
+        self.pos = match.end()
+        return match.group()
+
+    def fieldname(self):
+        return self.token(_fieldname, 'field name')
+
+    def optional(self, func, char=None):
+        # runs func (if the next token is char); restores position and
+        # returns None if func fails
+        pos = self.pos
+        if char is not None and not self.literal(char):
+            self.pos = pos
+            return None
+        self.pos = pos
+        try:
+            return func()
+        except ParseError:
+            self.pos = pos
+            return None
+
+    def delimited(self, func):
+        ret = [func()]
+        while True:
+            pos = self.pos
+            if not self.literal(','):
+                self.pos = pos
+                return ret
+            try:
+                ret.append(func())
+            except ParseError:
+                self.pos = pos
+                return ret
+
+    def end(self):
+        self.skip()
+        if self.pos != len(self.value):
+            self.fail('end of text')
+
+    # hints: delimited list of -field, +field, *field optionally followed by
+    # (hints) and !type(hints without casts)
+
+    def hints(self, cast=True):
+        return tuple(self.delimited(lambda: self.hint(cast)))
+
+    def hint(self, cast=True):
+        self.skip()
+        op = self.value[self.pos:self.pos + 1]
+        if op == '-':
+            self.pos += 1
+            return {'op': op, 'name': self.fieldname()}
+        if op in ('+', '*'):
+            self.pos += 1
+            ret = {'op': op, 'name': self.fieldname()}
+            children = self.optional(self.children, '(')
+            if children is not None:
+                ret['children'] = children
+            return ret
+        if op == '!' and cast:
+            self.pos += 1
+            ret = {'op': op, 'type': self.fieldname()}
+            self.expect('(')
+            ret['children'] = self.hints(False)
+            self.expect(')')
+            return ret
+        self.fail('hint')
+
+    def children(self):
+        self.expect('(')
+        ret = self.hints()
+        self.expect(')')
+        return ret
+
+    # route: verb!cast@pkey,pkey/drilldown!cast[slice]:profile:hints
+
+    def route(self):
+        route = {'verb': self.fieldname()}
+        cast = self.optional(self.cast, '!')
+        if cast is not None:
+            route['cast'] = cast
+        pkey = self.optional(self.pkey, '@')
+        if pkey is not None:
+            route['pkey'] = pkey
+        drilldown = self.optional(self.drilldown, '/')
+        if drilldown is not None:
+            route.update(drilldown)
+        slicer = self.optional(self.slice, '[')
+        if slicer is not None:
+            route['slice'] = slicer
+        profile = self.optional(self.profile, ':')
+        if profile is not None:
+            route['profile'] = profile
+        hints = self.optional(self.route_hints, ':')
+        if hints is not None:
+            route['hints'] = hints
+        return route
+
+    def cast(self):
+        self.expect('!')
+        return self.fieldname()
+
+    def pkey(self):
+        self.expect('@')
+        return tuple(self.delimited(lambda: self.token(_pkey, 'key')))
+
+    def drilldown(self):
+        self.expect('/')
+        ret = {'drilldown': self.fieldname()}
+        cast = self.optional(self.cast, '!')
+        if cast is not None:
+            ret['drilldown_cast'] = cast
+        return ret
+
+    def slice(self):
+        self.expect('[')
+        ret = self.optional(self.range)
+        if ret is None:
+            ret = {'index': self.token(_integer, 'integer')}
+        self.expect(']')
+        return ret
+
+    def range(self):
+        start = self.token(_integer, 'integer')
+        self.expect(':')
+        return {'start': start, 'stop': self.token(_integer, 'integer')}
+
+    def profile(self):
+        self.expect(':')
+        return self.fieldname()
+
+    def route_hints(self):
+        self.expect(':')
+        return self.hints()
+
+
+def parse_hints(value):
+    parser = _Parser(value)
+    ret = parser.hints()
+    parser.end()
+    return ret
+
+
+def parse_route(value):
+    parser = _Parser(value)
+    ret = parser.route()
+    parser.end()
+    return ret
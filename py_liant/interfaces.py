@@ -17,3 +17,30 @@ class JsonGuardProvider(ABC):
     @abstractmethod
     def guardDrilldown(self, prop):
         pass
+
+    def guardAggregate(self, cls, group, aggregates) -> bool:
+        # optional: group and aggregates map result names to the grouped
+        # columns and aggregate expressions; return a falsey value to refuse
+        return True
+
+    def guardProfile(self, request) -> bool:
+        # optional: approve profiling the request (see py_liant.profiling)
+        return False
+
+    def guardSerializeBatch(self, cls, objects):
+        # optional: called before serialization with the objects of class
+        # `cls` about to be serialized (loaded ones only), so that their
+        # permissions can be fetched at once; guardSerialize still runs
+        pass
+
+    def guardUpdateBatch(self, cls, items):
+        # optional: called with the (obj, data, for_update) items of class
+        # `cls` an apply_changes call is about to update; guardUpdate still
+        # runs for each of them
+        pass
+
+
+def overrides(provider, name):
+    # whether `provider` implements the optional method `name`
+    return getattr(type(provider), name, None) is not \
+        getattr(JsonGuardProvider, name)
@@ -1,35 +1,94 @@
 import simplejson
+from simplejson.encoder import encode_basestring, encode_basestring_ascii
 from datetime import (datetime, date, time, timedelta)
-from isodate import duration_isoformat
+from decimal import Decimal
 from sqlalchemy.inspection import inspect
 from sqlalchemy.ext.hybrid import HYBRID_METHOD
 from sqlalchemy.ext.associationproxy import ASSOCIATION_PROXY
 import base64
 from enum import Enum
 import uuid
-from .interfaces import JsonGuardProvider
+from .advisor import record_serialized
+from .interfaces import JsonGuardProvider, overrides
 from .json_object import JsonObject, JsonOrderedObject
 
 
 class JSONEncoder(simplejson.JSONEncoder):
     request = None
+    context = None
     obj_index = None
     base_type = None
     counter = 0
     sort = False
+    iterative = False
 
-    def __init__(self, request=None, base_type=None, sort=False, **kwargs):
+    def __init__(self, request=None, base_type=None, sort=False,
+                 iterative=False, **kwargs):
         super().__init__(encoding=None, **kwargs)
         self.request = request
+        # taken now: streamed responses are encoded after pyramid has
+        # dropped request.context
+        self.context = getattr(request, 'context', None)
         self.obj_index = dict()
         self.base_type = base_type
         self.sort = sort
+        self.iterative = iterative
+
+    def iterencode(self, o):
+        self.guard_batches(o)
+        if self.iterative:
+            return self._iterencode_iterative(o)
+        return super().iterencode(o)
+
+    def batch_guard(self):
+        # the request's guard, if it authorizes objects by class
+        context = self.context
+        if self.base_type is None or \
+                not isinstance(context, JsonGuardProvider) or \
+                not overrides(context, 'guardSerializeBatch'):
+            return None
+        return context
+
+    def guard_batches(self, o):
+        # lets the request's guard authorize the objects in `o` by class
+        context = self.batch_guard()
+        if context is None:
+            return
+        for cls, objects in self.collect_objects(o).items():
+            context.guardSerializeBatch(cls, objects)
+
+    def collect_objects(self, o):
+        # objects reachable from `o` through containers and loaded
+        # relationships, by class; already serialized ones are left out
+        ret = {}
+        seen = set()
+        stack = [o]
+        while stack:
+            o = stack.pop()
+            if isinstance(o, self.base_type):
+                if id(o) in seen:
+                    continue
+                seen.add(id(o))
+                state = inspect(o)
+                if state.identity is not None and \
+                        (type(o),) + state.identity in self.obj_index:
+                    continue
+                ret.setdefault(type(o), []).append(o)
+                for key in state.mapper.relationships.keys():
+                    if key in state.dict:
+                        stack.append(state.dict[key])
+            elif isinstance(o, dict):
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple, set, frozenset)):
+                stack.extend(o)
+        return ret
 
     def default(self, o):
         # handle date and time format
         if isinstance(o, (datetime, date, time)):
             return o.isoformat()
         if isinstance(o, timedelta):
+            from isodate import duration_isoformat
             return duration_isoformat(o)
 
         # bytes
@@ -78,10 +137,218 @@ class JSONEncoder(simplejson.JSONEncoder):
             self.counter += 1
             ret['_id'] = self.counter
             self.obj_index[pk_index] = ret
-            if self.request is not None and isinstance(self.request.context,
-                                                       JsonGuardProvider):
-                self.request.context.guardSerialize(o, ret)
+            if isinstance(self.context, JsonGuardProvider):
+                self.context.guardSerialize(o, ret)
+            if self.request is not None:
+                record_serialized(self.request, o, ret)
             return ret
 
         # end of handled types, we cannot serialize this type
         return super().default(o)
+
+    def _floatstr(self, o):
+        if o != o:
+            text = 'NaN'
+        elif o == float('inf'):
+            text = 'Infinity'
+        elif o == float('-inf'):
+            text = '-Infinity'
+        else:
+            return float.__repr__(o)
+        if self.ignore_nan:
+            return 'null'
+        if not self.allow_nan:
+            raise ValueError(f'Out of range float values are not JSON '
+                             f'compliant: {o!r}')
+        return text
+
+    def _key(self, key):
+        if isinstance(key, str):
+            return key
+        if key is True:
+            return 'true'
+        if key is False:
+            return 'false'
+        if key is None:
+            return 'null'
+        if isinstance(key, float):
+            return self._floatstr(key)
+        if isinstance(key, (int, Decimal)):
+            return str(key)
+        if self.skipkeys:
+            return None
+        raise TypeError(f'keys must be str, int, float, bool or None, not '
+                        f'{type(key).__name__}')
+
+    def _iterencode_iterative(self, o):
+        # iterencode with an explicit stack of open containers instead of
+        # recursion: the cost is linear in the size of the output whatever
+        # the depth of the graph. Supports the simplejson options besides
+        # for_json, bigint_as_string, int_as_string_bitcount and
+        # iterable_as_array; default() is called in document order, so _id
+        # and _ref come out as with the recursive encoder
+        markers = {} if self.check_circular else None
+        encode_str = encode_basestring_ascii if self.ensure_ascii \
+            else encode_basestring
+        indent = self.indent
+        item_separator = self.item_separator
+        key_separator = self.key_separator
+        sort_key = self.item_sort_key or \
+            ((lambda kv: kv[0]) if self.sort_keys else None)
+        # frames: [items iterator, is dict, first item, marker ids]
+        stack = []
+        pending, has_pending = o, True
+        while True:
+            if not has_pending:
+                if not stack:
+                    return
+                frame = stack[-1]
+                item = next(frame[0], _done)
+                if item is _done:
+                    stack.pop()
+                    if indent is not None:
+                        yield '\n' + indent * len(stack)
+                    yield '}' if frame[1] else ']'
+                    if markers is not None:
+                        for marker in frame[3]:
+                            del markers[marker]
+                    continue
+                if frame[1]:
+                    key, pending = item
+                    text = self._key(key)
+                    if text is None:
+                        # skipkeys
+                        continue
+                else:
+                    pending = item
+                if frame[2]:
+                    frame[2] = False
+                else:
+                    yield item_separator
+                if indent is not None:
+                    yield '\n' + indent * len(stack)
+                if frame[1]:
+                    yield encode_str(text) + key_separator
+                has_pending = True
+                continue
+
+            value, has_pending = pending, False
+            marked = []
+            while True:
+                if isinstance(value, str):
+                    chunk = encode_str(value)
+                elif value is None:
+                    chunk = 'null'
+                elif value is True:
+                    chunk = 'true'
+                elif value is False:
+                    chunk = 'false'
+                elif isinstance(value, int):
+                    chunk = int.__repr__(value)
+                elif isinstance(value, float):
+                    chunk = self._floatstr(value)
+                elif self.use_decimal and isinstance(value, Decimal):
+                    chunk = str(value)
+                elif isinstance(value, dict) or \
+                        (isinstance(value, (list, tuple)) and not (
+                            self.namedtuple_as_object and
+                            hasattr(value, '_asdict'))):
+                    chunk = None
+                elif self.namedtuple_as_object and \
+                        callable(getattr(value, '_asdict', None)):
+                    value = value._asdict()
+                    continue
+                else:
+                    if markers is not None:
+                        if id(value) in markers:
+                            raise ValueError('Circular reference detected')
+                        markers[id(value)] = value
+                        marked.append(id(value))
+                    value = self.default(value)
+                    continue
+                break
+
+            if chunk is None:
+                is_dict = isinstance(value, dict)
+                if not value:
+                    chunk = '{}' if is_dict else '[]'
+                else:
+                    if markers is not None:
+                        if id(value) in markers:
+                            raise ValueError('Circular reference detected')
+                        markers[id(value)] = value
+                        marked.append(id(value))
+                    items = value.items() if is_dict else value
+                    if is_dict and sort_key is not None:
+                        # simplejson sorts stringified keys
+                        items = sorted(
+                            ((text, item) for text, item in (
+                                (self._key(key), item) for key, item in items)
+                             if text is not None), key=sort_key)
+                    stack.append([iter(items), is_dict, True, marked])
+                    yield '{' if is_dict else '['
+                    continue
+            if markers is not None:
+                for marker in marked:
+                    del markers[marker]
+            yield chunk
+
+    async def aiterencode(self, o):
+        # like iterencode, but also consumes async iterables (such as streamed
+        # AsyncResult objects) found in o or in the dicts and lists holding
+        # them; object references are shared across the whole output
+        if self.batch_guard() is not None:
+            # the guard authorizes the whole response at once, so streamed
+            # results are read before anything is encoded
+            for chunk in self.iterencode(await _collect(o)):
+                yield chunk
+        elif hasattr(o, '__aiter__'):
+            yield '['
+            first = True
+            async for item in o:
+                if not first:
+                    yield self.item_separator
+                first = False
+                async for chunk in self.aiterencode(item):
+                    yield chunk
+            yield ']'
+        elif isinstance(o, dict) and _has_async(o.values()):
+            yield '{'
+            for i, (key, value) in enumerate(o.items()):
+                if i:
+                    yield self.item_separator
+                yield self.encode(str(key))
+                yield self.key_separator
+                async for chunk in self.aiterencode(value):
+                    yield chunk
+            yield '}'
+        elif isinstance(o, (list, tuple)) and _has_async(o):
+            yield '['
+            for i, item in enumerate(o):
+                if i:
+                    yield self.item_separator
+                async for chunk in self.aiterencode(item):
+                    yield chunk
+            yield ']'
+        else:
+            for chunk in self.iterencode(o):
+                yield chunk
+
+
+# end of items marker for JSONEncoder._iterencode_iterative
+_done = object()
+
+
+def _has_async(values):
+    return any(hasattr(value, '__aiter__') for value in values)
+
+
+async def _collect(o):
+    # `o` with the async iterables aiterencode would consume read into lists
+    if hasattr(o, '__aiter__'):
+        return [await _collect(item) async for item in o]
+    if isinstance(o, dict) and _has_async(o.values()):
+        return {key: await _collect(value) for key, value in o.items()}
+    if isinstance(o, (list, tuple)) and _has_async(o):
+        return [await _collect(item) for item in o]
+    return o
@@ -0,0 +1,172 @@
+from enum import Enum
+
+from sqlalchemy import String
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import ColumnProperty, Mapper
+from sqlalchemy.orm.base import NOT_EXTENSION
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from pyramid.settings import asbool
+
+from .monkeypatch import coerce_value
+from .search import search_filters
+
+
+def fields(target):
+    return [item for item in inspect(target).all_orm_descriptors.values()
+            if item.is_attribute and item.extension_type == NOT_EXTENSION
+            and isinstance(item.property, ColumnProperty)]
+
+
+def build_filters(target, fields, prefix=None):
+    def coerce_func(x, attr):
+        return coerce_value(target, attr.property.columns[0], x, False)
+
+    ret = dict()
+
+    for item in fields:
+        key = prefix + item.key if prefix is not None else item.key
+        ret[key] = lambda x, attr=item: attr == coerce_func(x, attr)
+        if isinstance(item.property.columns[0].type, String):
+            ret[f'{key}_like'] = \
+                lambda x, attr=item: attr.ilike('%' + x + '%')
+        ret[f'{key}_gt'] = \
+            lambda x, attr=item: attr > coerce_func(x, attr)
+        ret[f'{key}_ge'] = \
+            lambda x, attr=item: attr >= coerce_func(x, attr)
+        ret[f'{key}_lt'] = \
+            lambda x, attr=item: attr < coerce_func(x, attr)
+        ret[f'{key}_le'] = \
+            lambda x, attr=item: attr <= coerce_func(x, attr)
+        ret[f'{key}_isnull'] = \
+            lambda x, attr=item: attr.is_(None) if asbool(x) else \
+            attr.isnot(None)
+        ret[f'{key}_in'] = \
+            lambda x, attr=item: attr.in_([
+                coerce_func(_, attr) for _ in x.split(',')
+                ])
+    ret.update(search_filters(target, prefix))
+    return ret
+
+
+def build_order(fields, prefix=None):
+    ret = dict()
+    for attr in fields:
+        key = prefix + attr.key if prefix is not None else attr.key
+        ret[key] = attr
+    return ret
+
+
+def _pkey_coercer(cls, column):
+    def _impl(value):
+        return coerce_value(cls, column, value)
+    return _impl
+
+
+def _database_cascades(prop):
+    # whether deleting a row leaves to the database all the ORM would do
+    # through prop; only passive_deletes hands the cascade over, otherwise
+    # the ORM loads related rows, runs their events and cascades in Python
+    if prop.viewonly:
+        return True
+    if prop.direction is MANYTOONE:
+        return not prop.cascade.delete
+    return bool(prop.passive_deletes)
+
+
+class ViewMetadata:
+    '''
+    Per-class metadata used by CRUDView, CatchallView and CatchallPredicate;
+    built once per mapped class and shared between requests.
+    '''
+
+    def __init__(self, cls):
+        mapper = inspect(cls)
+        self.cls = cls = mapper.class_
+        self.mapper = mapper
+        self.fields = fields(cls)
+        self.filters = build_filters(cls, self.fields)
+        self.order = build_order(self.fields)
+        self.pkey_coercers = tuple(_pkey_coercer(cls, col)
+                                   for col in mapper.primary_key)
+        self.relationships = {prop.key: prop for prop in mapper.relationships}
+
+        # polymorphic identities by their string form, as found in routes
+        self.polymorphic_identities = dict()
+        if mapper.polymorphic_on is not None:
+            for identity, submapper in mapper.polymorphic_map.items():
+                keys = [str(identity)]
+                if isinstance(identity, Enum):
+                    keys = [identity.name]
+                    if isinstance(identity.value, str):
+                        keys.append(identity.value)
+                elif not isinstance(identity, (str, int)):
+                    # leave unusual types to coerce_value
+                    continue
+                for key in keys:
+                    self.polymorphic_identities.setdefault(key, submapper)
+
+        # a single DELETE statement can replace session.delete() when the
+        # hierarchy lives in one table, rows are not versioned and the
+        # database handles all relationship cascades
+        hierarchy = mapper.base_mapper.self_and_descendants
+        self.bulk_deletable = \
+            len({m.local_table for m in hierarchy}) == 1 and \
+            mapper.version_id_col is None and \
+            all(_database_cascades(prop)
+                for m in mapper.self_and_descendants
+                for prop in m.relationships)
+
+    def coerce_pkey(self, values):
+        # raises ValueError on invalid values
+        return tuple(func(value) for func, value in
+                     zip(self.pkey_coercers, values))
+
+    def can_bulk_delete(self):
+        # delete events are only fired by session.delete()
+        return self.bulk_deletable and not any(
+            m.dispatch.before_delete or m.dispatch.after_delete
+            for m in self.mapper.self_and_descendants)
+
+    def polymorphic_cast(self, value):
+        # mapper for the polymorphic identity given as a string, or None
+        mapper = self.polymorphic_identities.get(value)
+        if mapper is not None or self.mapper.polymorphic_on is None:
+            return mapper
+        try:
+            identity = coerce_value(self.cls, self.mapper.polymorphic_on,
+                                    value)
+        except ValueError:
+            return None
+        return self.mapper.polymorphic_map.get(identity)
+
+
+class MetadataRegistry:
+    def __init__(self):
+        self._metadata = dict()
+
+    def get(self, cls):
+        if isinstance(cls, Mapper):
+            cls = cls.class_
+        ret = self._metadata.get(cls)
+        if ret is None:
+            ret = self._metadata[cls] = ViewMetadata(cls)
+        return ret
+
+    def register(self, cls):
+        # registers cls and all its polymorphic subclasses
+        for mapper in inspect(cls).self_and_descendants:
+            self.get(mapper)
+
+    def __contains__(self, cls):
+        return cls in self._metadata
+
+    def clear(self):
+        self._metadata.clear()
+
+
+registry = MetadataRegistry()
+
+
+def view_metadata(cls):
+    return registry.get(cls)
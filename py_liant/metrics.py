@@ -0,0 +1,277 @@
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+
+from pyramid.response import Response
+
+# In-process metrics, aggregated per worker process. Every thread updates its
+# own fixed-size series without locking (a lock is only taken the first time a
+# thread touches a metric); collect() and prometheus_text() sum the threads'
+# series when read. The series of a thread are folded into the metric's
+# totals once the thread is gone.
+#
+# py_liant records its operations in the `metrics` registry below once
+# includeme_factory(metrics=True) enables it, which also registers the tween
+# timing requests. Expose prometheus_text() by mounting metrics_view:
+#     config.add_route('metrics', '/metrics')
+#     config.add_view(metrics_view, route_name='metrics')
+
+TIME_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+                50000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216)
+
+
+class _ThreadToken:
+    # kept in a thread's local storage, so collected when the thread ends
+    __slots__ = ('__weakref__',)
+
+
+def _merge(target, shard):
+    for key, series in list(shard.items()):
+        merged = target.get(key)
+        if merged is None:
+            target[key] = list(series)
+        else:
+            for i, value in enumerate(series):
+                merged[i] += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        # series of the threads that ended
+        self._totals = dict()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = dict()
+            self._local.token = _ThreadToken()
+            weakref.finalize(self._local.token, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            _merge(self._totals, shard)
+            self._shards = [_ for _ in self._shards if _ is not shard]
+
+    def _series(self):
+        # series of all threads, merged by label values
+        ret = dict()
+        with self._lock:
+            _merge(ret, self._totals)
+            for shard in self._shards:
+                _merge(ret, shard)
+        return ret
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            for shard in self._shards:
+                shard.clear()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0]
+        series[0] += amount
+
+    def collect(self):
+        return {key: series[0] for key, series in self._series().items()}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # one count per bucket, +Inf, then the sum of observed values
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        ret = dict()
+        for key, series in self._series().items():
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    series[:-1]):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            ret[key] = dict(buckets=buckets, sum=series[-1],
+                            count=cumulative)
+        return ret
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    # whether py_liant records its operations (see `metrics` below)
+    enabled = True
+
+    def __init__(self, prefix='py_liant_'):
+        self.prefix = prefix
+        self.metrics = dict()
+        self._caches = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f'duplicate metric {metric.name!r}')
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels,
+                                   buckets))
+
+    def track_cache(self, name, cache):
+        # reports cache.hits and cache.misses (for as long as cache lives)
+        with self._lock:
+            self._caches.append((name, weakref.ref(cache)))
+
+    def cache_stats(self):
+        ret = dict()
+        with self._lock:
+            self._caches = [item for item in self._caches
+                            if item[1]() is not None]
+            caches = list(self._caches)
+        for name, ref in caches:
+            cache = ref()
+            if cache is None:
+                continue
+            stats = ret.setdefault(name, dict(hits=0, misses=0))
+            stats['hits'] += cache.hits
+            stats['misses'] += cache.misses
+        return ret
+
+    def collect(self):
+        # {metric name: {label values: value}}; histogram values are dicts
+        # with cumulative buckets, sum and count
+        ret = {name: metric.collect() for name, metric in self.metrics.items()}
+        for key in ('hits', 'misses'):
+            ret[f'{self.prefix}cache_{key}_total'] = {
+                (name,): stats[key]
+                for name, stats in self.cache_stats().items()}
+        return ret
+
+    def prometheus_text(self):
+        lines = []
+        for name, metric in self.metrics.items():
+            exported = name + '_total' if metric.kind == 'counter' else name
+            lines.append(f'# HELP {exported} {metric.help}')
+            lines.append(f'# TYPE {exported} {metric.kind}')
+            for key, value in sorted(metric.collect().items()):
+                if metric.kind == 'counter':
+                    lines.append(f'{exported}{_labels(metric.labels, key)} '
+                                 f'{_number(value)}')
+                    continue
+                for bound, count in value['buckets']:
+                    labels = _labels(metric.labels, key,
+                                     [('le', _number(float(bound)))])
+                    lines.append(f'{name}_bucket{labels} {count}')
+                labels = _labels(metric.labels, key)
+                lines.append(f'{name}_sum{labels} {_number(value["sum"])}')
+                lines.append(f'{name}_count{labels} {value["count"]}')
+        stats = sorted(self.cache_stats().items())
+        for key in ('hits', 'misses'):
+            exported = f'{self.prefix}cache_{key}_total'
+            lines.append(f'# HELP {exported} Cache {key}')
+            lines.append(f'# TYPE {exported} counter')
+            for name, values in stats:
+                lines.append(f'{exported}{_labels(("cache",), (name,))} '
+                             f'{values[key]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+metrics = MetricsRegistry()
+# until includeme_factory(metrics=True)
+metrics.enabled = False
+request_seconds = metrics.histogram(
+    'request_seconds', 'Request latency', ('verb', 'method'))
+rows_returned = metrics.histogram(
+    'rows_returned', 'Items returned by list requests', ('verb',),
+    SIZE_BUCKETS)
+objects_encoded = metrics.histogram(
+    'objects_encoded', 'Objects encoded per response', ('verb',),
+    SIZE_BUCKETS)
+payload_bytes = metrics.histogram(
+    'payload_bytes', 'Encoded JSON size', ('verb',), BYTE_BUCKETS)
+apply_changes_objects = metrics.histogram(
+    'apply_changes_objects', 'Objects added, changed or deleted by '
+    'apply_changes', ('verb',), SIZE_BUCKETS)
+count_seconds = metrics.histogram(
+    'count_seconds', 'List count query time', ('mode',))
+
+
+def request_verb(request):
+    # CatchallView verb, or the matched route's name
+    route = (request.matchdict or {}).get('route')
+    if isinstance(route, dict) and 'verb' in route:
+        return route['verb']
+    matched = getattr(request, 'matched_route', None)
+    return matched.name if matched is not None else ''
+
+
+def metrics_tween_factory(handler, registry):
+    def metrics_tween(request):
+        start = perf_counter()
+        try:
+            return handler(request)
+        finally:
+            request_seconds.observe(
+                perf_counter() - start,
+                (request_verb(request), request.method))
+    return metrics_tween
+
+
+def metrics_view(request):
+    return Response(metrics.prometheus_text(),
+                    content_type='text/plain; version=0.0.4',
+                    charset='utf-8')
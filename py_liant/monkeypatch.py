@@ -1,13 +1,12 @@
 import base64
+import sys
 import uuid
 from collections import OrderedDict
 from datetime import date, datetime, time
 from decimal import Decimal
 from enum import Enum
 
-from dateutil import parser, tz
 from sqlalchemy import Column, DateTime, String, Time, cast
-from sqlalchemy.dialects.postgresql import HSTORE, UUID
 from sqlalchemy.ext.associationproxy import ASSOCIATION_PROXY
 from sqlalchemy.ext.hybrid import HYBRID_PROPERTY
 from sqlalchemy.inspection import inspect
@@ -17,7 +16,14 @@ from sqlalchemy.types import ARRAY
 
 from pyramid.settings import asbool
 
-from .interfaces import JsonGuardProvider
+from .interfaces import JsonGuardProvider, overrides
+
+
+def _postgresql_type(name):
+    # a PostgreSQL dialect type, without importing the dialect: columns can
+    # only use its types once it has been imported
+    return getattr(sys.modules.get('sqlalchemy.dialects.postgresql'), name,
+                   None)
 
 
 def coerce_value(cls, column, value, size_check=True):
@@ -32,6 +38,7 @@ def coerce_value(cls, column, value, size_check=True):
         python_type = column.type.python_type
     except NotImplementedError:
         # SA types that don't implement python_type treated early and explicity
+        HSTORE, UUID = _postgresql_type('HSTORE'), _postgresql_type('UUID')
         if column.type is HSTORE or type(column.type) is HSTORE:
             if value is None or isinstance(value, dict):
                 # coerce all non-string values of hstore dict
@@ -101,6 +108,7 @@ def coerce_value(cls, column, value, size_check=True):
                 f'{cls!r}, received {type(value)!r} instead')
 
     if python_type in (datetime, date, time):
+        from dateutil import parser, tz
         try:
             use_timezone = False
             if isinstance(column.type, (DateTime, Time)):
@@ -187,6 +195,98 @@ def __apply_changes(self, data, object_dict=None, context=None,
     if object_dict is None:
         object_dict = dict()
 
+    # with a guardUpdateBatch the objects of the whole tree are resolved
+    # first so that the guard can authorize each class at once, then changed
+    resolved = None
+    if isinstance(context, JsonGuardProvider) and \
+            overrides(context, 'guardUpdateBatch'):
+        resolved = dict()
+        batches = dict()
+        __resolve_changes(self, data, for_update, object_dict, resolved,
+                          batches)
+        for cls, items in batches.items():
+            context.guardUpdateBatch(cls, items)
+
+    __apply_object_changes(self, data, object_dict, context, for_update,
+                           resolved)
+
+
+def __resolve_changes(self, data, for_update, object_dict, resolved,
+                      batches):
+    # maps the objects of `data` to their (obj, for_update) in `resolved` and
+    # collects the (obj, data, for_update) items to update by class
+    resolved[data] = (self, for_update)
+    mapper = inspect(type(self))
+    if set(data.keys()) - {col.name for col in mapper.primary_key}:
+        batches.setdefault(type(self), []).append((self, data, for_update))
+
+    for key, prop in mapper.relationships.items():
+        value = data.get(key)
+        if value is None:
+            continue
+        child_class, child_mapper = _related(prop)
+        current = getattr(self, key)
+        if prop.uselist:
+            items = value
+        else:
+            items = (value,)
+            current = () if current is None else (current,)
+        current = {tuple(child_mapper.primary_key_from_instance(obj)): obj
+                   for obj in current}
+        for item in items:
+            if item in object_dict or item in resolved:
+                continue
+            child_obj, child_for_update = __resolve_child(
+                self, prop, child_class, child_mapper, item, current)
+            __resolve_changes(child_obj, item, child_for_update, object_dict,
+                              resolved, batches)
+
+
+def _related(prop):
+    # the class and mapper of a relationship's target
+    child_class = prop.argument
+
+    if isinstance(child_class, Mapper):
+        child_class = child_class.class_
+
+    child_mapper = inspect(child_class, False)
+
+    # might need to resolve (class resolver instance)
+    if child_mapper is None:
+        child_class = child_class()
+        child_mapper = inspect(child_class)
+
+    return child_class, child_mapper
+
+
+def __resolve_child(self, prop, child_class, child_mapper, item, current):
+    # the object `item` stands for, taken from `current` (the related objects
+    # by primary key) or the database or created, and whether it is updated
+    pk = _get_pk_from_json(child_class, child_mapper.primary_key, item,
+                           prop.local_remote_pairs, self)
+
+    # TODO
+    # 1) we need to establish definitively how we tell apart bogus
+    #    data from genuinely new objects; some keys may be natural?
+    #    for now check nulls in PK and assume that null PKs means
+    #    this is a new object
+    # 2) Are there any cases when deferring this would be useful?
+    if any(i is None for i in pk):
+        return _polymorphic_constructor(child_class, item), False
+    if tuple(pk) in current:
+        return current[tuple(pk)], True
+
+    child_obj = Session.object_session(self).query(child_class).get(pk)
+    if child_obj is not None:
+        return child_obj, True
+    if child_class.__table__._autoincrement_column is None:
+        return _polymorphic_constructor(child_class, item), False
+    raise AssertionError(
+        f'Could not find object of {child_class!r}[{pk!r}] in database')
+
+
+def __apply_object_changes(self, data, object_dict, context, for_update,
+                           resolved):
     # register in object dictionary to prevent loops and worse
     if self in object_dict:
         return
@@ -237,7 +337,7 @@ def __apply_changes(self, data, object_dict=None, context=None,
                 raise NotImplementedError('synonym properties not supported')
             elif isinstance(prop, RelationshipProperty):
                 __apply_collection_changes(self, attr, value, object_dict,
-                                           context)
+                                           context, resolved)
             else:
                 raise AssertionError(
                     f'Unexpected property type {type(prop)!r} in '
@@ -251,19 +351,10 @@ def __apply_changes(self, data, object_dict=None, context=None,
                 f'in {type(self)!r}: {key}')
 
 
-def __apply_collection_changes(self, attr, value, object_dict, context):
+def __apply_collection_changes(self, attr, value, object_dict, context,
+                               resolved):
     prop = attr.property
-    child_class = prop.argument
-
-    if isinstance(child_class, Mapper):
-        child_class = child_class.class_
-
-    child_mapper = inspect(child_class, False)
-
-    # might need to resolve (class resolver instance)
-    if child_mapper is None:
-        child_class = child_class()
-        child_mapper = inspect(child_class)
+    child_class, child_mapper = _related(prop)
 
     if prop.uselist:
         # list of items
@@ -285,38 +376,15 @@ def __apply_collection_changes(self, attr, value, object_dict, context):
                 object_map[item] = object_dict[item]
                 continue
 
-            pk = _get_pk_from_json(child_class,
-                                   child_mapper.primary_key, item,
-                                   prop.local_remote_pairs, self)
-            pk_incomplete = any(i is None for i in pk)
-
-            if pk_incomplete or tuple(pk) not in remote_pk_map:
-                if pk_incomplete:
-                    child_obj = _polymorphic_constructor(
-                        child_class, item)
-                    for_update = False
-                else:
-                    child_obj = Session.object_session(
-                        self).query(child_class).get(pk)
-                    if child_obj is None:
-                        if child_class.__table__._autoincrement_column is None:
-                            child_obj = _polymorphic_constructor(
-                                child_class, value)
-                            for_update = False
-                        else:
-                            raise AssertionError(
-                                f'Could not find object of {child_class!r}'
-                                f'[{pk!r}] in database')
-                    else:
-                        for_update = True
-                object_map[item] = child_obj
-                __apply_changes(child_obj, item, object_dict, context,
-                                for_update)
+            if resolved is not None and item in resolved:
+                child_obj, for_update = resolved[item]
             else:
-                child_obj = remote_pk_map[tuple(pk)]
-                object_map[item] = child_obj
-                __apply_changes(child_obj, item, object_dict, context,
-                                True)
+                child_obj, for_update = __resolve_child(
+                    self, prop, child_class, child_mapper, item,
+                    remote_pk_map)
+            object_map[item] = child_obj
+            __apply_object_changes(child_obj, item, object_dict, context,
+                                   for_update, resolved)
 
         for local, remote in object_map.items():
             if remote not in collection:
@@ -335,52 +403,21 @@ def __apply_collection_changes(self, attr, value, object_dict, context):
         # single item
         if value is None:
             attr.__set__(self, value)
+        elif value in object_dict:
+            attr.__set__(self, object_dict[value])
         else:
-            if value in object_dict:
-                attr.__set__(self, object_dict[value])
+            if resolved is not None and value in resolved:
+                child_obj, for_update = resolved[value]
             else:
-                pk = _get_pk_from_json(child_class, child_mapper.primary_key,
-                                       value, prop.local_remote_pairs, self)
-
                 current_value = attr.__get__(self, None)
-
-                # TODO
-                # 1) we need to establish definitively how we tell apart bogus
-                #    data from genuinely new objects; some keys may be natural?
-                #    for now check nulls in PK and assume that null PKs means
-                #    this is a new object
-                # 2) Are there any cases when deferring this would be useful?
-
-                pk_incomplete = any(i is None for i in pk)
-
-                if pk_incomplete or current_value is None or \
-                        child_mapper.primary_key_from_instance(current_value) \
-                        != pk:
-                    if pk_incomplete:
-                        child_obj = _polymorphic_constructor(
-                            child_class, value)
-                        for_update = False
-                    else:
-                        child_obj = Session.object_session(
-                            self).query(child_class).get(pk)
-                        if child_obj is None:
-                            if child_class.__table__._autoincrement_column \
-                                    is None:
-                                child_obj = _polymorphic_constructor(
-                                    child_class, value)
-                                for_update = False
-                            else:
-                                raise AssertionError(
-                                    f'Could not find object of {child_class!r}'
-                                    f'[{pk!r}] in database')
-                        else:
-                            for_update = True
-                    __apply_changes(child_obj, value, object_dict, context,
-                                    for_update)
-                    attr.__set__(self, child_obj)
-                else:
-                    __apply_changes(current_value, value, object_dict,
-                                    context, True)
+                current = {} if current_value is None else {
+                    tuple(child_mapper.primary_key_from_instance(
+                        current_value)): current_value}
+                child_obj, for_update = __resolve_child(
+                    self, prop, child_class, child_mapper, value, current)
+            __apply_object_changes(child_obj, value, object_dict, context,
+                                   for_update, resolved)
+            attr.__set__(self, child_obj)
 
 
 def patch_sqlalchemy_base_class(base_class: type):
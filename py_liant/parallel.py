@@ -0,0 +1,166 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool, SingletonThreadPool, StaticPool
+
+from .metrics import count_seconds, metrics
+
+_snapshot_id = re.compile(r'^[0-9A-Fa-f\-]+$')
+
+# isolation levels keeping one snapshot for the whole transaction
+_snapshot_levels = ('REPEATABLE READ', 'SERIALIZABLE')
+
+
+def count_statement(query):
+    # the statement Query.count() issues
+    subquery = query.enable_eagerloads(False).order_by(None).statement \
+        .subquery()
+    return select(func.count()).select_from(subquery)
+
+
+def _bind_arguments(query, statement):
+    # what the session picks the query's bind by (Session(binds=...))
+    descriptions = query.column_descriptions
+    return dict(mapper=descriptions[0]['entity'] if descriptions else None,
+                clause=statement)
+
+
+def _isolation_level(connection):
+    # the level the connection's transactions run at, without a round trip
+    return connection.get_execution_options().get('isolation_level') or \
+        getattr(connection.dialect, 'isolation_level', None) or \
+        connection.dialect.default_isolation_level
+
+
+def _pool_exhausted(pool):
+    if not isinstance(pool, QueuePool):
+        return False
+    return pool.checkedin() == 0 and pool._max_overflow > -1 and \
+        pool.overflow() >= pool._max_overflow
+
+
+class ConcurrentCount:
+    '''
+    Runs the count query of CRUDView listings on a separate pooled
+    connection, in a thread pool of `max_workers` threads, while the page is
+    fetched on the request's session. On PostgreSQL the count transaction
+    imports the session's snapshot so both queries see the same data.
+
+    The count falls back to running on the session, after the page query,
+    whenever the concurrent path could give a different result or would
+    have to wait: all workers are busy, the engine's pool has no connection
+    available (or times out), the session is bound to a connection or uses a
+    per-thread/static pool, or it has flushed changes in its transaction.
+    '''
+    # counters for the chosen path
+    concurrent = 0
+    sequential = 0
+
+    def __init__(self, max_workers=4, target=Session):
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='py_liant.count')
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._info_key = f'py_liant.concurrent_count.{id(self)}'
+        self.target = target
+        for name, fn in self._listeners():
+            event.listen(target, name, fn)
+
+    def _listeners(self):
+        return (('after_flush', self._after_flush),
+                ('after_commit', self._after_transaction),
+                ('after_soft_rollback', self._after_transaction))
+
+    def _after_flush(self, session, flush_context):
+        session.info[self._info_key] = True
+
+    def _after_transaction(self, session, *args):
+        session.info.pop(self._info_key, None)
+
+    def _engine(self, session, bind_arguments):
+        if session.new or session.dirty or session.deleted or \
+                session.info.get(self._info_key):
+            # uncommitted changes are invisible to other connections
+            return None
+        bind = session.get_bind(**bind_arguments)
+        if not isinstance(bind, Engine) or \
+                isinstance(bind.pool, (SingletonThreadPool, StaticPool)) or \
+                _pool_exhausted(bind.pool):
+            return None
+        return bind
+
+    def submit(self, query):
+        # returns a future for the count of query, or None if it should run
+        # sequentially
+        session = query.session
+        statement = count_statement(query)
+        bind_arguments = _bind_arguments(query, statement)
+        engine = self._engine(session, bind_arguments)
+        if engine is None or not self._slots.acquire(blocking=False):
+            self.sequential += 1
+            return None
+        try:
+            # the page query's connection is checked out first, so that the
+            # count cannot leave it waiting for the pool's last one
+            connection = session.connection(bind_arguments=bind_arguments)
+            if _pool_exhausted(engine.pool):
+                self._slots.release()
+                self.sequential += 1
+                return None
+            snapshot = None
+            if engine.dialect.name == 'postgresql':
+                # under READ COMMITTED the page query takes a snapshot of its
+                # own anyway, there is none worth sharing
+                if _isolation_level(connection) in _snapshot_levels:
+                    snapshot = connection.exec_driver_sql(
+                        'SELECT pg_export_snapshot()').scalar()
+            return self.executor.submit(
+                self._count, engine, statement, snapshot)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _count(self, engine, statement, snapshot):
+        # returns None if no connection could be obtained
+        try:
+            start = perf_counter()
+            if _pool_exhausted(engine.pool):
+                # taken since submit; waiting for one would hold up the
+                # response for up to pool_timeout
+                return None
+            try:
+                conn = engine.connect()
+            except TimeoutError:
+                return None
+            with conn, conn.begin():
+                if snapshot is not None and _snapshot_id.match(snapshot):
+                    conn.exec_driver_sql(
+                        'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                    conn.exec_driver_sql(
+                        f"SET TRANSACTION SNAPSHOT '{snapshot}'")
+                count = conn.execute(statement).scalar()
+            if metrics.enabled:
+                count_seconds.observe(perf_counter() - start,
+                                      ('concurrent',))
+            return count
+        finally:
+            self._slots.release()
+
+    def result(self, future, query):
+        # joins the count started by submit
+        count = future.result()
+        if count is None:
+            self.sequential += 1
+            return query.count()
+        self.concurrent += 1
+        return count
+
+    def shutdown(self, wait=True):
+        for name, fn in self._listeners():
+            event.remove(self.target, name, fn)
+        self.executor.shutdown(wait=wait)
@@ -40,3 +40,39 @@ route_parser = fieldname('verb') + \
     Optional(Suppress('[') + index_parser('slice') + Suppress(']')) + \
     Optional(Suppress(':') + fieldname('profile')) + \
     Optional(Suppress(':') + hints_parser('hints'))
+
+
+# the parse results are converted to plain (immutable where possible)
+# structures so they can be safely cached and shared between requests
+
+def _hints_to_tuple(parsed):
+    return tuple(_hint_to_dict(item) for item in parsed)
+
+
+def _hint_to_dict(item):
+    ret = {'op': item['op']}
+    for key in ('name', 'type'):
+        if key in item:
+            ret[key] = item[key]
+    if 'children' in item:
+        ret['children'] = _hints_to_tuple(item['children'])
+    return ret
+
+
+def parse_hints(value):
+    return _hints_to_tuple(hints_parser.parseString(value, True))
+
+
+def parse_route(value):
+    parsed = route_parser.parseString(value, True)
+    route = {'verb': parsed['verb']}
+    for key in ('cast', 'drilldown', 'drilldown_cast', 'profile'):
+        if key in parsed:
+            route[key] = parsed[key]
+    if 'pkey' in parsed:
+        route['pkey'] = tuple(parsed['pkey'])
+    if 'slice' in parsed:
+        route['slice'] = dict(parsed['slice'].items())
+    if 'hints' in parsed:
+        route['hints'] = _hints_to_tuple(parsed['hints'])
+    return route
@@ -0,0 +1,179 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from pyramid.events import ContextFound
+from pyramid.response import Response
+from pyramid.tweens import INGRESS
+
+from .cache import LRUCache
+from .interfaces import JsonGuardProvider
+from .timing import RequestTimings, _current, listen
+
+# On-demand profiling of single requests. A request carrying the
+# X-Py-Liant-Profile header or a _profile query parameter is profiled if its
+# context is a JsonGuardProvider whose guardProfile(request) approves it. The
+# request thread is sampled for the rest of the request; stacks are rooted at
+# the py_liant phase in progress (route, sql, apply_changes, flush, commit,
+# encode) and stored with the statements that ran, see Profile. Requests
+# without the trigger only pay for a header and a query string lookup.
+#
+# Register with includeme_factory(profiling=True). Settings:
+#     py_liant.profiling.interval: sampling interval in seconds (0.001)
+#     py_liant.profiling.directory: also write <id>.json and <id>.folded here
+# Profiles are kept in `profiles` (last 32) and their id is returned in the
+# X-Py-Liant-Profile response header; mount profile_view to fetch them.
+
+HEADER = 'X-Py-Liant-Profile'
+PARAM = '_profile'
+
+_environ_key = 'py_liant.profiler'
+
+profiles = LRUCache(maxsize=32)
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class Profile:
+    def __init__(self, id, method, path, duration, interval, phases,
+                 statements, stacks):
+        self.id, self.method, self.path = id, method, path
+        self.duration, self.interval = duration, interval
+        self.phases, self.statements, self.stacks = phases, statements, stacks
+
+    def folded(self):
+        # collapsed stacks, as read by flamegraph.pl and speedscope
+        return ''.join(f'{";".join(stack)} {count}\n'
+                       for stack, count in sorted(self.stacks.items()))
+
+    def as_dict(self):
+        return dict(id=self.id, method=self.method, path=self.path,
+                    duration=self.duration, interval=self.interval,
+                    phases=self.phases, statements=self.statements,
+                    samples=self.folded().splitlines())
+
+
+class RequestProfiler(threading.Thread):
+    '''
+    Samples the stack of the thread handling a request every `interval`
+    seconds.
+    '''
+
+    def __init__(self, request, interval=0.001):
+        super().__init__(name='py_liant.profiler', daemon=True)
+        self.request = request
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        # joins the request's timings if the timing tween is enabled
+        self.timings = _current.get()
+        self._token = None
+        if self.timings is None:
+            self.timings = RequestTimings()
+            self._token = _current.set(self.timings)
+        self.timings.statements = []
+        self.start_time = time.perf_counter()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if not stack:
+                continue
+            active = self.timings.active
+            stack.append(f'[{active[-1]}]' if active else '[view]')
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        if self._token is not None:
+            _current.reset(self._token)
+        return Profile(
+            uuid.uuid4().hex, self.request.method, self.request.path_qs,
+            round((time.perf_counter() - self.start_time) * 1000, 3),
+            self.interval, self.timings.milliseconds(),
+            self.timings.statements, dict(self.stacks))
+
+
+def requested(request):
+    return HEADER in request.headers or \
+        PARAM in request.GET
+
+
+def _context_found(event):
+    request = event.request
+    if _environ_key not in request.environ:
+        return
+    context = request.context
+    if request.environ[_environ_key] is not None or \
+            not isinstance(context, JsonGuardProvider) or \
+            not context.guardProfile(request):
+        return
+    profiler = RequestProfiler(request, _interval(request.registry))
+    request.environ[_environ_key] = profiler
+    profiler.start()
+
+
+def store(profile, directory=None):
+    profiles.set(profile.id, profile)
+    if directory:
+        with open(os.path.join(directory, f'{profile.id}.json'), 'w') as f:
+            json.dump(profile.as_dict(), f)
+        with open(os.path.join(directory, f'{profile.id}.folded'), 'w') as f:
+            f.write(profile.folded())
+
+
+def _interval(registry):
+    settings = registry.settings or {}
+    return float(settings.get('py_liant.profiling.interval', 0.001))
+
+
+def profiling_tween_factory(handler, registry):
+    directory = (registry.settings or {}).get('py_liant.profiling.directory')
+
+    def profiling_tween(request):
+        if not requested(request):
+            return handler(request)
+        # the context decides in _context_found
+        request.environ[_environ_key] = None
+        try:
+            response = handler(request)
+        finally:
+            profiler = request.environ.pop(_environ_key)
+            profile = profiler.stop() if profiler is not None else None
+        if profile is not None:
+            store(profile, directory)
+            response.headers[HEADER] = profile.id
+        return response
+    return profiling_tween
+
+
+def includeme(config):
+    # included by includeme_factory(profiling=True)
+    listen()
+    config.add_subscriber(_context_found, ContextFound)
+    config.add_tween('py_liant.profiling.profiling_tween_factory',
+                     under=INGRESS)
+
+
+def profile_view(request):
+    # GET .../{id}, ?format=folded for the collapsed stacks only; protect it
+    # with a permission
+    profile = profiles.get(request.matchdict['id'])
+    if profile is None:
+        return Response(status=404)
+    if request.GET.get('format') == 'folded':
+        return Response(profile.folded(), content_type='text/plain',
+                        charset='utf-8')
+    return Response(json_body=profile.as_dict())
@@ -1,26 +1,33 @@
+from contextlib import contextmanager
+from time import perf_counter
 from typing import Dict
+import weakref
 
 import transaction
-from pyparsing import ParseException
-from sqlalchemy import String, and_, orm
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy import Integer, Numeric, and_, func, orm, tuple_
 from sqlalchemy.inspection import inspect
-from sqlalchemy.orm import ColumnProperty, Mapper, RelationshipProperty
-from sqlalchemy.orm.base import NOT_EXTENSION
+from sqlalchemy.orm import (ColumnProperty, Mapper, RelationshipProperty,
+                            object_session)
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound, StaleDataError
 from sqlalchemy.orm.util import AliasedClass
 
-from pyramid.httpexceptions import (HTTPConflict, HTTPNotFound, HTTPOk,
-                                    HTTPServerError)
+from pyramid.httpexceptions import (HTTPConflict, HTTPForbidden,
+                                    HTTPNotFound, HTTPOk, HTTPServerError)
 from pyramid.request import Request
-from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
 
+from .cache import LRUCache, class_tag
+from .fast_parser import ParseError, parse_hints, parse_route
 from .interfaces import JsonGuardProvider
 from .json_decoder import JSONDecoder
 from .json_encoder import JSONEncoder
+from .metadata import (build_filters, build_order, fields, registry,
+                       view_metadata)
+from . import metrics as _metrics
 from .monkeypatch import (_polymorphic_constructor, coerce_value,
                           patch_sqlalchemy_base_class)
-from .parser import hints_parser, route_parser
+from .timing import listen as listen_timing, timed
 
 # Returns a renderer for pyramid; base_type (SQLAlchemy declarative base) is
 # needed to detect sqlalchemy object instances
@@ -28,7 +35,7 @@ from .parser import hints_parser, route_parser
 #     config.add_renderer('json', pyramid_json_renderer_factory(Base))
 
 def pyramid_json_renderer_factory(base_type=None, wsgi_iter=False,
-                                  separators=(',', ':')):
+                                  separators=(',', ':'), iterative=False):
     def _json_renderer(info):
         def _render(value, system):
             request = system.get('request')
@@ -40,31 +47,58 @@ def pyramid_json_renderer_factory(base_type=None, wsgi_iter=False,
 
                 json_encoder = JSONEncoder(request, base_type=base_type,
                                            separators=separators,
-                                           check_circular=False)
+                                           check_circular=False,
+                                           iterative=iterative)
 
                 # solution 1: write to stream from renderer
                 if not wsgi_iter:
-                    for chunk in json_encoder.iterencode(value):
-                        response.write(chunk)
+                    size = 0
+                    with timed('encode'):
+                        for chunk in json_encoder.iterencode(value):
+                            chunk = chunk.encode()
+                            size += len(chunk)
+                            response.write(chunk)
+                    _record_encoding(request, json_encoder, size)
                     return None
 
                 # solution 2: provide iterable to wsgi layer
                 else:
                     def _iterencode(val):
-                        for chunk in json_encoder.iterencode(val):
-                            yield chunk.encode()
+                        # runs as the server iterates the response, timed
+                        # (py_liant.timing) chunk by chunk
+                        size = 0
+                        chunks = iter(json_encoder.iterencode(val))
+                        while True:
+                            with timed('encode'):
+                                chunk = next(chunks, None)
+                            if chunk is None:
+                                break
+                            chunk = chunk.encode()
+                            size += len(chunk)
+                            yield chunk
+                        _record_encoding(request, json_encoder, size)
 
                     response.app_iter = _iterencode(value)
                     return None
             else:
                 # fallback for direct calls?
                 json_encoder = JSONEncoder(base_type=base_type,
-                                           separators=separators)
-                return json_encoder.encode(value)
+                                           separators=separators,
+                                           iterative=iterative)
+                with timed('encode'):
+                    return json_encoder.encode(value)
         return _render
     return _json_renderer
 
 
+def _record_encoding(request, encoder, size):
+    if not _metrics.metrics.enabled:
+        return
+    verb = (_metrics.request_verb(request),)
+    _metrics.objects_encoded.observe(encoder.counter, verb)
+    _metrics.payload_bytes.observe(size, verb)
+
+
 # Sample usage:
 #     config.add_request_method(pyramid_json_decoder, 'json', reify=True)
 def pyramid_json_decoder(request):
@@ -90,6 +124,20 @@ class CRUDView(object):
     update_lock = False
     # this means accept_order will be rewritten
     use_subquery_after_filter = False
+    # optional ResultCache instance for list results
+    result_cache = None
+    # optional ReplicaRouter; get and list read from replica engines
+    replica_router = None
+    # optional ConcurrentCount; list counts run alongside the page query
+    concurrent_count = None
+    # optional LoadAdvisor recording the lazy loads of requests
+    load_advisor = None
+    # query parameters of aggregation requests
+    group_param = 'group'
+    aggregate_param = 'aggregate'
+    aggregate_functions = dict(count=func.count, sum=func.sum, min=func.min,
+                               max=func.max, avg=func.avg)
+    _reading = False
 
     def __init__(self, request):
         """:type request: Request"""
@@ -97,6 +145,12 @@ class CRUDView(object):
         self.context = request.context
         # self.context._json_hints = self.json_hints
         assert(isinstance(self.request, Request))
+        if self.load_advisor is not None:
+            self.load_advisor.start(request, self.advisor_key)
+
+    @property
+    def advisor_key(self):
+        return self.target_name
 
     @property
     def identity_filter(self):
@@ -113,6 +167,13 @@ class CRUDView(object):
         return query.filter(self.context_filter, self.identity_filter).one()
 
     def get_by_id(self, update_lock=False):
+        if update_lock:
+            # locking reads always go to the primary
+            with self.reading(False):
+                return self._get_by_id(update_lock)
+        return self._get_by_id(update_lock)
+
+    def _get_by_id(self, update_lock):
         try:
             query = self.get_identity_base()
             if update_lock:
@@ -179,8 +240,29 @@ class CRUDView(object):
                    ) if 'page' in self.request.GET else 0
         return slice(page * page_size, page * page_size + page_size)
 
+    @contextmanager
+    def reading(self, enabled=True):
+        # queries built within this block use the replica session (if a
+        # replica_router is set)
+        previous, self._reading = self._reading, enabled
+        try:
+            yield
+        finally:
+            self._reading = previous
+
+    @property
+    def query_session(self):
+        if self._reading and self.replica_router is not None:
+            return self.replica_router.read_session(self.request)
+        return self.request.dbsession
+
+    def written(self):
+        # called after a successful write
+        if self.replica_router is not None:
+            self.replica_router.pin(self.request)
+
     def get_base_query(self):
-        return self.request.dbsession.query(self.target_type)
+        return self.query_session.query(self.target_type)
 
     def get_identity_base(self):
         return self.get_base_query()
@@ -188,111 +270,304 @@ class CRUDView(object):
     def get_list_base(self):
         return self.get_base_query()
 
+    def cache_principal(self):
+        return self.request.authenticated_userid
+
+    def result_cache_key(self):
+        return self.result_cache.make_key(
+            type(self).__module__, type(self).__qualname__,
+            class_tag(inspect(self.target_type).class_),
+            self.request.path_info, sorted(self.request.GET.items()),
+            self.cache_principal(),
+            # set by py_liant.tenancy.TenantRouter
+            self.request.environ.get('py_liant.tenant'))
+
+    def get_cached_results(self, query, key):
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+        pkeys, count = cached
+        if not pkeys:
+            return [], count
+        mapper = inspect(self.target_type).mapper
+        # target_type may be an alias, so use its own attributes
+        pkey_attrs = [
+            getattr(self.target_type, mapper.get_property_by_column(col).key)
+            for col in mapper.primary_key]
+        if len(pkey_attrs) == 1:
+            pkey_filter = pkey_attrs[0].in_([_[0] for _ in pkeys])
+        else:
+            pkey_filter = tuple_(*pkey_attrs).in_(pkeys)
+        items = {tuple(mapper.primary_key_from_instance(item)): item
+                 for item in query.filter(pkey_filter)}
+        return [items[_] for _ in pkeys if _ in items], count
+
     def get_search_results(self, query=None):
         if query is None:
             query = self.get_list_base().filter(self.context_filter)
         query = query.filter(*self.query_filters)
         pager = self.pager_slice
-        count = query.count()
+
+        cache_key = None
+        if self.result_cache is not None and \
+                not self.use_subquery_after_filter:
+            cache_key = self.result_cache_key()
+            cached = self.get_cached_results(query, cache_key)
+            if cached is not None:
+                return cached
+
+        # with concurrent_count the count runs while the page is fetched
+        count_query, future = query, None
+        if self.concurrent_count is not None:
+            future = self.concurrent_count.submit(count_query)
+        if future is None:
+            start = perf_counter()
+            count = query.count()
+            if _metrics.metrics.enabled:
+                _metrics.count_seconds.observe(perf_counter() - start,
+                                              ('sequential',))
 
         if self.use_subquery_after_filter:
             query = query.subquery()
             self.accept_order = dict(query.c)
-            query = self.request.dbsession.query(
-                *query.c)
+            query = self.query_session.query(*query.c)
 
         order_clauses = self.order_clauses
         if order_clauses is not None:
             # reset and apply order_by
             query = query.order_by(None).order_by(*order_clauses)
-        return query[pager] if pager else query.all(), count
+        items = query[pager] if pager else query.all()
+        if future is not None:
+            count = self.concurrent_count.result(future, count_query)
+
+        if cache_key is not None:
+            mapper = inspect(self.target_type).mapper
+            self.result_cache.set(
+                cache_key,
+                ([tuple(mapper.primary_key_from_instance(item))
+                  for item in items], count),
+                [self.target_type])
+        return items, count
+
+    def _aggregate_column(self, key):
+        column = self.accept_order.get(key)
+        if column is None or isinstance(column, list):
+            return None
+        return column
+
+    def aggregate_columns(self):
+        # grouped columns and aggregates requested by the query string, by
+        # result name: group=field,... aggregate=count,sum:field,...
+        # grouping is allowed on accept_order columns, sum/min/max/avg on
+        # numeric ones
+        group, aggregates = dict(), dict()
+        params = self.request.GET
+        for key in filter(None, params.get(self.group_param, '').split(',')):
+            column = self._aggregate_column(key)
+            if column is None:
+                raise HTTPServerError(f'not implemented, group by {key}')
+            group[key] = column
+        for item in filter(None,
+                           params.get(self.aggregate_param, '').split(',')):
+            name, _, key = item.partition(':')
+            function = self.aggregate_functions.get(name)
+            column = self._aggregate_column(key) if key else None
+            if function is None or (key and column is None) or \
+                    (not key and name != 'count') or \
+                    (name != 'count' and not
+                     isinstance(column.type, (Integer, Numeric))):
+                raise HTTPServerError(f'not implemented, aggregate {item}')
+            label = f'{name}_{key}' if key else name
+            aggregates[label] = function(column) if key else function()
+        if not aggregates and not group:
+            raise HTTPServerError('not implemented, empty aggregate')
+        return group, aggregates
+
+    def get_aggregate_query(self, query=None):
+        group, aggregates = self.aggregate_columns()
+        if isinstance(self.context, JsonGuardProvider) and \
+                not self.context.guardAggregate(
+                    inspect(self.target_type).class_, group, aggregates):
+            raise HTTPForbidden()
+        if query is None:
+            query = self.get_list_base()
+        query = query.filter(self.context_filter, *self.get_query_filters(
+            exclude=(self.group_param, self.aggregate_param)))
+        # orderings may refer to the result names
+        self.accept_order = dict(group, **aggregates)
+        query = query.order_by(None).with_entities(
+            *(col.label(key) for key, col in group.items()),
+            *(col.label(key) for key, col in aggregates.items())) \
+            .group_by(*group.values())
+        order_clauses = self.order_clauses
+        if order_clauses is not None:
+            query = query.order_by(*order_clauses)
+        return query
+
+    def aggregate(self):
+        # a single GROUP BY query; items are plain rows
+        with self.reading():
+            query = self.get_aggregate_query()
+            return dict(items=[row._asdict() for row in query])
 
     def get(self):
-        return {self.target_name: self.get_by_id()}
+        with self.reading():
+            return {self.target_name: self.get_by_id()}
 
     def list(self):
-        items, count = self.get_search_results()
+        with self.reading():
+            items, count = self.get_search_results()
+        if _metrics.metrics.enabled:
+            _metrics.rows_returned.observe(
+                len(items), (_metrics.request_verb(self.request),))
         return dict(items=items, total=count)
 
     def apply_changes(self, obj, data, for_update=True):
-        obj.apply_changes(data, context=self.context, for_update=for_update)
+        with timed('apply_changes'):
+            obj.apply_changes(data, context=self.context,
+                              for_update=for_update)
+        session = object_session(obj)
+        if session is not None and _metrics.metrics.enabled:
+            _metrics.apply_changes_objects.observe(
+                len(session.new) + len(session.dirty) + len(session.deleted),
+                (_metrics.request_verb(self.request),))
+
+    @contextmanager
+    def keep_loaded(self, session=None):
+        # objects keep their state through the commit; see refresh_result
+        if session is None:
+            session = self.request.dbsession
+        previous, session.expire_on_commit = session.expire_on_commit, False
+        try:
+            yield
+        finally:
+            session.expire_on_commit = previous
+
+    def refresh_result(self, obj):
+        # flushes obj and brings its state to what loading it anew after the
+        # commit would give, so the response is encoded without further
+        # queries: database generated columns are refreshed (no statement
+        # at all if the mapper uses eager_defaults), columns left out of an
+        # INSERT are NULL, relationships not eagerly loaded by default and
+        # deferred columns are expired
+        session = object_session(obj)
+        state = inspect(obj)
+        inserted = state.pending
+        session.flush()
+
+        expire, refresh = [], []
+        for prop in state.mapper.attrs:
+            if isinstance(prop, ColumnProperty):
+                eager = not prop.deferred
+            elif isinstance(prop, RelationshipProperty):
+                eager = prop.lazy in ('joined', 'selectin', 'subquery',
+                                      'immediate')
+            else:
+                continue
+            loaded = prop.key not in state.unloaded
+            if loaded and not eager:
+                expire.append(prop.key)
+            elif eager and not loaded:
+                if inserted and isinstance(prop, ColumnProperty) and \
+                        prop.key not in state.expired_attributes and \
+                        all(col.server_default is None
+                            for col in prop.columns):
+                    set_committed_value(obj, prop.key, None)
+                else:
+                    refresh.append(prop.key)
+        if expire:
+            session.expire(obj, expire)
+        if refresh:
+            session.refresh(obj, refresh)
 
     def update(self):
         try:
-            with transaction.manager, self.request.dbsession.no_autoflush:
+            with self.keep_loaded(), transaction.manager, \
+                    self.request.dbsession.no_autoflush:
                 old = self.get_by_id(update_lock=self.update_lock)
                 values = self.sanitize_input()
                 try:
                     self.apply_changes(old, values, True)
                 except VersionCheckError as ex:
                     raise HTTPConflict(str(ex))
+                self.refresh_result(old)
         except StaleDataError as ex:
             raise HTTPConflict(str(ex))
-        return self.request.dbsession.merge(old)
+        self.written()
+        return old
 
     def insert(self):
         values = self.sanitize_input()
         obj = _polymorphic_constructor(self.target_type, values)
-        with transaction.manager:
+        with self.keep_loaded(), transaction.manager:
             self.request.dbsession.add(obj)
             self.apply_changes(obj, values, False)
-        obj = self.request.dbsession.merge(obj)
+            self.refresh_result(obj)
+        self.written()
         return {self.target_name: obj}
 
+    def delete_query(self):
+        # query matching the object to delete with a single statement, or
+        # None to load and delete it through the session
+        return self.get_identity_base().filter(
+            self.context_filter, self.identity_filter, *self.query_filters)
+
+    def bulk_delete(self, query):
+        # deletes what query matches and returns the number of rows; this is
+        # a single DELETE when the database handles all cascades, otherwise
+        # the objects are loaded and deleted through the session
+        mapper = inspect(self.target_type).mapper
+        if view_metadata(mapper).can_bulk_delete() and \
+                _single_table(query, mapper):
+            return query.delete(synchronize_session=False)
+        count = 0
+        for obj in query:
+            query.session.delete(obj)
+            count += 1
+        return count
+
     def delete(self):
         with transaction.manager:
-            old = self.get_by_id()
-            self.request.dbsession.delete(old)
+            mapper = inspect(self.target_type).mapper
+            query = self.delete_query() \
+                if view_metadata(mapper).can_bulk_delete() else None
+            if query is not None and _single_table(query, mapper):
+                if not query.delete(synchronize_session=False):
+                    raise HTTPNotFound()
+            else:
+                old = self.get_by_id()
+                self.request.dbsession.delete(old)
+        self.written()
         return HTTPOk()
 
+    @classmethod
+    def _default_metadata(cls, target):
+        # prebuilt metadata applies to mapped classes when auto_fields is not
+        # customized
+        return cls.auto_fields.__func__ is CRUDView.auto_fields.__func__ \
+            and isinstance(inspect(target, False), Mapper)
+
     @classmethod
     def auto_fields(cls, target):
-        return [item for item in inspect(target).all_orm_descriptors.values()
-                if item.is_attribute and item.extension_type == NOT_EXTENSION
-                and isinstance(item.property, ColumnProperty)]
+        if isinstance(inspect(target, False), Mapper):
+            return list(view_metadata(target).fields)
+        return fields(target)
 
     @classmethod
     def auto_filters(cls, target=None, prefix=None):
         if target is None:
             target = cls.target_type
-
-        def coerce_func(x, attr):
-            return coerce_value(target, attr.property.columns[0], x, False)
-
-        ret = dict()
-
-        for item in cls.auto_fields(target):
-            key = prefix + item.key if prefix is not None else item.key
-            ret[key] = lambda x, attr=item: attr == coerce_func(x, attr)
-            if isinstance(item.property.columns[0].type, String):
-                ret[f'{key}_like'] = \
-                    lambda x, attr=item: attr.ilike('%' + x + '%')
-            ret[f'{key}_gt'] = \
-                lambda x, attr=item: attr > coerce_func(x, attr)
-            ret[f'{key}_ge'] = \
-                lambda x, attr=item: attr >= coerce_func(x, attr)
-            ret[f'{key}_lt'] = \
-                lambda x, attr=item: attr < coerce_func(x, attr)
-            ret[f'{key}_le'] = \
-                lambda x, attr=item: attr <= coerce_func(x, attr)
-            ret[f'{key}_isnull'] = \
-                lambda x, attr=item: attr.is_(None) if asbool(x) else \
-                attr.isnot(None)
-            ret[f'{key}_in'] = \
-                lambda x, attr=item: attr.in_([
-                    coerce_func(_, attr) for _ in x.split(',')
-                    ])
-        return ret
+        if prefix is None and cls._default_metadata(target):
+            return dict(view_metadata(target).filters)
+        return build_filters(target, cls.auto_fields(target), prefix)
 
     @classmethod
     def auto_order(cls, target=None, prefix=None):
         if target is None:
             target = cls.target_type
-        ret = dict()
-        for attr in cls.auto_fields(target):
-            key = prefix + attr.key if prefix is not None else attr.key
-            ret[key] = attr
-        return ret
+        if prefix is None and cls._default_metadata(target):
+            return dict(view_metadata(target).order)
+        return build_order(cls.auto_fields(target), prefix)
 
 
 class ConvertMatchdictPredicate:
@@ -335,6 +610,22 @@ def _get_by_combinedfilter(pkey_filter):
         return q.filter(*pkey_filter).one()
     return _impl
 
+
+def _pkey_getter(query, mapper, pkey):
+    if query.whereclause is None:
+        # no implicit/context filters
+        return _get_by_pkey(pkey)
+    return _get_by_combinedfilter(tuple(
+        col == val for col, val in zip(mapper.primary_key, pkey)))
+
+
+def _single_table(query, mapper):
+    # Query.delete() needs the mapped table alone: no joins, no other
+    # tables in the filters
+    froms = query.statement.get_final_froms()
+    return len(froms) == 1 and froms[0] is mapper.local_table
+
+
 # TODO: reverse order for negative indexes (?)
 def _get_by_index(index):
     def _impl(q):
@@ -353,14 +644,89 @@ class CatchallTarget:
     def __init__(self, cls, profiles=dict(), filters=None):
         self._cls, self.profiles, self.filters = cls, profiles, \
             filters
+        self._parsed_profiles = {
+            key: parse_hints(value) for key, value in profiles.items()
+        }
+        # loader options compiled from profiles, keyed by (profile, class)
+        self._profile_options = dict()
+
+    def cast(self, cls):
+        # same target seen as a polymorphic subclass; shares compiled profiles
+        ret = CatchallTarget.__new__(CatchallTarget)
+        ret.__dict__.update(self.__dict__)
+        ret._cls = cls
+        return ret
+
+    def profile_options(self, profile, context=None):
+        hints = self._parsed_profiles[profile]
+        if isinstance(context, JsonGuardProvider):
+            # guards may change the hints depending on the request
+            return CatchallPredicate.get_hints(hints, self._cls,
+                                               context=context)
+        key = (profile, self._cls)
+        options = self._profile_options.get(key)
+        if options is None:
+            options = CatchallPredicate.get_hints(hints, self._cls)
+            self._profile_options[key] = options
+        return options
 
     def __repr__(self):
         return f"(cls:{self._cls!r}, profiles:{self.profiles!r}, filters:{self.filters!r}"
 
 
+# parsed routes keyed by the catchall string; False marks unparseable routes
+route_cache = LRUCache(maxsize=4096)
+_metrics.metrics.track_cache('catchall_routes', route_cache)
+
+
+def _route_shape(route):
+    # the route without key and index values; routes with the same shape
+    # share a query plan
+    shape = dict(route)
+    if 'pkey' in shape:
+        shape['pkey'] = len(shape['pkey'])
+    if 'slice' in shape:
+        shape['slice'] = tuple(shape['slice'])
+    return repr(sorted(shape.items()))
+
+
+def _parse_route(value):
+    # returns the parsed route and its shape
+    cached = route_cache.get(value)
+    if cached is None:
+        try:
+            route = parse_route(value)
+            cached = (route, _route_shape(route))
+        except ParseError:
+            cached = False
+        route_cache.set(value, cached)
+    return cached or (None, None)
+
+
+class _CatchallPlan:
+    # request independent part of a CatchallPredicate match
+    meta = None
+    root = None
+    query = None
+    filters = None
+    drilldown = None
+    dynamic = False
+    single = False
+    index = False
+
+    def __init__(self):
+        self.options = []
+
+
+# predicates created by the configuration, see py_liant.warmup
+catchall_predicates = weakref.WeakSet()
+
+
 class CatchallPredicate:
     targets: Dict[str, CatchallTarget] = None
 
+    plan_cache_size = 1024
+
     def __init__(self, targets, config):
         def _adapt(obj) -> CatchallTarget:
             if isinstance(obj, CatchallTarget):
@@ -374,6 +740,30 @@ class CatchallPredicate:
         self.targets = {
             key: _adapt(obj) for key, obj in targets.items()
         }
+        self._phash = self.text()
+        # query plans by route shape; hits and misses are counted
+        self.plans = LRUCache(maxsize=self.plan_cache_size)
+        _metrics.metrics.track_cache('catchall_plans', self.plans)
+
+        # prepare metadata and compile profiles to loader options at
+        # configuration time
+        for target in self.targets.values():
+            registry.register(target._cls)
+            for profile in target.profiles:
+                target.profile_options(profile)
+        catchall_predicates.add(self)
+
+    def warmup(self):
+        # plans the basic routes of every target: lists and single objects,
+        # plain and with each profile
+        for verb, target in self.targets.items():
+            pkey = ','.join('1' * len(inspect(target._cls).primary_key))
+            for suffix in ('', *(f':{_}' for _ in target.profiles)):
+                for value in (verb + suffix, f'{verb}@{pkey}{suffix}'):
+                    route, shape = _parse_route(value)
+                    if route is not None:
+                        self.plans.set((shape, False, orm.Query),
+                                       self.plan(None, route) or False)
 
     def text(self):
         return f'catchall={self.targets!r}'
@@ -387,153 +777,199 @@ class CatchallPredicate:
         if 'catchall' not in match:
             return False
 
-        try:
-            route = route_parser.parseString(match['catchall'], True)
-        except ParseException:
+        # pyramid may evaluate this predicate once for each candidate view;
+        # do the work once per request and replay the outcome afterwards
+        memo = request.environ.setdefault('py_liant.catchall', {})
+        key = (self._phash, match['catchall'])
+        if key not in memo:
+            with timed('route'):
+                route, shape = _parse_route(match['catchall'])
+                memo[key] = None if route is None else \
+                    self.evaluate(context, request, route, shape)
+        result = memo[key]
+        if result is None:
             return False
+        match.update(result)
+        return True
+
+    def evaluate(self, context, request, route, shape=None):
+        # queries are built on the sync session, also for AsyncSession
+        session = getattr(request.dbsession, 'sync_session',
+                          request.dbsession)
+        is_async = session is not request.dbsession
+        # the session's Query subclass (sessionmaker(query_cls=...))
+        query_cls = session._query_cls
+
+        # plans depend on the route's shape only, unless guards are involved
+        if shape is None or isinstance(context, JsonGuardProvider):
+            plan = self.plan(context, route, is_async, query_cls)
+        else:
+            key = (shape, is_async, query_cls)
+            plan = self.plans.get(key)
+            if plan is None:
+                plan = self.plan(context, route, is_async, query_cls) or False
+                self.plans.set(key, plan)
+        if not plan:
+            return None
+        return self.bind(plan, request, session, route)
 
+    def plan(self, context, route, is_async=False, query_cls=orm.Query):
+        # builds the request independent part of a route: sessionless query
+        # templates with filters, drilldown joins and loader options
         if route['verb'] not in self.targets:
-            return False
+            return None
 
         target = self.targets[route['verb']]
-        getter = None
+        plan = _CatchallPlan()
 
-        insp = inspect(target._cls)
+        meta = view_metadata(target._cls)
         if 'cast' in route:
-            if insp.polymorphic_on is None:
-                return False
-            try:
-                value = coerce_value(target._cls, insp.polymorphic_on,
-                                     route['cast'])
-            except ValueError:
-                return False
-            if value not in insp.polymorphic_map:
-                return False
-            insp = insp.polymorphic_map[value]
-            target = CatchallTarget(insp.class_, target.profiles,
-                                    target.filters)
-
-        query = request.dbsession.query(target._cls)
-
+            mapper = meta.polymorphic_cast(route['cast'])
+            if mapper is None:
+                return None
+            meta = view_metadata(mapper)
+            target = target.cast(meta.cls)
+        plan.meta = meta
+
+        query = query_cls(target._cls)
         if target.filters is not None:
             filters = target.filters
             if callable(filters):
-                filters = filters(request)
-            if type(filters) not in (list, tuple):
-                filters = (filters,)
-
-            query = query.filter(*filters)
+                # evaluated for each request
+                plan.filters = filters
+            else:
+                if type(filters) not in (list, tuple):
+                    filters = (filters,)
+                query = query.filter(*filters)
+        plan.root = query
 
-        # convert pkey
         if 'pkey' in route:
-            pkey = route['pkey']
-            if len(pkey) != len(insp.primary_key):
-                return False
-            try:
-                pkey = tuple(coerce_value(target._cls, col, val)
-                             for col, val in zip(insp.primary_key, pkey))
-            except ValueError:
-                return False
-            if query.whereclause is None:
-                # no implicit/context filters
-                getter = _get_by_pkey(pkey)
-            else:
-                filters = map(
-                    lambda x: x[0]==x[1], 
-                    zip(insp.primary_key, pkey)
-                    )
-                getter = _get_by_combinedfilter(filters)
+            if len(route['pkey']) != len(meta.mapper.primary_key):
+                return None
 
         if 'drilldown' in route:
             # cannot drilldown property if result is list
-            if getter is None:
-                return False
+            if 'pkey' not in route:
+                return None
 
-            drilldown = route['drilldown']
-            try:
-                prop = insp.get_property(drilldown)
-            except InvalidRequestError:
-                return False
+            prop = meta.relationships.get(route['drilldown'])
+            if prop is None:
+                return None
 
             if isinstance(context, JsonGuardProvider):
                 if not context.guardDrilldown(prop.class_attribute):
-                    return False
-
-            if not isinstance(prop, RelationshipProperty):
-                return False
+                    return None
 
             # target switch in drilldown
             target = CatchallTarget(prop.entity.class_)
+            plan.drilldown = prop.key
+            plan.single = not prop.uselist
 
-            if prop.lazy == 'dynamic':
+            # dynamic props need the parent loaded; async sessions cannot
+            # do I/O here so they get the manual drilldown query below
+            if prop.lazy == 'dynamic' and not is_async:
                 if 'drilldown_cast' in route:
                     # we cannot apply polymorphic casting here
-                    return False
-                # special drilldown love for dynamic props
-                query = getattr(getter(query), prop.key)
-                # getter no longer useful
-                getter = None
+                    return None
+                # special drilldown love for dynamic props: the query comes
+                # from the parent, loaded for each request
+                plan.dynamic = True
+                query = None
             else:
                 # manually construct drilldown query for non-dynamic props
-                pkey_filter = (col == val for col, val in
-                               zip(insp.primary_key, pkey))
                 if 'drilldown_cast' in route:
-                    insp = inspect(target._cls)
-                    if insp.polymorphic_on is None:
-                        return False
-                    try:
-                        value = coerce_value(target._cls, insp.polymorphic_on,
-                                             route['drilldown_cast'])
-                    except ValueError:
-                        return False
-                    if value not in insp.polymorphic_map:
-                        return False
-                    insp = insp.polymorphic_map[value]
-                    target = CatchallTarget(insp.class_)
+                    mapper = view_metadata(target._cls).polymorphic_cast(
+                        route['drilldown_cast'])
+                    if mapper is None:
+                        return None
+                    target = CatchallTarget(mapper.class_)
 
-                query = request.dbsession.query(target._cls) \
+                query = query_cls(target._cls) \
                     .select_from(prop.parent) \
-                    .join(prop.class_attribute) \
-                    .filter(and_(*pkey_filter))
-                getter = None
-
-            if not prop.uselist:
-                # target is single item fk
-                getter = _get_assert_one
+                    .join(prop.class_attribute)
 
         if 'slice' in route:
             # cannot slice if pkey or single item drilldown encountered
-            if getter is not None:
-                return False
-
-            slicer = route['slice']
-            if 'index' in slicer:
-                getter = _get_by_index(int(slicer['index']))
-            else:
-                match['slicer'] = slicer
+            if ('pkey' in route and 'drilldown' not in route) or plan.single:
+                return None
+            plan.index = 'index' in route['slice']
 
-        profile = None
         if 'profile' in route:
             if route['profile'] not in target.profiles:
-                return False
-            profile = target.profiles[route['profile']]
-            profile = hints_parser.parseString(profile, True)
-            hints = self.get_hints(profile, target._cls, context=context)
-            query = query.options(*hints)
+                return None
+            plan.options.extend(
+                target.profile_options(route['profile'], context=context))
 
         # decode hints
         if 'hints' in route:
             try:
-                hints = self.get_hints(route['hints'], target._cls,
-                                       context=context)
-                query = query.options(*hints)
+                plan.options.extend(self.get_hints(route['hints'],
+                                                   target._cls,
+                                                   context=context))
             except AssertionError:
-                return False
+                return None
 
-        match['query'] = query
-        match['getter'] = getter
+        if query is not None:
+            plan.query = query.options(*plan.options)
+        return plan
 
-        return True
+    def bind(self, plan, request, session, route):
+        # applies a plan to the request's session and route values
+        ret = dict(route=route)
+        getter = None
+
+        filters = ()
+        if plan.filters is not None:
+            filters = plan.filters(request)
+            if type(filters) not in (list, tuple):
+                filters = (filters,)
+
+        # convert pkey
+        if 'pkey' in route:
+            try:
+                pkey = plan.meta.coerce_pkey(route['pkey'])
+            except ValueError:
+                return None
+            ret['pkey'] = pkey
+
+        if plan.drilldown is None:
+            query = plan.query.with_session(session).filter(*filters)
+            if 'pkey' in route:
+                getter = _pkey_getter(query, plan.meta.mapper, pkey)
+        else:
+            # pkey is the parent's
+            del ret['pkey']
+            if plan.dynamic:
+                root = plan.root.with_session(session).filter(*filters)
+                try:
+                    parent = _pkey_getter(root, plan.meta.mapper, pkey)(root)
+                except NoResultFound:
+                    parent = None
+                if parent is None:
+                    return None
+                query = getattr(parent, plan.drilldown).options(*plan.options)
+            else:
+                query = plan.query.with_session(session).filter(and_(
+                    *(col == val for col, val in
+                      zip(plan.meta.mapper.primary_key, pkey))))
+            if plan.single:
+                # target is single item fk
+                getter = _get_assert_one
+
+        if 'slice' in route:
+            slicer = route['slice']
+            if plan.index:
+                try:
+                    getter = _get_by_index(int(slicer['index']))
+                except ValueError:
+                    return None
+            else:
+                ret['slicer'] = slicer
+
+        ret['query'] = query
+        ret['getter'] = getter
+
+        return ret
 
     @staticmethod
     def get_hints(value, cls, base=orm, context=None):
@@ -615,6 +1051,9 @@ class CatchallView(CRUDView):
     query = None
     getter = None
     slicer = None
+    pkey = None
+    # allow DELETE on (filtered) lists
+    allow_list_delete = False
 
     def __init__(self, request):
         super().__init__(request)
@@ -624,13 +1063,25 @@ class CatchallView(CRUDView):
         self.target_type = self.query.column_descriptions[0]['type']
         self.target_name = self.target_type.__table__.name
         self.slicer = self.request.matchdict.get('slicer')
+        self.pkey = self.request.matchdict.get('pkey')
 
+        # filters and orderings come prebuilt from the metadata registry
         self.filters = self.auto_filters(target=self.target_type)
         self.accept_order = self.auto_order(target=self.target_type)
 
     def get_base_query(self):
+        session = self.query_session
+        if session is not self.request.dbsession:
+            return self.query.with_session(session)
         return self.query
 
+    @property
+    def identity_filter(self):
+        if self.pkey is None:
+            return False
+        return and_(*(col == value for col, value in
+                      zip(inspect(self.target_type).primary_key, self.pkey)))
+
     def get_one_from_query(self, query):
         if self.getter is None:
             raise HTTPNotFound()
@@ -640,10 +1091,59 @@ class CatchallView(CRUDView):
             query = query.order_by(None).order_by(*order_clauses)
         return self.getter(query)
 
+    def delete_query(self):
+        # single statement deletes need the target's primary key
+        if self.pkey is None:
+            return None
+        return self.get_identity_base().filter(
+            self.identity_filter, *self.query_filters)
+
+    @property
+    def advisor_key(self):
+        # hints apply to the drilldown target
+        route = self.request.matchdict['route']
+        if 'drilldown' in route:
+            return f"{route['verb']}/{route['drilldown']}"
+        return route['verb']
+
+    @property
+    def is_aggregate(self):
+        return self.group_param in self.request.GET or \
+            self.aggregate_param in self.request.GET
+
+    def aggregate(self):
+        if self.slicer is not None:
+            raise HTTPNotFound()
+        return super().aggregate()
+
+    def delete_list_query(self):
+        # the objects DELETE on a list deletes
+        query = self.get_list_base().filter(self.context_filter,
+                                            *self.query_filters)
+        if 'drilldown' in self.request.matchdict['route']:
+            # drilldown queries select from the parent; delete by key
+            pkey = tuple(inspect(self.target_type).primary_key)
+            subquery = query.with_entities(*pkey).subquery()
+            query = query.session.query(self.target_type).filter(
+                tuple_(*pkey).in_(subquery.select()) if len(pkey) > 1
+                else pkey[0].in_(subquery.select()))
+        return query
+
+    def delete_list(self):
+        if not self.allow_list_delete or self.slicer is not None:
+            raise HTTPNotFound()
+        query = self.delete_list_query()
+        with transaction.manager:
+            count = self.bulk_delete(query)
+        self.written()
+        return dict(deleted=count)
+
     def process(self):
         if self.request.method == 'GET':
             if self.getter is not None:
                 return self.get()
+            if self.is_aggregate:
+                return self.aggregate()
             return self.list()
         elif self.request.method == 'POST':
             if self.getter is not None:
@@ -651,7 +1151,7 @@ class CatchallView(CRUDView):
             return self.insert()
         elif self.request.method == 'DELETE':
             if self.getter is None:
-                raise HTTPNotFound()
+                return self.delete_list()
             return self.delete()
         raise HTTPNotFound()
 
@@ -664,14 +1164,16 @@ class CatchallView(CRUDView):
 
 
 def includeme_factory(base_class=None, config_json=True, add_predicates=True,
-                      wsgi_iter=False, separators=(',', ':')):
+                      wsgi_iter=False, separators=(',', ':'),
+                      result_cache=None, timing=False, metrics=False,
+                      profiling=False, iterative=False, warmup=False):
     def includeme(config):
         if config_json and base_class is not None:
             config.add_renderer(
                 'json',
                 pyramid_json_renderer_factory(
                     base_class, wsgi_iter=wsgi_iter,
-                    separators=separators))
+                    separators=separators, iterative=iterative))
             config.add_request_method(pyramid_json_decoder, 'json', reify=True)
         if add_predicates:
             config.add_view_predicate(
@@ -679,5 +1181,30 @@ def includeme_factory(base_class=None, config_json=True, add_predicates=True,
             config.add_view_predicate('catchall', CatchallPredicate)
         if base_class is not None:
             patch_sqlalchemy_base_class(base_class)
+            if hasattr(base_class, 'registry'):
+                orm.configure_mappers()
+                for mapper in base_class.registry.mappers:
+                    registry.register(mapper.class_)
+        if result_cache is not None:
+            # invalidate cached results whenever a session commits changes
+            result_cache.listen()
+        if metrics:
+            _metrics.metrics.enabled = True
+            config.add_tween('py_liant.metrics.metrics_tween_factory',
+                             under=INGRESS)
+            if result_cache is not None:
+                _metrics.metrics.track_cache('result_cache', result_cache)
+        if timing:
+            # outermost, so that pyramid_tm commits are timed as well
+            config.add_tween('py_liant.timing.timing_tween_factory',
+                             under=INGRESS)
+            listen_timing()
+        if profiling:
+            config.include('py_liant.profiling')
+        if warmup:
+            from .warmup import warmup as _warmup
+            # after the actions registering views, and so their catchall
+            # predicates
+            config.action(None, _warmup, args=(base_class,), order=10000)
 
     return includeme
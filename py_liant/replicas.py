@@ -0,0 +1,93 @@
+import itertools
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+
+_environ_key = 'py_liant.replica_session'
+
+
+class ReplicaRouter:
+    '''
+    Routes CRUDView/CatchallView reads to a pool of replica engines.
+
+    `strategy` is either 'round_robin' or 'least_busy' (fewest connections
+    checked out). When `pin_seconds` is set, a client that wrote through a
+    view reads from the primary (request.dbsession) for that many seconds.
+    With a `tenant_router` (py_liant.tenancy), replica sessions use the
+    request's tenant schema.
+    '''
+    strategies = ('round_robin', 'least_busy')
+
+    def __init__(self, replicas, strategy='round_robin', pin_seconds=0,
+                 session_factory=Session, max_pinned=65536,
+                 tenant_router=None):
+        if strategy not in self.strategies:
+            raise ValueError(f'unknown strategy {strategy!r}')
+        self.replicas = tuple(replicas)
+        self.strategy = strategy
+        self.session_factory = session_factory
+        self.tenant_router = tenant_router
+        self.pin_seconds = pin_seconds
+        self._pinned = LRUCache(max_pinned, pin_seconds) if pin_seconds \
+            else None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._busy = {id(engine): 0 for engine in self.replicas}
+        for engine in self.replicas:
+            event.listen(engine, 'checkout', self._checkout(engine))
+            event.listen(engine, 'checkin', self._checkin(engine))
+
+    def _checkout(self, engine):
+        def _impl(dbapi_connection, record, proxy):
+            with self._lock:
+                self._busy[id(engine)] += 1
+        return _impl
+
+    def _checkin(self, engine):
+        def _impl(dbapi_connection, record):
+            with self._lock:
+                self._busy[id(engine)] -= 1
+        return _impl
+
+    def busy(self, engine):
+        return self._busy[id(engine)]
+
+    def choose(self):
+        if self.strategy == 'least_busy':
+            return min(self.replicas, key=self.busy)
+        return self.replicas[next(self._counter) % len(self.replicas)]
+
+    def client_key(self, request):
+        userid = request.authenticated_userid
+        return ('user', userid) if userid is not None \
+            else ('addr', request.client_addr)
+
+    def pin(self, request):
+        # called after a client wrote through a view
+        if self._pinned is not None:
+            self._pinned.set(self.client_key(request), True)
+
+    def is_pinned(self, request):
+        return self._pinned is not None and \
+            self._pinned.get(self.client_key(request), False)
+
+    def read_session(self, request):
+        # one replica session per request, closed when the request finishes;
+        # pinned clients read from request.dbsession
+        session = request.environ.get(_environ_key)
+        if session is None:
+            if not self.replicas or self.is_pinned(request):
+                session = request.dbsession
+            else:
+                bind = self.choose()
+                if self.tenant_router is not None:
+                    bind = self.tenant_router.translate(
+                        bind, self.tenant_router.tenant(request))
+                session = self.session_factory(bind=bind)
+                request.add_finished_callback(
+                    lambda request: session.close())
+            request.environ[_environ_key] = session
+        return session
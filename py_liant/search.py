@@ -0,0 +1,271 @@
+import re
+
+from sqlalchemy import Boolean, String, bindparam, event, func, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.inspection import inspect
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.traversals import InternalTraversal
+from sqlalchemy.types import TypeDecorator
+
+# Index backed search filters. declare_search() registers the searchable
+# columns of a mapped class and the DDL for the indexes they need; metadata
+# then adds <field>_search filters for each column and one filter searching
+# all of them (named after `param`, 'q' by default) to auto_filters.
+#
+# PostgreSQL: 'fulltext' matches to_tsvector(...) @@ websearch_to_tsquery(...)
+# using GIN expression indexes, 'trigram' uses the pg_trgm similarity
+# operator % with gin_trgm_ops indexes (the extension must be installed).
+# SQLite: an FTS5 external content table <table>_search kept up to date by
+# triggers. Other dialects fall back to case insensitive LIKE.
+
+_config_name = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_terms = re.compile(r'"([^"]*)"|(\S+)')
+
+_specs = dict()
+
+
+class SearchSpec:
+    methods = ('fulltext', 'trigram')
+
+    def __init__(self, cls, keys, method='fulltext', config='simple',
+                 param='q'):
+        if method not in self.methods:
+            raise ValueError(f'unknown search method {method!r}')
+        if not _config_name.match(config):
+            raise ValueError(f'invalid text search configuration {config!r}')
+        mapper = inspect(cls)
+        self.cls = mapper.class_
+        self.keys = tuple(keys)
+        self.method, self.config, self.param = method, config, param
+        self.table = mapper.local_table
+        self.columns = tuple(mapper.get_property(key).columns[0]
+                             for key in self.keys)
+        self.pkey = mapper.primary_key
+        self.fts_table = f'{self.table.name}_search'
+
+    # DDL
+
+    def create(self, target, connection, **kw):
+        for statement in self.ddl(connection.dialect):
+            connection.exec_driver_sql(statement)
+
+    def drop(self, target, connection, **kw):
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql(
+                f'DROP TABLE IF EXISTS {self._quote(connection.dialect)}')
+
+    def _quote(self, dialect, name=None):
+        return dialect.identifier_preparer.quote(
+            self.fts_table if name is None else name)
+
+    def ddl(self, dialect):
+        preparer = dialect.identifier_preparer
+        table = preparer.format_table(self.table)
+        names = [preparer.quote(col.name) for col in self.columns]
+        if dialect.name == 'postgresql':
+            return self._postgresql_ddl(preparer, table, names)
+        if dialect.name == 'sqlite':
+            return self._sqlite_ddl(preparer, table, names)
+        return []
+
+    def _index_name(self, preparer, suffix):
+        return preparer.quote(f'ix_{self.table.name}_{suffix}_search')
+
+    def _postgresql_ddl(self, preparer, table, names):
+        ret = []
+        for col, name in zip(self.columns, names):
+            if self.method == 'trigram':
+                expression = f'{name} gin_trgm_ops'
+            else:
+                expression = _tsvector(self.config, [name])
+            ret.append(f'CREATE INDEX {self._index_name(preparer, col.name)} '
+                       f'ON {table} USING gin ({expression})')
+        if self.method == 'fulltext' and len(names) > 1:
+            ret.append(f'CREATE INDEX {self._index_name(preparer, self.param)}'
+                       f' ON {table} USING gin '
+                       f'({_tsvector(self.config, names)})')
+        return ret
+
+    def _sqlite_ddl(self, preparer, table, names):
+        if len(self.pkey) != 1:
+            raise ValueError('FTS5 search needs a single integer primary key')
+        fts = self._quote(preparer.dialect)
+        pkey = self.pkey[0].name
+        rowid = preparer.quote(pkey)
+        columns = ', '.join(names)
+        new = ', '.join(f'new.{name}' for name in names)
+        old = ', '.join(f'old.{name}' for name in names)
+        insert = f'INSERT INTO {fts}(rowid, {columns}) ' \
+            f'VALUES (new.{rowid}, {new});'
+        delete = f'INSERT INTO {fts}({fts}, rowid, {columns}) ' \
+            f"VALUES ('delete', old.{rowid}, {old});"
+        trigger = preparer.quote(f'{self.fts_table}_a')
+        return [
+            f'CREATE VIRTUAL TABLE {fts} USING fts5({columns}, '
+            f"content='{self.table.name}', content_rowid='{pkey}')",
+            f'CREATE TRIGGER {trigger}i AFTER INSERT ON {table} '
+            f'BEGIN {insert} END',
+            f'CREATE TRIGGER {trigger}d AFTER DELETE ON {table} '
+            f'BEGIN {delete} END',
+            f'CREATE TRIGGER {trigger}u AFTER UPDATE ON {table} '
+            f'BEGIN {delete} {insert} END',
+        ]
+
+    def rebuild(self, connection):
+        # fills the SQLite search table for rows that existed before it
+        if connection.dialect.name == 'sqlite':
+            fts = self._quote(connection.dialect)
+            connection.exec_driver_sql(
+                f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    # filters
+
+    def match(self, target, keys, value):
+        return SearchMatch(
+            [getattr(target, key) for key in keys],
+            bindparam(None, value, type_=_SearchText(), unique=True),
+            getattr(target, inspect(target).mapper.get_property_by_column(
+                self.pkey[0]).key) if len(self.pkey) == 1 else None,
+            self.method, self.config, self.fts_table,
+            '' if keys == self.keys else ' '.join(
+                inspect(self.cls).get_property(key).columns[0].name
+                for key in keys))
+
+    def filters(self, target, prefix=None):
+        prefix = prefix or ''
+        ret = {f'{prefix}{key}_search':
+               lambda x, key=key: self.match(target, (key,), x)
+               for key in self.keys}
+        ret[f'{prefix}{self.param}'] = \
+            lambda x: self.match(target, self.keys, x)
+        return ret
+
+
+def declare_search(cls, *keys, method='fulltext', config='simple', param='q'):
+    '''
+    Makes the given attributes of cls searchable; call before the tables
+    are created and before views are configured.
+    '''
+    spec = SearchSpec(cls, keys, method, config, param)
+    previous = _specs.get(spec.cls)
+    if previous is not None:
+        event.remove(previous.table, 'after_create', previous.create)
+        event.remove(previous.table, 'before_drop', previous.drop)
+    _specs[spec.cls] = spec
+    event.listen(spec.table, 'after_create', spec.create)
+    event.listen(spec.table, 'before_drop', spec.drop)
+    return spec
+
+
+def search_spec(cls):
+    for mapper in inspect(cls).mapper.iterate_to_root():
+        spec = _specs.get(mapper.class_)
+        if spec is not None:
+            return spec
+    return None
+
+
+def search_filters(target, prefix=None):
+    spec = search_spec(target)
+    return spec.filters(target, prefix) if spec is not None else dict()
+
+
+def _tsvector(config, names):
+    document = " || ' ' || ".join(f"coalesce({name}, '')" for name in names)
+    return f"to_tsvector('{config}'::regconfig, {document})"
+
+
+def fts5_query(value):
+    # websearch-like input to an FTS5 query: "quoted phrases", or, -negation;
+    # all other terms are quoted so the input cannot break the syntax
+    ret = []
+    for phrase, word in _terms.findall(value):
+        if not phrase and word.lower() == 'or':
+            if ret and ret[-1] != 'OR':
+                ret.append('OR')
+            continue
+        if not phrase and word in ('', '-'):
+            continue
+        negated = not phrase and word.startswith('-')
+        text = phrase or (word[1:] if negated else word)
+        text = '"' + text.replace('"', '""') + '"'
+        if negated:
+            if not ret or ret[-1] == 'OR':
+                # FTS5 has no unary NOT
+                continue
+            text = 'NOT ' + text
+        ret.append(text)
+    if ret and ret[-1] == 'OR':
+        ret.pop()
+    return ' '.join(ret) if ret else '""'
+
+
+class _SearchText(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == 'sqlite':
+            return fts5_query(value)
+        return value
+
+
+class SearchMatch(ColumnElement):
+    __visit_name__ = 'search_match'
+    type = Boolean()
+
+    _traverse_internals = [
+        ('columns', InternalTraversal.dp_clauseelement_tuple),
+        ('value', InternalTraversal.dp_clauseelement),
+        ('pkey', InternalTraversal.dp_clauseelement),
+        ('method', InternalTraversal.dp_string),
+        ('config', InternalTraversal.dp_string),
+        ('fts_table', InternalTraversal.dp_string),
+        ('fts_columns', InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, columns, value, pkey, method, config, fts_table,
+                 fts_columns):
+        self.columns = tuple(col.__clause_element__() for col in columns)
+        self.value = value
+        self.pkey = pkey.__clause_element__() if pkey is not None else None
+        self.method, self.config = method, config
+        self.fts_table, self.fts_columns = fts_table, fts_columns
+
+    @property
+    def _from_objects(self):
+        return [from_obj for col in self.columns
+                for from_obj in col._from_objects]
+
+
+@compiles(SearchMatch)
+def _compile_default(element, compiler, **kw):
+    value = func.lower(element.value)
+    return compiler.process(or_(*(func.lower(col).contains(value)
+                                  for col in element.columns)), **kw)
+
+
+@compiles(SearchMatch, 'postgresql')
+def _compile_postgresql(element, compiler, **kw):
+    value = compiler.process(element.value, **kw)
+    if element.method == 'trigram':
+        operator = '%%' if compiler.preparer._double_percents else '%'
+        return '(' + ' OR '.join(
+            f'{compiler.process(col, **kw)} {operator} {value}'
+            for col in element.columns) + ')'
+    document = _tsvector(element.config, [compiler.process(col, **kw)
+                                          for col in element.columns])
+    return f"{document} @@ websearch_to_tsquery(" \
+        f"'{element.config}'::regconfig, {value})"
+
+
+@compiles(SearchMatch, 'sqlite')
+def _compile_sqlite(element, compiler, **kw):
+    if element.pkey is None:
+        return _compile_default(element, compiler, **kw)
+    fts = compiler.preparer.quote(element.fts_table)
+    value = compiler.process(element.value, **kw)
+    if element.fts_columns:
+        value = f"'{{{element.fts_columns}}} : (' || {value} || ')'"
+    return f'{compiler.process(element.pkey, **kw)} IN ' \
+        f'(SELECT rowid FROM {fts} WHERE {fts} MATCH {value})'
@@ -1,33 +1,86 @@
-from sqlalchemy.interfaces import PoolListener
+from sqlalchemy import event
 import logging
 
 sa_logger = logging.getLogger('sqlalchemy')
 
 
-class SearchPathSetter(PoolListener):
+class SearchPathSetter:
     '''
-    Dynamically sets the search path on connections checked out from a pool.
+    Sets the schema search path on the connections of an engine's pool.
+
+    The statement runs once when a connection is created; checkouts only
+    compare the path applied to the connection with `search_path` and run it
+    again if it changed.
     '''
+    _info_key = 'py_liant.search_path'
+    # dialect of the pool, for the PoolListener interface
+    _dialect = None
 
-    def __init__(self, search_path='public'):
+    def __init__(self, search_path='public', engine=None):
         self.search_path = search_path
+        if engine is not None:
+            self.listen(engine)
+
+    @property
+    def search_path(self):
+        return self._search_path
+
+    @search_path.setter
+    def search_path(self, value):
+        self._search_path = value
+        # statements by dialect
+        self._statements = {}
 
     @staticmethod
     def quote_schema(dialect, schema):
-        return dialect.identifier_preparer.quote_schema(schema, False)
+        return dialect.identifier_preparer.quote_schema(schema)
 
-    def checkout(self, dbapi_con, con_record, con_proxy):
-        dialect = con_proxy._pool._dialect
-        search_path = [
-            self.quote_schema(dialect, _.strip())
-            for _ in self.search_path.split(',')
-            if _.strip()
-        ]
-        if 'public' not in search_path:
-            search_path.append('public')
-        cursor = dbapi_con.cursor()
-        statement = "SET search_path TO %s;" % ', '.join(search_path)
+    def statement(self, dialect):
+        statement = self._statements.get(dialect)
+        if statement is None:
+            search_path = [
+                self.quote_schema(dialect, _.strip())
+                for _ in self.search_path.split(',')
+                if _.strip()
+            ]
+            if 'public' not in search_path:
+                search_path.append('public')
+            statement = "SET search_path TO %s;" % ', '.join(search_path)
+            self._statements[dialect] = statement
+        return statement
+
+    def apply(self, dialect, dbapi_con, con_record):
+        statement = self.statement(dialect)
+        if con_record.info.get(self._info_key) == statement:
+            return
         sa_logger.info(statement)
+        cursor = dbapi_con.cursor()
         cursor.execute(statement)
-        dbapi_con.commit()
         cursor.close()
+        # keep the setting past the rollback on return to the pool
+        dbapi_con.commit()
+        con_record.info[self._info_key] = statement
+
+    def listen(self, engine):
+        dialect = engine.dialect
+
+        def connect(dbapi_con, con_record):
+            self.apply(dialect, dbapi_con, con_record)
+
+        def checkout(dbapi_con, con_record, con_proxy):
+            self.apply(dialect, dbapi_con, con_record)
+
+        event.listen(engine, 'connect', connect)
+        event.listen(engine, 'checkout', checkout)
+        return engine
+
+    # PoolListener interface, kept for create_engine(listeners=[...]) and
+    # pool.add_listener() on SQLAlchemy < 1.4; listen(engine) replaces it
+    def connect(self, dbapi_con, con_record):
+        # the pool's dialect is known from the first checkout on
+        if self._dialect is not None:
+            self.apply(self._dialect, dbapi_con, con_record)
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        self._dialect = con_proxy._pool._dialect
+        self.apply(self._dialect, dbapi_con, con_record)
@@ -6,6 +6,7 @@ from sqlalchemy import (
     Integer, Text, DateTime, Interval, BLOB
 )
 from py_liant.enum import PythonEnum
+from py_liant.search import declare_search
 from sqlalchemy.orm import (
     sessionmaker, configure_mappers,
     relationship, backref
@@ -53,6 +54,51 @@ class Child(Base):
         'children', cascade='all, delete-orphan'))
 
 
+class Animal(Base):
+    id = Column(Integer, primary_key=True)
+    kind = Column(Text, nullable=False)
+    name = Column(Text)
+
+    __mapper_args__ = dict(
+        polymorphic_on=kind,
+        polymorphic_identity='animal'
+    )
+
+
+class Dog(Animal):
+    # single table inheritance
+    __tablename__ = None
+    barks = Column(Integer)
+
+    __mapper_args__ = dict(
+        polymorphic_identity='dog'
+    )
+
+
+class Folder(Base):
+    id = Column(Integer, primary_key=True)
+    name = Column(Text)
+
+
+class Note(Base):
+    # deleting a folder leaves its notes to the database
+    id = Column(Integer, primary_key=True)
+    folder_id = Column(ForeignKey(Folder.id, ondelete="CASCADE"), index=True)
+    data = Column(Text)
+
+    folder = relationship(Folder, backref=backref(
+        'notes', cascade='all, delete-orphan', passive_deletes=True))
+
+
+class Document(Base):
+    id = Column(Integer, primary_key=True)
+    title = Column(Text)
+    body = Column(Text)
+
+
+declare_search(Document, 'title', 'body')
+
+
 # finalize mappers
 configure_mappers()
 
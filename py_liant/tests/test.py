@@ -118,6 +118,9 @@ class TestJsonEncoderDecoder(EngineTest):
                         data5=ParentType.type1)
         parent.children.append(Child(data='child value'))
         self.session.add(parent)
+        # the identity map is weak; keep the objects (and the loaded
+        # child.parent) regardless of when the garbage collector runs
+        self.parent = parent
 
     def test_json_serialization(self):
         from py_liant.json_encoder import JSONEncoder
@@ -131,6 +134,43 @@ class TestJsonEncoderDecoder(EngineTest):
         self.assertMultiLineEqual(info, self.expected_json,
                                   "JSON encoded correctly")
 
+    def test_iterative_serialization(self):
+        from py_liant.json_encoder import JSONEncoder
+        from ..tests.models import Base, Parent
+        from sqlalchemy.orm import joinedload
+        encoder = JSONEncoder(base_type=Base, check_circular=False,
+                              indent=4 * ' ', sort=True, iterative=True)
+        obj = self.session.query(Parent).options(
+            joinedload(Parent.children)).get(1)
+        self.assertMultiLineEqual(encoder.encode(obj), self.expected_json)
+
+    def test_iterative_deep_chain(self):
+        from sqlalchemy import Column, ForeignKey, Integer
+        from sqlalchemy.orm import declarative_base, relationship
+        from py_liant.json_encoder import JSONEncoder
+        ChainBase = declarative_base()
+
+        class Link(ChainBase):
+            __tablename__ = 'link'
+            id = Column(Integer, primary_key=True)
+            next_id = Column(ForeignKey('link.id'))
+            next = relationship('Link', remote_side=[id])
+
+        head = link = Link(id=0)
+        for i in range(1, 100000):
+            link.next = Link(id=i)
+            link = link.next
+        # back to the head, written as a reference
+        link.next = head
+        encoder = JSONEncoder(base_type=ChainBase, check_circular=False,
+                              separators=(',', ':'), iterative=True)
+        info = encoder.encode(head)
+        self.assertEqual(encoder.counter, 100000)
+        self.assertTrue(info.startswith('{"id":0,"next":{"id":1,"next":'))
+        self.assertTrue(info.endswith(
+            '{"id":99999,"next":{"_ref":1},"_id":100000}' +
+            ''.join(f',"_id":{i}}}' for i in range(99999, 0, -1))))
+
     def test_json_deserialization(self):
         from py_liant.json_decoder import JSONDecoder
         from py_liant.json_object import JsonObject
@@ -251,3 +291,1668 @@ class TestApplyChanges(EngineTest):
         self.assertIsNone(obj_child2.id, "second child is transient")
         self.assertEqual(obj_child2.data, "new child value",
                          "second child correct value")
+
+    def test_guard_batches(self):
+        from py_liant.interfaces import JsonGuardProvider
+        from py_liant.json_decoder import JSONDecoder
+        from py_liant.json_encoder import JSONEncoder
+        from ..tests.models import Base, Parent, Child
+        calls = []
+
+        class Guard(JsonGuardProvider):
+            guardHints = guardDrilldown = None
+
+            def guardUpdate(self, obj, data, for_update=True):
+                calls.append(('update', type(obj)))
+                return True
+
+            def guardSerialize(self, obj, value):
+                calls.append(('serialize', type(obj)))
+
+            def guardUpdateBatch(self, cls, items):
+                calls.append(('updateBatch', cls, [
+                    (obj.id, data.get('data'), for_update)
+                    for obj, data, for_update in items]))
+
+            def guardSerializeBatch(self, cls, objects):
+                calls.append(('serializeBatch', cls, len(objects)))
+
+        obj = self.session.query(Parent).get(1)
+        data = JSONDecoder().decode('''{"children": [
+            {"id": 1, "data": "changed"}, {"data": "new 1"},
+            {"data": "new 2"}]}''')
+        obj.apply_changes(data, context=Guard())
+        # once per class for the whole tree, before any change
+        self.assertEqual(calls, [
+            ('updateBatch', Parent, [(1, None, True)]),
+            ('updateBatch', Child, [(1, 'changed', True),
+                                    (None, 'new 1', False),
+                                    (None, 'new 2', False)]),
+            ('update', Parent),
+            ('update', Child), ('update', Child), ('update', Child)])
+
+        # scalar relationships included
+        calls.clear()
+        child = self.session.query(Child).get(2)
+        child.apply_changes(JSONDecoder().decode(
+            '{"data": "moved", "parent": {"id": 1, "data1": "p"}}'),
+            context=Guard())
+        self.assertEqual(calls, [
+            ('updateBatch', Child, [(2, 'moved', True)]),
+            ('updateBatch', Parent, [(1, None, True)]),
+            ('update', Child), ('update', Parent)])
+        self.assertIs(child.parent, obj)
+        self.assertEqual(obj.data1, 'p')
+
+        calls.clear()
+        self.session.flush()
+        request = testing.DummyRequest(context=Guard())
+        JSONEncoder(request, base_type=Base, check_circular=False) \
+            .encode([obj])
+        self.assertEqual(sorted(calls[:2], key=repr), [
+            ('serializeBatch', Child, 3), ('serializeBatch', Parent, 1)])
+        self.assertEqual(len(calls), 6)
+
+
+class ViewTest(EngineTest):
+    # base for tests that drive views with a populated database
+    def setUp(self):
+        super().setUp()
+        self.init_database()
+
+        from ..tests.models import Parent, Child, ParentType
+        from datetime import datetime, timedelta
+        with transaction.manager:
+            for i in range(3):
+                parent = Parent(data1=f'parent value {i}',
+                                data2=datetime(2000, 1, 1, 0, 0, 0),
+                                data3=timedelta(days=1.3),
+                                data4=b'test',
+                                data5=ParentType.type1)
+                parent.children.append(Child(data=f'child value {i}'))
+                self.session.add(parent)
+
+        from sqlalchemy import event
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     self.count_statement)
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def make_request(self, path, method='GET', body=None, matchdict=None,
+                     context=None):
+        from pyramid.request import Request
+        from py_liant.pyramid import pyramid_json_decoder
+        request = Request.blank(path, method=method)
+        if body is not None:
+            request.body = body.encode()
+        request.registry = self.config.registry
+        request.dbsession = self.session
+        request.context = context
+        request.matchdict = matchdict if matchdict is not None else {}
+        request.set_property(pyramid_json_decoder, 'json', reify=True)
+        return request
+
+
+class TestResultCache(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.cache import ResultCache
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Parent
+
+        self.cache = ResultCache()
+        self.cache.listen(self.session)
+
+        class ParentView(CRUDView):
+            target_type = Parent
+            target_name = 'parent'
+            result_cache = self.cache
+
+            def __init__(self, request):
+                super().__init__(request)
+                self.filters = self.auto_filters()
+                self.accept_order = self.auto_order()
+
+        self.view = ParentView
+
+    def test_list_hit(self):
+        path = '/parent?order=id+desc&pageSize=2'
+        first = self.view(self.make_request(path)).list()
+        self.assertEqual(self.cache.misses, 1)
+        del self.statements[:]
+        second = self.view(self.make_request(path)).list()
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(len(self.statements), 1, "no count query on hit")
+        self.assertEqual(second['total'], 3)
+        self.assertEqual([_.id for _ in second['items']],
+                         [_.id for _ in first['items']])
+        self.assertEqual([_.id for _ in second['items']], [3, 2])
+
+    def test_key_includes_filters(self):
+        self.view(self.make_request('/parent?id_gt=1')).list()
+        result = self.view(self.make_request('/parent?id_gt=2')).list()
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(result['total'], 1)
+
+    def test_invalidate_on_commit(self):
+        self.view(self.make_request('/parent')).list()
+        self.view(self.make_request(
+            '/parent', 'POST', '{"parent": {"data1": "new value"}}'
+        )).insert()
+        result = self.view(self.make_request('/parent')).list()
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(result['total'], 4)
+
+    def test_rollback_keeps_entries(self):
+        from ..tests.models import Parent
+        self.view(self.make_request('/parent')).list()
+        self.session.add(Parent(data1='discarded'))
+        self.session.flush()
+        transaction.abort()
+        self.view(self.make_request('/parent')).list()
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_savepoint_rollback_keeps_pending(self):
+        from ..tests.models import Parent
+        self.view(self.make_request('/parent')).list()
+        self.session.add(Parent(data1='kept'))
+        self.session.flush()
+        savepoint = self.session.begin_nested()
+        self.session.add(Parent(data1='discarded'))
+        self.session.flush()
+        savepoint.rollback()
+        transaction.commit()
+        result = self.view(self.make_request('/parent')).list()
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(result['total'], 4)
+
+
+class TestCatchallPredicate(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CatchallPredicate
+        from ..tests.models import Parent, Child
+        self.predicate = CatchallPredicate({
+            'parent': {'cls': Parent, 'profiles': {'full': '*children'}},
+            'child': Child
+        }, self.config)
+
+    def test_profile_precompiled(self):
+        from ..tests.models import Parent
+        target = self.predicate.targets['parent']
+        self.assertIn(('full', Parent), target._profile_options)
+
+    def test_get_with_profile(self):
+        request = self.make_request(
+            '/', matchdict={'catchall': 'parent@2:full'})
+        self.assertTrue(self.predicate(None, request))
+        match = request.matchdict
+        obj = match['getter'](match['query'])
+        self.assertEqual(obj.id, 2)
+        self.assertIn('children', obj.__dict__, "profile hints applied")
+        self.assertEqual(match['route']['profile'], 'full')
+
+    def test_invalid_routes(self):
+        for route in ('parent@', 'unknown', 'parent:missing', 'parent@1,2',
+                      'child@1[0]'):
+            request = self.make_request('/', matchdict={'catchall': route})
+            with self.subTest(route=route):
+                self.assertFalse(self.predicate(None, request))
+
+    def test_route_cache(self):
+        from py_liant.pyramid import route_cache
+        route_cache.clear()
+        for i in range(2):
+            request = self.make_request(
+                '/', matchdict={'catchall': 'child[0:1]:+parent'})
+            self.assertTrue(self.predicate(None, request))
+        self.assertIn('child[0:1]:+parent', route_cache)
+        self.assertEqual(request.matchdict['slicer'],
+                         {'start': '0', 'stop': '1'})
+
+    def test_evaluated_once_per_request(self):
+        from unittest import mock
+        request = self.make_request('/', matchdict={'catchall': 'parent@1'})
+        with mock.patch.object(self.predicate, 'evaluate',
+                               wraps=self.predicate.evaluate) as evaluate:
+            self.assertTrue(self.predicate(None, request))
+            query = request.matchdict['query']
+            self.assertTrue(self.predicate(None, request))
+            self.assertEqual(evaluate.call_count, 1)
+        self.assertIs(request.matchdict['query'], query)
+
+
+class TestViewMetadata(ViewTest):
+    def test_includeme_registers_mappers(self):
+        from py_liant.metadata import registry
+        from py_liant.pyramid import includeme_factory
+        from ..tests.models import Base, Parent, Animal, Dog
+        registry.clear()
+        self.config.include(includeme_factory(
+            base_class=Base, config_json=False, add_predicates=False))
+        for cls in (Parent, Animal, Dog):
+            self.assertIn(cls, registry)
+
+    def test_auto_filters_shared(self):
+        from py_liant.metadata import view_metadata
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Parent
+        filters = CRUDView.auto_filters(target=Parent)
+        meta = view_metadata(Parent)
+        self.assertIsNot(filters, meta.filters)
+        self.assertIs(filters['id_in'], meta.filters['id_in'])
+        self.assertIn('data1_like', filters)
+        self.assertNotIn('data2_like', filters)
+        self.assertIn('pfx_id', CRUDView.auto_filters(Parent, prefix='pfx_'))
+        self.assertEqual(set(CRUDView.auto_order(Parent)),
+                         {'id', 'data1', 'data2', 'data3', 'data4', 'data5'})
+
+    def test_polymorphic_cast(self):
+        from py_liant.metadata import view_metadata
+        from ..tests.models import Parent, Animal, Dog
+        meta = view_metadata(Animal)
+        self.assertIs(meta.polymorphic_cast('dog').class_, Dog)
+        self.assertIsNone(meta.polymorphic_cast('cat'))
+        self.assertIsNone(view_metadata(Parent).polymorphic_cast('dog'))
+        self.assertEqual(meta.coerce_pkey(('12',)), (12,))
+        self.assertIn('children', view_metadata(Parent).relationships)
+
+    def test_catchall_view_filters(self):
+        from py_liant.pyramid import CatchallPredicate, CatchallView
+        from ..tests.models import Animal, Dog
+        with transaction.manager:
+            self.session.add(Animal(name='generic'))
+            self.session.add(Dog(name='rex', barks=3))
+        predicate = CatchallPredicate({'animal': Animal}, self.config)
+        request = self.make_request('/?barks_gt=1',
+                                    matchdict={'catchall': 'animal!dog'})
+        self.assertTrue(predicate(None, request))
+        view = CatchallView(request)
+        self.assertIs(view.target_type, Dog)
+        self.assertIn('barks_gt', view.filters)
+        result = view.list()
+        self.assertEqual([_.name for _ in result['items']], ['rex'])
+
+
+class TestReplicaRouter(ViewTest):
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Base, Parent
+
+        # replicas hold distinguishable copies of the data
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.replicas = []
+        for i in range(2):
+            engine = create_engine(
+                f'sqlite:///{self.tmpdir.name}/replica{i}.db')
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                session.add_all(Parent(id=j + 1, data1=f'replica {i}')
+                                for j in range(3))
+                session.commit()
+            self.replicas.append(engine)
+
+        class ParentView(CRUDView):
+            target_type = Parent
+            target_name = 'parent'
+
+            @property
+            def identity_filter(self):
+                return Parent.id == int(self.request.matchdict['id'])
+
+        self.view = ParentView
+
+    def tearDown(self):
+        for engine in self.replicas:
+            engine.dispose()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def read(self, path='/parent', **kwargs):
+        request = self.make_request(path, **kwargs)
+        result = self.view(request).list()
+        value = result['items'][0].data1
+        request._process_finished_callbacks()
+        return value
+
+    def test_round_robin(self):
+        from py_liant.replicas import ReplicaRouter
+        self.view.replica_router = ReplicaRouter(self.replicas)
+        self.assertEqual([self.read() for _ in range(3)],
+                         ['replica 0', 'replica 1', 'replica 0'])
+
+    def test_least_busy(self):
+        from py_liant.replicas import ReplicaRouter
+        router = self.view.replica_router = ReplicaRouter(
+            self.replicas, strategy='least_busy')
+        with self.replicas[0].connect():
+            self.assertEqual(router.busy(self.replicas[0]), 1)
+            self.assertEqual(self.read(), 'replica 1')
+        self.assertEqual(router.busy(self.replicas[0]), 0)
+
+    def test_writes_and_pinning(self):
+        from py_liant.replicas import ReplicaRouter
+        self.view.replica_router = ReplicaRouter(self.replicas,
+                                                 pin_seconds=60)
+        request = self.make_request(
+            '/parent/1', 'POST', '{"parent": {"data1": "written"}}',
+            matchdict={'id': '1'})
+        request.environ['REMOTE_ADDR'] = '10.0.0.1'
+        self.view.update_lock = True
+        self.assertEqual(self.view(request).update().data1, 'written')
+        self.assertIsNone(request.environ.get('py_liant.replica_session'))
+
+        # the writing client reads its own writes, others use replicas
+        request = self.make_request('/parent/1', matchdict={'id': '1'})
+        request.environ['REMOTE_ADDR'] = '10.0.0.1'
+        self.assertEqual(self.view(request).get()['parent'].data1, 'written')
+        self.assertEqual(self.read(), 'replica 0')
+
+    def test_catchall(self):
+        from py_liant.pyramid import CatchallPredicate, CatchallView
+        from py_liant.replicas import ReplicaRouter
+        from ..tests.models import Parent
+
+        class View(CatchallView):
+            replica_router = ReplicaRouter(self.replicas[1:])
+
+        predicate = CatchallPredicate({'parent': Parent}, self.config)
+        for route in ('parent', 'parent@2'):
+            request = self.make_request('/', matchdict={'catchall': route})
+            self.assertTrue(predicate(None, request))
+            result = View(request).process()
+            item = result['items'][0] if 'items' in result \
+                else result['parent']
+            self.assertEqual(item.data1, 'replica 1')
+
+
+class TestWritePath(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Parent
+
+        class ParentView(CRUDView):
+            target_type = Parent
+            target_name = 'parent'
+
+            @property
+            def identity_filter(self):
+                return Parent.id == int(self.request.matchdict['id'])
+
+        self.view = ParentView
+
+    def encode(self, value):
+        from py_liant.json_encoder import JSONEncoder
+        from ..tests.models import Base
+        return JSONEncoder(base_type=Base, sort=True).encode(value)
+
+    def test_update(self):
+        from ..tests.models import Parent
+        obj = self.view(self.make_request(
+            '/parent/2', 'POST',
+            '{"parent": {"data1": "changed", "children": [{"data": "new"}]}}',
+            matchdict={'id': '2'})).update()
+        # select, load children, update, insert and delete child; no reload
+        self.assertEqual(len(self.statements), 5)
+        self.assertNotIn('children', obj.__dict__)
+        del self.statements[:]
+        encoded = self.encode(obj)
+        self.assertEqual(self.statements, [], 'encoded from memory')
+        self.assertEqual(encoded, self.encode(self.session.get(Parent, 2)))
+
+    def test_insert(self):
+        from ..tests.models import Parent
+        obj = self.view(self.make_request(
+            '/parent', 'POST',
+            '{"parent": {"data1": "new", "children": [{"data": "a"}]}}'
+        )).insert()['parent']
+        self.assertEqual(len(self.statements), 2)
+        del self.statements[:]
+        encoded = self.encode(obj)
+        self.assertEqual(self.statements, [])
+        self.assertIn('"data2":null', encoded.replace(' ', ''))
+        self.assertEqual(encoded,
+                         self.encode(self.session.get(Parent, obj.id)))
+
+
+class TestBulkDelete(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CRUDView, CatchallPredicate
+        from ..tests.models import Parent, Child, Folder, Note
+
+        with transaction.manager:
+            for i in range(3):
+                folder = Folder(name=f'folder {i}')
+                folder.notes.append(Note(data=f'note {i}'))
+                self.session.add(folder)
+
+        # cascades are left to the database
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+        del self.statements[:]
+
+        def view(cls, name):
+            class View(CRUDView):
+                target_type = cls
+                target_name = name
+
+                def __init__(self, request):
+                    super().__init__(request)
+                    self.filters = self.auto_filters()
+
+                @property
+                def identity_filter(self):
+                    return cls.id == int(self.request.matchdict['id'])
+            return View
+
+        self.view = view(Folder, 'folder')
+        self.parent_view = view(Parent, 'parent')
+        self.predicate = CatchallPredicate(
+            {'parent': Parent, 'child': Child, 'folder': Folder,
+             'note': Note}, self.config)
+
+    def count(self, cls):
+        return self.session.query(cls).count()
+
+    def delete(self, view, path, id):
+        return view(self.make_request(path, 'DELETE',
+                                      matchdict={'id': id})).delete()
+
+    def catchall(self, route, path='/', allow_list_delete=True):
+        from py_liant.pyramid import CatchallView
+        request = self.make_request(path, 'DELETE',
+                                    matchdict={'catchall': route})
+        self.assertTrue(self.predicate(None, request))
+        view = CatchallView(request)
+        view.allow_list_delete = allow_list_delete
+        return view.process()
+
+    def test_metadata(self):
+        from py_liant.metadata import view_metadata
+        from ..tests.models import Parent, Child, Folder, Animal, Dog
+        for cls in (Folder, Child, Animal, Dog):
+            self.assertTrue(view_metadata(cls).can_bulk_delete())
+        # the ORM cascades Parent.children (no passive_deletes)
+        self.assertFalse(view_metadata(Parent).can_bulk_delete())
+
+    def test_single_statement(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        from ..tests.models import Note
+        self.delete(self.view, '/folder/2', '2')
+        self.assertEqual(len(self.statements), 1)
+        self.assertTrue(self.statements[0].startswith('DELETE FROM folder'))
+        self.assertEqual(self.count(Note), 2)
+        with self.assertRaises(HTTPNotFound):
+            self.delete(self.view, '/folder/3?name=other', '3')
+
+    def test_orm_cascade(self):
+        from ..tests.models import Child
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        self.delete(self.parent_view, '/parent/2', '2')
+        self.assertEqual(self.count(Child), 2, 'cascaded by the session')
+
+    def test_delete_events_fall_back(self):
+        from sqlalchemy import event
+        from ..tests.models import Folder
+        deleted = []
+
+        def _before_delete(mapper, connection, target):
+            deleted.append(target.id)
+        event.listen(Folder, 'before_delete', _before_delete)
+        try:
+            self.delete(self.view, '/folder/2', '2')
+        finally:
+            event.remove(Folder, 'before_delete', _before_delete)
+        self.assertEqual(deleted, [2])
+
+    def test_joined_query_falls_back(self):
+        from ..tests.models import Folder, Note
+
+        class View(self.view):
+            def get_identity_base(self):
+                return super().get_identity_base().join(Folder.notes) \
+                    .filter(Note.data == 'note 1')
+
+        self.delete(View, '/folder/2', '2')
+        self.assertEqual(self.count(Folder), 2)
+
+    def test_catchall(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        from ..tests.models import Folder, Note
+        self.catchall('note@1')
+        self.assertEqual(self.count(Note), 2)
+        self.assertEqual(self.catchall('folder', '/?id_gt=2'),
+                         {'deleted': 1})
+        self.assertEqual(self.count(Folder), 2)
+        self.assertEqual(self.count(Note), 1, 'cascaded by the database')
+        self.assertEqual(self.catchall('folder@2/notes'), {'deleted': 1})
+        self.assertEqual(self.count(Note), 0)
+        for route, allow in (('folder', False), ('folder[0:1]', True)):
+            with self.assertRaises(HTTPNotFound):
+                self.catchall(route, allow_list_delete=allow)
+
+
+class TestCatchallPlans(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.cache import StatementCacheStats
+        from py_liant.pyramid import CatchallPredicate
+        from ..tests.models import Parent, Child
+        self.predicate = CatchallPredicate({
+            'parent': {'cls': Parent, 'profiles': {'full': '*children'}},
+            'child': {'cls': Child,
+                      'filters': lambda request: Child.data != 'hidden'},
+        }, self.config)
+        self.stats = StatementCacheStats()
+        self.stats.listen(self.engine)
+
+    def match(self, route):
+        request = self.make_request('/', matchdict={'catchall': route})
+        if not self.predicate(None, request):
+            return None
+        return request.matchdict
+
+    def test_shared_plan(self):
+        from py_liant.pyramid import CatchallView
+        for pkey in (1, 2, 3):
+            match = self.match(f'parent@{pkey}:full')
+            obj = match['getter'](match['query'])
+            self.assertEqual(obj.id, pkey)
+        self.assertEqual((self.predicate.plans.misses,
+                          self.predicate.plans.hits), (1, 2))
+        self.assertEqual(len(self.predicate.plans), 1)
+        self.assertGreater(self.stats.hits, 0)
+
+        for index in (0, 2):
+            request = self.make_request(
+                '/', matchdict={'catchall': f'child[{index}]'})
+            self.assertTrue(self.predicate(None, request))
+            obj = CatchallView(request).get()['child']
+            self.assertEqual(obj.data, f'child value {index}')
+        self.assertEqual(self.predicate.plans.hits, 3)
+
+    def test_query_cls(self):
+        from sqlalchemy import orm
+
+        class Query(orm.Query):
+            pass
+
+        session = orm.Session(self.engine, query_cls=Query)
+        self.addCleanup(session.close)
+        for route in ('parent@1', 'parent@1/children', 'parent@1'):
+            request = self.make_request('/', matchdict={'catchall': route})
+            request.dbsession = session
+            self.assertTrue(self.predicate(None, request))
+            self.assertIs(type(request.matchdict['query']), Query)
+            # plans built for the default Query are not reused
+            self.assertIs(type(self.match(route)['query']), orm.Query)
+
+    def test_request_values(self):
+        from ..tests.models import Child
+        # callable filters are applied for each request
+        self.session.query(Child).filter(Child.id == 2).update(
+            {'data': 'hidden'})
+        for route, expected in (('parent@2/children', [2]),
+                                ('parent@3/children', [3]),
+                                ('child', [1, 3]),
+                                ('child@1/parent', [1])):
+            match = self.match(route)
+            self.assertEqual([_.id for _ in match['query']], expected)
+        self.assertIsNone(self.match('parent@x'))
+        self.assertIsNone(self.match('parent@1[0]'))
+        self.assertIsNone(self.match('parent@1/nosuchrelationship'))
+        # invalid shapes are cached as well
+        self.assertIsNone(self.match('parent@2/nosuchrelationship'))
+        self.assertGreaterEqual(self.predicate.plans.hits, 1)
+
+
+class TestSearch(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Document
+        with transaction.manager:
+            self.session.add_all([
+                Document(title='Indexing tables', body='b-tree and gin'),
+                Document(title='Full text search', body='tsvector queries'),
+                Document(title='Trigrams', body='similarity search'),
+            ])
+
+        class DocumentView(CRUDView):
+            target_type = Document
+            target_name = 'document'
+
+            def __init__(self, request):
+                super().__init__(request)
+                self.filters = self.auto_filters()
+
+        self.view = DocumentView
+
+    def search(self, query):
+        result = self.view(self.make_request('/document?' + query)).list()
+        return sorted(_.id for _ in result['items'])
+
+    def test_sqlite_fts(self):
+        from ..tests.models import Document
+        self.assertEqual(self.search('q=search'), [2, 3])
+        self.assertEqual(self.search('title_search=search'), [2])
+        self.assertEqual(self.search('body_search=search'), [3])
+        self.assertEqual(self.search('q=%22text+search%22'), [2])
+        self.assertEqual(self.search('q=search+-trigrams'), [2])
+        self.assertEqual(self.search('q=tables+or+trigrams'), [1, 3])
+        self.assertEqual(self.search('q=%22'), [])
+        self.assertIn('document_search', self.statements[-1])
+
+        # the search table follows updates and deletes
+        with transaction.manager:
+            self.session.get(Document, 3).body = 'fuzzy matching'
+            self.session.delete(self.session.get(Document, 2))
+        self.assertEqual(self.search('q=search'), [])
+        self.assertEqual(self.search('q=fuzzy'), [3])
+
+    def test_postgresql(self):
+        from sqlalchemy.dialects import postgresql
+        from py_liant.search import SearchSpec, search_spec
+        from ..tests.models import Document
+        dialect = postgresql.dialect()
+        spec = search_spec(Document)
+        sql = str(spec.match(Document, spec.keys, 'x').compile(
+            dialect=dialect))
+        self.assertEqual(
+            sql, "to_tsvector('simple'::regconfig, "
+            "coalesce(document.title, '') || ' ' || "
+            "coalesce(document.body, '')) @@ websearch_to_tsquery("
+            "'simple'::regconfig, %(param_1)s)")
+        ddl = spec.ddl(dialect)
+        self.assertEqual(len(ddl), 3)
+        self.assertIn(sql.split(' @@ ')[0].replace('document.', ''), ddl[2])
+
+        trigram = SearchSpec(Document, ('title',), method='trigram')
+        sql = str(trigram.match(Document, ('title',), 'x').compile(
+            dialect=dialect))
+        self.assertEqual(sql, '(document.title %% %(param_1)s)')
+        self.assertIn('gin_trgm_ops', trigram.ddl(dialect)[0])
+
+
+class TestConcurrentCount(ViewTest):
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        import threading
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.orm import Session
+        from sqlalchemy.pool import QueuePool
+        from py_liant.parallel import ConcurrentCount
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Base, Parent
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file_engine = create_engine(
+            f'sqlite:///{self.tmpdir.name}/db', poolclass=QueuePool,
+            pool_size=2, max_overflow=0, pool_timeout=1,
+            connect_args={'check_same_thread': False})
+        Base.metadata.create_all(self.file_engine)
+        with Session(self.file_engine) as session:
+            session.add_all(Parent(data1=f'parent {i}') for i in range(5))
+            session.commit()
+        self.file_session = Session(self.file_engine)
+
+        # threads the count statements ran in
+        self.count_threads = []
+
+        def _track(conn, cursor, statement, *args):
+            if statement.lstrip().startswith('SELECT count('):
+                self.count_threads.append(threading.current_thread().name)
+        event.listen(self.file_engine, 'before_cursor_execute', _track)
+
+        self.counter = ConcurrentCount(2)
+
+        class ParentView(CRUDView):
+            target_type = Parent
+            target_name = 'parent'
+            concurrent_count = self.counter
+
+            def __init__(self, request):
+                super().__init__(request)
+                self.filters = self.auto_filters()
+                self.accept_order = self.auto_order()
+
+        self.view = ParentView
+
+    def tearDown(self):
+        self.counter.shutdown()
+        self.file_session.close()
+        self.file_engine.dispose()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def list(self, session, query='order=id&pageSize=2&page=1'):
+        request = self.make_request('/parent?' + query)
+        request.dbsession = session
+        result = self.view(request).list()
+        return [_.id for _ in result['items']], result['total']
+
+    def test_concurrent(self):
+        self.assertEqual(self.list(self.file_session), ([3, 4], 5))
+        self.assertEqual(self.list(self.file_session, 'id_gt=3'), ([4, 5], 2))
+        self.assertEqual(self.counter.concurrent, 2)
+        self.assertEqual(self.counter.sequential, 0)
+        self.assertTrue(all(name.startswith('py_liant.count')
+                            for name in self.count_threads))
+
+    def test_fallback(self):
+        from ..tests.models import Parent
+        # the in-memory engine uses a per-thread pool
+        self.assertEqual(self.list(self.session)[1], 3)
+        self.assertEqual(self.counter.sequential, 1)
+
+        # flushed changes are only visible to the session's connection
+        self.file_session.add(Parent(data1='new'))
+        self.file_session.flush()
+        self.assertEqual(self.list(self.file_session)[1], 6)
+        self.file_session.rollback()
+        self.assertEqual(self.counter.sequential, 2)
+
+        # no connection left in the pool
+        self.file_session.connection()
+        with self.file_engine.connect():
+            self.assertEqual(self.list(self.file_session)[1], 5)
+        self.assertEqual(self.counter.sequential, 3)
+        self.assertEqual(self.counter.concurrent, 0)
+        self.assertFalse(any(name.startswith('py_liant.count')
+                             for name in self.count_threads))
+
+    def test_binds(self):
+        from sqlalchemy.orm import Session
+        from ..tests.models import Parent
+        # no default bind: the engine is found through the query's mapper
+        with Session(binds={Parent: self.file_engine}) as session:
+            self.assertEqual(self.list(session), ([3, 4], 5))
+        self.assertEqual(self.counter.concurrent, 1)
+
+    def test_last_connection(self):
+        import time
+        # the page query takes the last connection, the count does not wait
+        # pool_timeout for it
+        with self.file_engine.connect():
+            start = time.perf_counter()
+            self.assertEqual(self.list(self.file_session)[1], 5)
+            self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(self.counter.sequential, 1)
+        self.assertEqual(self.counter.concurrent, 0)
+
+    def test_isolation_level(self):
+        from py_liant.parallel import _isolation_level
+        with self.file_engine.connect() as conn:
+            self.assertEqual(_isolation_level(conn),
+                             self.file_engine.dialect.default_isolation_level)
+        with self.file_engine.execution_options(
+                isolation_level='READ UNCOMMITTED').connect() as conn:
+            self.assertEqual(_isolation_level(conn), 'READ UNCOMMITTED')
+
+
+class TestAggregate(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CatchallPredicate
+        from ..tests.models import Parent, Child
+        with transaction.manager:
+            parent = self.session.get(Parent, 1)
+            parent.children.append(Child(data='extra'))
+        self.predicate = CatchallPredicate({
+            'parent': Parent,
+            'child': {'cls': Child, 'filters': Child.id != 2},
+        }, self.config)
+
+    def process(self, route, query, context=None):
+        from py_liant.pyramid import CatchallView
+        request = self.make_request('/?' + query, context=context,
+                                    matchdict={'catchall': route})
+        self.assertTrue(self.predicate(context, request))
+        self.statements.clear()
+        return CatchallView(request).process()
+
+    def test_group_by(self):
+        result = self.process(
+            'child', 'group=parent_id&aggregate=count,max:id&order=count+desc')
+        self.assertEqual(len(self.statements), 1)
+        self.assertIn('GROUP BY', self.statements[0])
+        # target filters exclude child 2
+        self.assertEqual(result['items'], [
+            {'parent_id': 1, 'count': 2, 'max_id': 4},
+            {'parent_id': 3, 'count': 1, 'max_id': 3}])
+
+        result = self.process('child', 'aggregate=sum:id,avg:id&id_gt=1')
+        self.assertEqual(result['items'], [{'sum_id': 7, 'avg_id': 3.5}])
+        result = self.process('parent@1/children', 'aggregate=count')
+        self.assertEqual(result['items'], [{'count': 2}])
+
+    def test_invalid(self):
+        from pyramid.httpexceptions import HTTPForbidden, HTTPServerError
+        from py_liant.interfaces import JsonGuardProvider
+        for query in ('aggregate=sum:data', 'aggregate=median:id',
+                      'group=unknown', 'aggregate=sum', 'group='):
+            with self.subTest(query=query), \
+                    self.assertRaises(HTTPServerError):
+                self.process('child', query)
+
+        class Guard(JsonGuardProvider):
+            guardUpdate = guardHints = guardSerialize = guardDrilldown = None
+
+            def guardAggregate(self, cls, group, aggregates):
+                return 'data' not in group
+
+        self.assertEqual(len(self.process(
+            'child', 'group=parent_id', Guard())['items']), 2)
+        with self.assertRaises(HTTPForbidden):
+            self.process('child', 'group=data', Guard())
+
+
+class TestLoadAdvisor(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.advisor import LoadAdvisor
+        from py_liant.pyramid import CatchallPredicate, CatchallView
+        from ..tests.models import Parent, Child
+        self.advisor = LoadAdvisor()
+        self.advisor.listen()
+        self.predicate = CatchallPredicate(
+            {'parent': Parent, 'child': Child}, self.config)
+
+        class View(CatchallView):
+            load_advisor = self.advisor
+
+        self.view = View
+
+    def tearDown(self):
+        self.advisor.remove()
+        super().tearDown()
+
+    def render(self, route, touch=None, context=None):
+        from py_liant.json_encoder import JSONEncoder
+        from ..tests.models import Base
+        request = self.make_request('/', matchdict={'catchall': route},
+                                    context=context)
+        self.assertTrue(self.predicate(context, request))
+        result = self.view(request).process()
+        for item in result['items']:
+            if touch is not None:
+                touch(item)
+        JSONEncoder(request, base_type=Base, check_circular=False) \
+            .encode(result)
+        request._process_finished_callbacks()
+
+    def test_lazy_loads(self):
+        with self.assertLogs('py_liant.advisor', 'INFO') as logs:
+            self.render('child', lambda child: child.parent.children)
+        self.assertEqual(self.advisor.report(), [
+            dict(verb='child', path='parent', hint='+parent',
+                 queries=3, rows=3, requests=1),
+            dict(verb='child', path='parent.children',
+                 hint='+parent(*children)', queries=3, rows=3, requests=1)])
+        self.assertEqual(self.advisor.suggestions(),
+                         {'child': '+parent(*children)'})
+        self.assertIn('suggested hints: +parent(*children)', logs.output[0])
+
+        # following the suggestion removes the lazy loads
+        self.advisor.reset()
+        self.render('child:+parent(*children)',
+                    lambda child: child.parent.children)
+        self.assertEqual(self.advisor.report(), [])
+        self.assertEqual(self.advisor.unused_eager(), [])
+
+    def test_unused_eager(self):
+        from py_liant.interfaces import JsonGuardProvider
+
+        class Guard(JsonGuardProvider):
+            guardUpdate = guardDrilldown = None
+
+            def guardHints(self, cls, hints):
+                pass
+
+            def guardSerialize(self, obj, value):
+                value.pop('children', None)
+
+        self.render('parent:*children', context=Guard())
+        self.assertEqual(self.advisor.unused_eager(), [
+            dict(verb='parent', path='children', requests=1)])
+
+
+class TestTiming(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from ..tests.models import Base, Parent
+        self.config.include(includeme_factory(base_class=Base, timing=True))
+        self.config.add_request_method(lambda request: self.session,
+                                       'dbsession', reify=True)
+        self.config.add_route('catchall', '/{catchall:.*}')
+        self.config.add_view(CatchallView, attr='process', renderer='json',
+                             route_name='catchall',
+                             catchall={'parent': Parent})
+        self.app = self.config.make_wsgi_app()
+
+    def timings(self, path, method='GET', body=None):
+        from pyramid.request import Request
+        request = Request.blank(path, method=method)
+        if body is not None:
+            request.body = body.encode()
+        response = request.get_response(self.app)
+        self.assertEqual(response.status_code, 200)
+        return dict(item.split(';')[0:2] for item in
+                    response.headers['Server-Timing'].split(', '))
+
+    def test_phases(self):
+        with self.assertLogs('py_liant.timing', 'INFO') as logs:
+            timings = self.timings('/parent:*children')
+        self.assertEqual(list(timings),
+                         ['route', 'sql', 'encode', 'total'])
+        self.assertTrue(all(value.startswith('dur=')
+                            for value in timings.values()))
+        self.assertEqual(set(logs.records[0].timings), set(timings))
+
+        timings = self.timings('/parent@1', 'POST',
+                               '{"parent": {"data1": "changed"}}')
+        self.assertLessEqual({'apply_changes', 'flush', 'commit'},
+                             set(timings))
+
+    def test_streamed(self):
+        import json
+        from pyramid.config import Configurator
+        from pyramid.request import Request
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from ..tests.models import Base, Parent
+        config = Configurator()
+        config.include(includeme_factory(base_class=Base, timing=True,
+                                         wsgi_iter=True))
+        config.add_request_method(lambda request: self.session,
+                                  'dbsession', reify=True)
+        config.add_route('catchall', '/{catchall:.*}')
+        config.add_view(CatchallView, attr='process', renderer='json',
+                        route_name='catchall', catchall={'parent': Parent})
+        app = config.make_wsgi_app()
+        with self.assertLogs('py_liant.timing', 'INFO') as logs:
+            response = Request.blank('/parent:*children').get_response(app)
+            # sent before the response is encoded
+            self.assertNotIn('encode', response.headers['Server-Timing'])
+            self.assertEqual(logs.records, [])
+            self.assertEqual(len(json.loads(response.body)['items']), 3)
+        # logged once the server closes the response, encoding included
+        self.assertEqual(len(logs.records), 1)
+        self.assertLessEqual({'route', 'sql', 'encode', 'total'},
+                             set(logs.records[0].timings))
+
+    def test_inactive(self):
+        from py_liant.timing import current_timings, timed
+        with timed('encode'):
+            self.assertIsNone(current_timings())
+
+
+class TestMetrics(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.metrics import metrics
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from ..tests.models import Base, Parent
+        metrics.reset()
+        self.addCleanup(setattr, metrics, 'enabled', False)
+        self.config.include(includeme_factory(base_class=Base, metrics=True))
+        self.config.add_request_method(lambda request: self.session,
+                                       'dbsession', reify=True)
+        self.config.add_route('catchall', '/{catchall:.*}')
+        self.config.add_view(CatchallView, attr='process', renderer='json',
+                             route_name='catchall',
+                             catchall={'parent': Parent})
+        self.app = self.config.make_wsgi_app()
+
+    def test_histogram(self):
+        import threading
+        from py_liant.metrics import MetricsRegistry
+        registry = MetricsRegistry(prefix='test_')
+        histogram = registry.histogram('size', 'Sizes', ('kind',),
+                                       buckets=(1, 10))
+        counter = registry.counter('events', 'Events')
+
+        def _work():
+            for value in (0, 5, 50):
+                histogram.observe(value, ('a',))
+            counter.inc()
+        threads = [threading.Thread(target=_work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the series of ended threads are folded into the totals
+        self.assertEqual(histogram._shards, [])
+
+        collected = registry.collect()
+        self.assertEqual(collected['test_size'][('a',)], dict(
+            buckets=[(1, 4), (10, 8), (float('inf'), 12)], sum=220,
+            count=12))
+        self.assertEqual(collected['test_events'], {(): 4})
+        text = registry.prometheus_text()
+        self.assertIn('test_size_bucket{kind="a",le="10.0"} 8\n', text)
+        self.assertIn('test_size_bucket{kind="a",le="+Inf"} 12\n', text)
+        self.assertIn('test_size_count{kind="a"} 12\n', text)
+        self.assertIn('# TYPE test_events_total counter\ntest_events_total 4',
+                      text)
+
+    def test_requests(self):
+        from pyramid.request import Request
+        from py_liant.metrics import metrics, metrics_view
+        for i in range(2):
+            response = Request.blank('/parent').get_response(self.app)
+            self.assertEqual(response.status_code, 200)
+
+        collected = metrics.collect()
+        self.assertEqual(collected['py_liant_request_seconds'][
+            ('parent', 'GET')]['count'], 2)
+        self.assertEqual(collected['py_liant_rows_returned'][
+            ('parent',)]['sum'], 6)
+        self.assertEqual(collected['py_liant_objects_encoded'][
+            ('parent',)]['sum'], 6)
+        self.assertEqual(collected['py_liant_payload_bytes'][
+            ('parent',)]['sum'], 2 * len(response.body))
+        self.assertEqual(collected['py_liant_count_seconds'][
+            ('sequential',)]['count'], 2)
+        self.assertGreaterEqual(
+            collected['py_liant_cache_hits_total'][('catchall_plans',)], 1)
+
+        text = metrics_view(None).text
+        self.assertIn('py_liant_request_seconds_count{verb="parent",'
+                      'method="GET"} 2\n', text)
+        self.assertIn('py_liant_cache_misses_total{cache="catchall_plans"}',
+                      text)
+
+    def test_disabled(self):
+        from pyramid.config import Configurator
+        from pyramid.request import Request
+        from py_liant.metrics import metrics
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from ..tests.models import Base, Parent
+        metrics.enabled = False
+        config = Configurator()
+        config.include(includeme_factory(base_class=Base))
+        config.add_request_method(lambda request: self.session,
+                                  'dbsession', reify=True)
+        config.add_route('catchall', '/{catchall:.*}')
+        config.add_view(CatchallView, attr='process', renderer='json',
+                        route_name='catchall', catchall={'parent': Parent})
+        response = Request.blank('/parent').get_response(
+            config.make_wsgi_app())
+        self.assertEqual(response.status_code, 200)
+        collected = metrics.collect()
+        for name in ('rows_returned', 'objects_encoded', 'payload_bytes',
+                     'count_seconds'):
+            self.assertEqual(collected['py_liant_' + name], {})
+
+
+class TestProfiling(ViewTest):
+    def setUp(self):
+        super().setUp()
+        import time
+        from py_liant.interfaces import JsonGuardProvider
+        from py_liant.pyramid import includeme_factory
+        from py_liant.timing import timed
+        from ..tests.models import Base, Parent
+        self.config.include(includeme_factory(base_class=Base,
+                                              profiling=True))
+        self.config.add_request_method(lambda request: self.session,
+                                       'dbsession', reify=True)
+
+        class Context(JsonGuardProvider):
+            guardUpdate = guardHints = guardSerialize = guardDrilldown = None
+
+            def __init__(self, request):
+                pass
+
+            def guardProfile(self, request):
+                return request.headers.get('X-Py-Liant-Profile') == 'secret'
+
+        def slow(request):
+            with timed('apply_changes'):
+                time.sleep(0.05)
+                request.dbsession.query(Parent).all()
+            return {'ok': True}
+
+        self.config.add_route('slow', '/slow', factory=Context)
+        self.config.add_view(slow, route_name='slow', renderer='json')
+        self.app = self.config.make_wsgi_app()
+
+    def get(self, trigger=None):
+        from pyramid.request import Request
+        request = Request.blank('/slow')
+        if trigger is not None:
+            request.headers['X-Py-Liant-Profile'] = trigger
+        response = request.get_response(self.app)
+        self.assertEqual(response.json, {'ok': True})
+        return response.headers.get('X-Py-Liant-Profile')
+
+    def test_profile(self):
+        from py_liant.profiling import profiles
+        profile = profiles.get(self.get('secret'))
+        self.assertEqual(profile.path, '/slow')
+        self.assertGreaterEqual(profile.phases['apply_changes'], 50)
+        self.assertEqual(len(profile.statements), 1)
+        self.assertEqual(profile.statements[0]['phase'], 'apply_changes')
+        self.assertIn('FROM parent', profile.statements[0]['statement'])
+        self.assertRegex(profile.folded(),
+                         r'\[apply_changes\];.*py_liant\.tests\.test:slow \d+')
+
+    def test_not_profiled(self):
+        from py_liant.timing import current_timings
+        self.assertIsNone(self.get())
+        self.assertIsNone(self.get('denied'))
+        self.assertIsNone(current_timings())
+
+    def test_requested(self):
+        from pyramid.request import Request
+        from py_liant.profiling import requested
+        self.assertTrue(requested(Request.blank('/slow?_profile=1')))
+        for path in ('/slow?foo_profile=1', '/slow?q=_profile'):
+            with self.subTest(path=path):
+                self.assertFalse(requested(Request.blank(path)))
+
+
+class TestBatch(ViewTest):
+    def setUp(self):
+        super().setUp()
+        from py_liant.batch import BatchView
+        from py_liant.pyramid import includeme_factory
+        from ..tests.models import Base, Child, Parent
+
+        class Batch(BatchView):
+            targets = {'parent': Parent, 'child': Child}
+            max_requests = 4
+
+        self.config.include(includeme_factory(base_class=Base))
+        self.config.add_request_method(lambda request: self.session,
+                                       'dbsession', reify=True)
+        self.config.add_route('batch', '/_batch')
+        self.config.add_view(Batch, attr='process', route_name='batch',
+                             request_method='POST', renderer='json')
+        self.app = self.config.make_wsgi_app()
+
+    def post(self, body):
+        from pyramid.request import Request
+        request = Request.blank('/_batch', method='POST')
+        request.body = body.encode()
+        return request.get_response(self.app)
+
+    def test_batch(self):
+        import json
+        del self.statements[:]
+        response = self.post('["parent@1:*children", "child@1:+parent", '
+                             '"parent?data1_like=parent%25&pageSize=2", '
+                             '"unknown@1"]')
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.text)['results']
+        self.assertEqual([result['status'] for result in results],
+                         [200, 200, 200, 404])
+        parent = results[0]['body']['parent']
+        # child 1 and parent 1 are written once, then referenced
+        self.assertEqual(results[1]['body']['child'],
+                         {'_ref': parent['children'][0]['_id']})
+        items = results[2]['body']['items']
+        self.assertEqual(items[0], {'_ref': parent['_id']})
+        self.assertEqual(items[1]['data1'], 'parent value 1')
+        self.assertEqual(results[2]['body']['total'], 3)
+        self.assertEqual(response.text.count('"data1":"parent value 0"'), 1)
+
+    def test_invalid(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        self.assertEqual(self.post('["parent"]').status_code, 200)
+        with self.assertRaises(HTTPBadRequest):
+            self.post('{"parent": 1}')
+        with self.assertRaises(HTTPBadRequest):
+            self.post('["parent", "parent", "parent", "parent", "parent"]')
+
+    def test_replica_router(self):
+        import json
+        import tempfile
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+        from pyramid.config import Configurator
+        from py_liant.batch import BatchView
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from py_liant.replicas import ReplicaRouter
+        from ..tests.models import Base, Parent
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        engines = []
+        for i in range(2):
+            engine = create_engine(f'sqlite:///{tmpdir.name}/replica{i}.db')
+            self.addCleanup(engine.dispose)
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                session.add_all(Parent(id=j + 1, data1=f'replica {i}')
+                                for j in range(3))
+                session.commit()
+            engines.append(engine)
+        sessions = []
+
+        def session_factory(**kwargs):
+            sessions.append(Session(**kwargs))
+            return sessions[-1]
+
+        class View(CatchallView):
+            replica_router = ReplicaRouter(engines,
+                                           session_factory=session_factory)
+
+        class Batch(BatchView):
+            view_class = View
+            targets = {'parent': Parent}
+
+        config = Configurator()
+        config.include(includeme_factory(base_class=Base))
+        config.add_request_method(lambda request: self.session,
+                                  'dbsession', reify=True)
+        config.add_route('batch', '/_batch')
+        config.add_view(Batch, attr='process', route_name='batch',
+                        request_method='POST', renderer='json')
+        app = config.make_wsgi_app()
+
+        from pyramid.request import Request
+        request = Request.blank('/_batch', method='POST')
+        request.body = b'["parent@1", "parent@2", "parent@3"]'
+        results = json.loads(request.get_response(app).text)['results']
+        # one replica session for the batch, closed once it is encoded
+        self.assertEqual([result['body']['parent']['data1']
+                          for result in results], ['replica 0'] * 3)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(len(sessions[0].identity_map), 0)
+
+    def test_identity(self):
+        import json
+        from pyramid.config import Configurator
+        from py_liant.batch import BatchView
+        from py_liant.cache import ResultCache
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from ..tests.models import Base, Parent
+
+        class Policy:
+            def identity(self, request):
+                return request.headers.get('X-User')
+
+            def authenticated_userid(self, request):
+                return self.identity(request)
+
+            def permits(self, request, context, permission):
+                return True
+
+        cache = ResultCache()
+        cache.listen(self.session)
+
+        class View(CatchallView):
+            result_cache = cache
+
+        class Batch(BatchView):
+            view_class = View
+            targets = {'parent': dict(cls=Parent, filters=lambda request:
+                                      Parent.data1 == 'parent value ' +
+                                      request.authenticated_userid)}
+
+        config = Configurator()
+        config.include(includeme_factory(base_class=Base))
+        config.set_security_policy(Policy())
+        config.add_request_method(lambda request: self.session,
+                                  'dbsession', reify=True)
+        config.add_route('batch', '/_batch')
+        config.add_view(Batch, attr='process', route_name='batch',
+                        request_method='POST', renderer='json')
+        self.app = config.make_wsgi_app()
+
+        def items(user):
+            from pyramid.request import Request
+            request = Request.blank('/_batch', method='POST',
+                                    headers={'X-User': user})
+            request.body = b'["parent?pageSize=10"]'
+            body = json.loads(request.get_response(self.app).text)
+            return [item['data1']
+                    for item in body['results'][0]['body']['items']]
+
+        self.assertEqual(items('0'), ['parent value 0'])
+        self.assertEqual(items('1'), ['parent value 1'])
+        self.assertEqual(items('0'), ['parent value 0'])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+
+class TestSearchPathSetter(unittest.TestCase):
+    class Cursor:
+        # sqlite3 cursor that records SET statements instead of running them
+        def __init__(self, connection):
+            self.connection = connection
+            self.cursor = connection.connection.cursor()
+
+        def execute(self, statement, *args):
+            if statement.startswith('SET '):
+                self.connection.log.append(statement)
+                return self
+            return self.cursor.execute(statement, *args)
+
+        def __getattr__(self, name):
+            return getattr(self.cursor, name)
+
+    class Connection:
+        def __init__(self, log):
+            import sqlite3
+            self.connection = sqlite3.connect(':memory:')
+            self.log = log
+
+        def cursor(self):
+            return TestSearchPathSetter.Cursor(self)
+
+        def commit(self):
+            self.log.append('COMMIT')
+            self.connection.commit()
+
+        def __getattr__(self, name):
+            return getattr(self.connection, name)
+
+    def setUp(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import QueuePool
+        from py_liant.searchpath import SearchPathSetter
+        self.log = []
+        self.engine = create_engine(
+            'sqlite://', poolclass=QueuePool, pool_size=1, max_overflow=0,
+            creator=lambda: self.Connection(self.log))
+        self.setter = SearchPathSetter('tenant, Other Tenant', self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_once_per_connection(self):
+        from sqlalchemy import text
+        for _ in range(3):
+            with self.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+        self.assertEqual(self.log, [
+            'SET search_path TO tenant, "Other Tenant", public;', 'COMMIT'])
+
+        del self.log[:]
+        self.setter.search_path = 'public,tenant'
+        for _ in range(2):
+            with self.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+        self.assertEqual(self.log,
+                         ['SET search_path TO public, tenant;', 'COMMIT'])
+
+    def test_pool_listener(self):
+        from sqlalchemy import create_engine, event, text
+        from sqlalchemy.pool import QueuePool
+        from py_liant.searchpath import SearchPathSetter
+        log = []
+        engine = create_engine(
+            'sqlite://', poolclass=QueuePool, pool_size=1, max_overflow=0,
+            creator=lambda: self.Connection(log))
+        # what SQLAlchemy < 1.4 does with create_engine(listeners=[...])
+        setter = SearchPathSetter('tenant')
+        event.listen(engine.pool, 'connect', setter.connect)
+        event.listen(engine.pool, 'checkout', setter.checkout)
+        try:
+            for _ in range(3):
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+        finally:
+            engine.dispose()
+        self.assertEqual(log, ['SET search_path TO tenant, public;',
+                               'COMMIT'])
+
+
+class TestTenancy(unittest.TestCase):
+    def setUp(self):
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from py_liant.monkeypatch import patch_sqlalchemy_base_class
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from py_liant.tenancy import TenantRouter
+        from ..tests.models import Base, Child, Parent, get_tm_session
+
+        self.engine = create_engine(
+            'sqlite://', poolclass=StaticPool,
+            connect_args=dict(check_same_thread=False))
+
+        @event.listens_for(self.engine, 'connect')
+        def attach(dbapi_con, con_record):
+            for schema in ('tenant_a', 'tenant_b'):
+                dbapi_con.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+
+        self.router = TenantRouter(
+            self.engine, lambda request: request.headers.get('X-Tenant'))
+        patch_sqlalchemy_base_class(Base)
+        factory = sessionmaker()
+        for tenant in ('tenant_a', 'tenant_b'):
+            bind = self.router.translate(self.engine, tenant)
+            Base.metadata.create_all(
+                bind, tables=[Parent.__table__, Child.__table__])
+            with transaction.manager:
+                session = get_tm_session(factory, transaction.manager)
+                session.bind = bind
+                session.add(Parent(data1=f'{tenant} parent'))
+
+        class View(CatchallView):
+            update_lock = True
+
+        self.config = testing.setUp()
+        self.config.include(includeme_factory(base_class=Base))
+        self.config.add_request_method(
+            lambda request: self.router.bind(request, get_tm_session(
+                factory, transaction.manager)), 'dbsession', reify=True)
+        self.config.add_route('catchall', '/{catchall:.*}')
+        self.config.add_view(View, attr='process', renderer='json',
+                             route_name='catchall',
+                             catchall={'parent': Parent})
+        self.app = self.config.make_wsgi_app()
+
+    def tearDown(self):
+        testing.tearDown()
+        transaction.abort()
+        self.engine.dispose()
+
+    def call(self, tenant, path, method='GET', body=None):
+        from pyramid.request import Request
+        request = Request.blank(path, method=method)
+        request.headers['X-Tenant'] = tenant
+        if body is not None:
+            request.body = body.encode()
+        response = request.get_response(self.app)
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_routing(self):
+        self.assertEqual(self.call('tenant_a', '/parent')['items'][0]['data1'],
+                         'tenant_a parent')
+        self.assertEqual(self.call('tenant_b', '/parent@1')['parent']['data1'],
+                         'tenant_b parent')
+        self.call('tenant_b', '/parent@1', 'POST',
+                  '{"parent": {"data1": "changed"}}')
+        self.assertEqual(self.call('tenant_b', '/parent@1')['parent']['data1'],
+                         'changed')
+        self.assertEqual(self.call('tenant_a', '/parent@1')['parent']['data1'],
+                         'tenant_a parent')
+        # one variant per tenant, all on the same pool
+        bind = self.router.translate(self.engine, 'tenant_a')
+        self.assertIs(bind, self.router.translate(self.engine, 'tenant_a'))
+        self.assertIs(bind.pool, self.engine.pool)
+
+    def test_aliased_update_lock(self):
+        from pyramid.request import Request, apply_request_extensions
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.orm import aliased
+        from py_liant.pyramid import CRUDView
+        from ..tests.models import Parent
+        alias = aliased(Parent)
+        queries = []
+
+        class View(CRUDView):
+            target_type = alias
+            target_name = 'parent'
+
+            @property
+            def identity_filter(self):
+                return alias.id == 1
+
+            def get_one_from_query(self, query):
+                queries.append(query)
+                return super().get_one_from_query(query)
+
+        request = Request.blank('/parent@1')
+        request.headers['X-Tenant'] = 'tenant_b'
+        request.registry = self.config.registry
+        request.context = None
+        apply_request_extensions(request)
+        view = View(request)
+        self.assertEqual(view.get_by_id(update_lock=True).data1,
+                         'tenant_b parent')
+
+        # SQLite leaves FOR UPDATE out; PostgreSQL needs the lock on the
+        # alias, with the table qualified by the tenant's schema
+        bind = request.dbsession.get_bind()
+        sql = str(queries[0].statement.compile(
+            dialect=postgresql.dialect(), render_schema_translate=True,
+            schema_translate_map=bind.get_execution_options()[
+                'schema_translate_map']))
+        self.assertIn('FROM tenant_b.parent AS parent_1', sql)
+        self.assertTrue(sql.endswith('FOR UPDATE OF parent_1'))
+
+
+class TestSmallintEnum(unittest.TestCase):
+    def setUp(self):
+        from enum import Enum
+        from sqlalchemy import Column, Integer, create_engine
+        from sqlalchemy.orm import Session, declarative_base
+        from py_liant.enum import EnumAttrs, PythonEnum
+        from py_liant.monkeypatch import patch_sqlalchemy_base_class
+
+        @EnumAttrs('fact_kind', codes=dict(sale=1, refund=2, void=7))
+        class FactKind(Enum):
+            sale = 'sale'
+            refund = 'refund'
+            void = 'void'
+
+        Base = declarative_base()
+
+        class Fact(Base):
+            __tablename__ = 'fact'
+            id = Column(Integer, primary_key=True)
+            kind = Column(PythonEnum(FactKind, storage='smallint'))
+
+        patch_sqlalchemy_base_class(Base)
+        self.Base, self.Fact, self.FactKind = Base, Fact, FactKind
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+        self.session.add_all([Fact(kind=kind) for kind in
+                              (FactKind.sale, FactKind.void, FactKind.sale,
+                               FactKind.refund)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def test_storage(self):
+        from sqlalchemy import text
+        from py_liant.json_encoder import JSONEncoder
+        from py_liant.metadata import view_metadata
+        Fact, FactKind = self.Fact, self.FactKind
+        self.assertEqual(self.session.execute(text(
+            'SELECT kind FROM fact ORDER BY id')).scalars().all(),
+            [1, 7, 1, 2])
+        filters = view_metadata(Fact).filters
+        query = self.session.query(Fact).order_by(Fact.id)
+        self.assertEqual([f.id for f in query.filter(filters['kind']('sale'))],
+                         [1, 3])
+        self.assertEqual(
+            [f.kind for f in query.filter(filters['kind_in']('void,refund'))],
+            [FactKind.void, FactKind.refund])
+        self.assertEqual(query.filter(Fact.kind == 'refund').one().id, 4)
+        fact = query.first()
+        self.assertIs(fact.kind, FactKind.sale)
+        self.assertIn('"kind":"sale"', JSONEncoder(
+            base_type=self.Base, separators=(',', ':')).encode(fact))
+
+    def test_codes(self):
+        from enum import Enum
+        from py_liant.enum import EnumAttrs, PythonEnum, smallint_migration
+
+        @EnumAttrs('partial', codes=dict(a=1))
+        class Partial(Enum):
+            a = 'a'
+            b = 'b'
+
+        with self.assertRaises(ValueError):
+            PythonEnum(Partial, storage='smallint')
+        self.assertEqual(
+            smallint_migration('fact', 'kind', self.FactKind),
+            "ALTER TABLE fact ALTER COLUMN kind TYPE smallint USING CASE "
+            "kind::text WHEN 'sale' THEN 1 WHEN 'refund' THEN 2 "
+            "WHEN 'void' THEN 7 END")
+
+    def test_unknown_codes(self):
+        import warnings
+        from py_liant.enum import PythonEnum
+        kind = PythonEnum(self.FactKind, storage='smallint')
+        for code in (3, -1, 8):
+            with self.subTest(code=code), self.assertRaises(LookupError):
+                kind.process_result_value(code, None)
+        self.assertIs(kind.process_result_value(7, None), self.FactKind.void)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertIn(('enum_class', self.FactKind),
+                          kind._static_cache_key)
+
+
+class TestWarmup(ViewTest):
+    def tearDown(self):
+        import gc
+        gc.unfreeze()
+        super().tearDown()
+
+    def test_lazy_imports(self):
+        import subprocess
+        import sys
+        output = subprocess.check_output([sys.executable, '-c', (
+            'import sys, py_liant.pyramid; print(" ".join(sorted(set('
+            '["sqlalchemy.dialects.postgresql", "pyparsing", "dateutil",'
+            ' "isodate"]) & set(sys.modules))))')])
+        self.assertEqual(output.strip(), b'')
+
+    def test_includeme(self):
+        import gc
+        from pyramid.config import Configurator
+        from py_liant.pyramid import CatchallView, includeme_factory
+        from py_liant.pyramid import catchall_predicates
+        from ..tests.models import Base, Parent, Child
+        config = Configurator()
+        config.include(includeme_factory(base_class=Base, warmup=True))
+        config.add_route('catchall', '/{catchall:.*}')
+        config.add_view(CatchallView, attr='process', renderer='json',
+                        route_name='catchall', catchall={
+                            'parent': dict(cls=Parent,
+                                           profiles={'full': '*children'}),
+                            'child': Child})
+        config.commit()
+        predicate = next(_ for _ in catchall_predicates
+                         if 'parent' in _.targets and 'child' in _.targets
+                         and len(_.plans._data) == 6)
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+        # requests use the plans planned by the warm-up
+        request = self.make_request(
+            '/', matchdict={'catchall': 'parent@2:full'})
+        self.assertTrue(predicate(None, request))
+        self.assertEqual(predicate.plans.misses, 0)
+        self.assertEqual(predicate.plans.hits, 1)
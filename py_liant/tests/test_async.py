@@ -0,0 +1,215 @@
+import os
+import tempfile
+import unittest
+
+from pyramid import testing
+
+# async views against aiosqlite; skipped when the driver is not installed
+try:
+    import aiosqlite  # noqa: F401
+except ImportError:  # pragma: no cover
+    aiosqlite = None
+
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite not installed')
+class TestAsyncViews(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        from py_liant.monkeypatch import patch_sqlalchemy_base_class
+        from py_liant.async_views import AsyncCRUDView
+        from .models import Base, Parent, Child
+
+        self.config = testing.setUp()
+        patch_sqlalchemy_base_class(Base)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_async_engine(
+            'sqlite+aiosqlite:///' + os.path.join(self.tmpdir.name, 'db'))
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        self.session = AsyncSession(self.engine)
+        for i in range(3):
+            parent = Parent(data1=f'parent value {i}')
+            parent.children.append(Child(data=f'child value {i}'))
+            self.session.add(parent)
+        await self.session.commit()
+
+        class ParentView(AsyncCRUDView):
+            target_type = Parent
+            target_name = 'parent'
+
+            def __init__(self, request):
+                super().__init__(request)
+                self.filters = self.auto_filters()
+                self.accept_order = self.auto_order()
+
+            @property
+            def identity_filter(self):
+                return Parent.id == int(self.request.matchdict['id'])
+
+        self.view = ParentView
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+        self.tmpdir.cleanup()
+        testing.tearDown()
+
+    def make_request(self, path, method='GET', body=None, matchdict=None):
+        from pyramid.request import Request
+        from py_liant.pyramid import pyramid_json_decoder
+        request = Request.blank(path, method=method)
+        if body is not None:
+            request.body = body.encode()
+        request.registry = self.config.registry
+        request.dbsession = self.session
+        request.context = None
+        request.matchdict = matchdict if matchdict is not None else {}
+        request.set_property(pyramid_json_decoder, 'json', reify=True)
+        return request
+
+    async def test_list(self):
+        result = await self.view(self.make_request(
+            '/parent?id_gt=1&order=id+desc&pageSize=1&page=1')).list()
+        self.assertEqual(result['total'], 2)
+        self.assertEqual([_.id for _ in result['items']], [2])
+
+    async def test_get(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        result = await self.view(self.make_request(
+            '/parent/2', matchdict={'id': '2'})).get()
+        self.assertEqual(result['parent'].data1, 'parent value 1')
+        with self.assertRaises(HTTPNotFound):
+            await self.view(self.make_request(
+                '/parent/9', matchdict={'id': '9'})).get()
+
+    async def test_insert_update_delete(self):
+        from sqlalchemy import func, select
+        from .models import Child
+        result = await self.view(self.make_request(
+            '/parent', 'POST', '{"parent": {"data1": "new", '
+            '"children": [{"data": "a"}, {"data": "b"}]}}')).insert()
+        obj = result['parent']
+        self.assertEqual(obj.data1, 'new')
+        pid = obj.id
+
+        # children reconciliation: keep one, add one, drop one
+        kept = await self.session.scalar(
+            select(func.min(Child.id)).where(Child.parent_id == pid))
+        obj = await self.view(self.make_request(
+            f'/parent/{pid}', 'POST',
+            f'{{"parent": {{"data1": "changed", "children": '
+            f'[{{"id": {kept}}}, {{"data": "c"}}]}}}}',
+            matchdict={'id': str(pid)})).update()
+        self.assertEqual(obj.data1, 'changed')
+        data = await self.session.scalars(
+            select(Child.data).where(Child.parent_id == pid)
+            .order_by(Child.id))
+        self.assertEqual(data.all(), ['a', 'c'])
+
+        await self.view(self.make_request(
+            f'/parent/{pid}', 'DELETE', matchdict={'id': str(pid)})).delete()
+        count = await self.session.scalar(
+            select(func.count()).select_from(Child))
+        self.assertEqual(count, 3, 'delete cascades to children')
+
+    async def test_catchall(self):
+        from py_liant.async_views import AsyncCatchallView
+        from py_liant.pyramid import CatchallPredicate
+        from .models import Parent, Child
+        predicate = CatchallPredicate({'parent': Parent, 'child': Child},
+                                      self.config)
+
+        request = self.make_request(
+            '/', matchdict={'catchall': 'parent@2/children:*parent'})
+        self.assertTrue(predicate(None, request))
+        result = await AsyncCatchallView(request).process()
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['items'][0].parent.id, 2)
+
+        request = self.make_request(
+            '/', matchdict={'catchall': 'child@3'})
+        self.assertTrue(predicate(None, request))
+        result = await AsyncCatchallView(request).process()
+        self.assertEqual(result['child'].data, 'child value 2')
+
+        request = self.make_request(
+            '/?aggregate=count,max:id', matchdict={'catchall': 'child'})
+        self.assertTrue(predicate(None, request))
+        result = await AsyncCatchallView(request).process()
+        self.assertEqual(result['items'], [{'count': 3, 'max_id': 3}])
+
+    async def test_delete_list(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        from sqlalchemy import func, select
+        from py_liant.async_views import AsyncCatchallView
+        from py_liant.pyramid import CatchallPredicate
+        from .models import Parent, Child
+        predicate = CatchallPredicate({'parent': Parent, 'child': Child},
+                                      self.config)
+
+        class View(AsyncCatchallView):
+            allow_list_delete = True
+
+        async def delete(route, view=View):
+            request = self.make_request(
+                '/?' + route.partition('?')[2], 'DELETE',
+                matchdict={'catchall': route.partition('?')[0]})
+            self.assertTrue(predicate(None, request))
+            return await view(request).process()
+
+        async def count(cls):
+            return await self.session.scalar(
+                select(func.count()).select_from(cls))
+
+        with self.assertRaises(HTTPNotFound):
+            await delete('child', AsyncCatchallView)
+        self.assertEqual(await delete('child?data_like=child value 0'),
+                         {'deleted': 1})
+        self.assertEqual(await delete('parent@2/children'), {'deleted': 1})
+        self.assertEqual(await count(Child), 1)
+        # deleted through the session, cascading to the children
+        self.assertEqual(await delete('parent?id_gt=1'), {'deleted': 2})
+        self.assertEqual((await count(Parent), await count(Child)), (1, 0))
+
+    async def test_stream(self):
+        import simplejson
+        from py_liant.json_encoder import JSONEncoder
+        from .models import Base
+
+        request = self.make_request('/parent?order=id')
+        result = await self.view(request).list_stream()
+        encoder = JSONEncoder(request, base_type=Base)
+        streamed = ''.join([chunk async for chunk in
+                            encoder.aiterencode(result)])
+
+        result = await self.view(request).list()
+        expected = JSONEncoder(request, base_type=Base).encode(result)
+        self.assertIn('"_id": 3', streamed)
+        self.assertEqual(simplejson.loads(streamed),
+                         simplejson.loads(expected))
+
+    async def test_stream_guard_batch(self):
+        from py_liant.interfaces import JsonGuardProvider
+        from py_liant.json_encoder import JSONEncoder
+        from .models import Base
+        calls = []
+
+        class Guard(JsonGuardProvider):
+            guardHints = guardDrilldown = guardUpdate = None
+
+            def guardSerialize(self, obj, value):
+                pass
+
+            def guardSerializeBatch(self, cls, objects):
+                calls.append((cls.__name__, len(objects)))
+
+        request = self.make_request('/parent?order=id')
+        request.context = Guard()
+        result = await self.view(request).list_stream()
+        encoder = JSONEncoder(request, base_type=Base)
+        streamed = ''.join([chunk async for chunk in
+                            encoder.aiterencode(result)])
+        # once for the response, not once per streamed row
+        self.assertEqual(calls, [('Parent', 3)])
+        self.assertIn('"_id": 3', streamed)
@@ -0,0 +1,105 @@
+import unittest
+
+from hypothesis import given, settings, strategies as st
+
+from py_liant import fast_parser, parser
+
+# property based checks of the hand-written parser against the pyparsing
+# grammar: for any input both either fail or produce the same structure
+
+fieldnames = st.from_regex(r'[A-Za-z][A-Za-z0-9_]{0,6}', fullmatch=True)
+pkeys = st.from_regex(r'[A-Za-z0-9_\- ]{1,6}', fullmatch=True)
+integers = st.from_regex(r'-?[0-9]{1,3}', fullmatch=True)
+spaces = st.sampled_from(['', '', '', ' ', '  ', '\t', '\n'])
+
+
+def _hints():
+    def _extend(children):
+        children = st.lists(children, min_size=1, max_size=3).map(','.join)
+        return st.one_of(
+            st.builds('{}{}({})'.format, st.sampled_from('+*'), fieldnames,
+                      children),
+            st.builds('!{}({})'.format, fieldnames, children))
+
+    atom = st.builds('{}{}'.format, st.sampled_from('-+*'), fieldnames)
+    hint = st.recursive(atom, _extend, max_leaves=6)
+    return st.lists(hint, min_size=1, max_size=4).map(','.join)
+
+
+def _optional(strategy):
+    return st.one_of(st.just(''), strategy)
+
+
+routes = st.builds(
+    '{}{}{}{}{}{}{}'.format,
+    fieldnames,
+    _optional(st.builds('!{}'.format, fieldnames)),
+    _optional(st.lists(pkeys, min_size=1, max_size=3)
+              .map(lambda _: '@' + ','.join(_))),
+    _optional(st.builds('/{}{}'.format, fieldnames,
+                        _optional(st.builds('!{}'.format, fieldnames)))),
+    _optional(st.one_of(st.builds('[{}]'.format, integers),
+                        st.builds('[{}:{}]'.format, integers, integers))),
+    _optional(st.builds(':{}'.format, fieldnames)),
+    _optional(st.builds(':{}'.format, _hints())),
+)
+
+
+@st.composite
+def _noisy(draw, strategy):
+    # insert whitespace and random grammar characters into a valid input
+    value = list(draw(strategy))
+    for _ in range(draw(st.integers(0, 3))):
+        pos = draw(st.integers(0, len(value)))
+        value.insert(pos, draw(st.one_of(spaces, st.sampled_from(
+            list('!@/[]:,()+-*_ ') + ['0', 'a']))))
+    return ''.join(value)
+
+
+def _outcome(func, value):
+    try:
+        return func(value)
+    except Exception as ex:
+        return type(ex).__name__
+
+
+class TestFastParser(unittest.TestCase):
+    def assertEquivalent(self, reference, candidate, value):
+        expected = _outcome(reference, value)
+        actual = _outcome(candidate, value)
+        if expected == 'ParseException':
+            self.assertEqual(actual, 'ParseError', f'input: {value!r}')
+        else:
+            self.assertEqual(actual, expected, f'input: {value!r}')
+
+    @given(routes)
+    @settings(max_examples=200)
+    def test_valid_routes(self, value):
+        self.assertEquivalent(parser.parse_route, fast_parser.parse_route,
+                              value)
+
+    @given(_noisy(routes))
+    @settings(max_examples=300)
+    def test_noisy_routes(self, value):
+        self.assertEquivalent(parser.parse_route, fast_parser.parse_route,
+                              value)
+
+    @given(_noisy(_hints()))
+    @settings(max_examples=200)
+    def test_noisy_hints(self, value):
+        self.assertEquivalent(parser.parse_hints, fast_parser.parse_hints,
+                              value)
+
+    @given(st.text(alphabet='ab1 -_!@/[]:,()+*\t', max_size=20))
+    @settings(max_examples=300)
+    def test_arbitrary_input(self, value):
+        self.assertEquivalent(parser.parse_route, fast_parser.parse_route,
+                              value)
+
+    def test_examples(self):
+        for value in ('parent', 'parent!father@1/children!girl[0:10]:full',
+                      'p@ 1 ,a b:prof:-a,*b(+c,!t(*d(!u(+e))))', 'p[-]',
+                      ' p : + a ( - b ) ', 'p@1\t2', 'p:a(', 'p!:x', ''):
+            with self.subTest(value=value):
+                self.assertEquivalent(parser.parse_route,
+                                      fast_parser.parse_route, value)
@@ -0,0 +1,219 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from pyramid.settings import asbool
+
+# Per-request timing breakdown. The tween makes a RequestTimings current for
+# the request; phases are accumulated by timed() blocks in py_liant (route
+# parsing, apply_changes, JSON encoding) and by engine/session events (SQL,
+# flush, commit). Outside timed requests the hooks only read a ContextVar.
+#
+# Register with includeme_factory(timing=True), or:
+#     config.add_tween('py_liant.timing.timing_tween_factory', under=INGRESS)
+#     py_liant.timing.listen()
+# Settings: py_liant.timing.header (Server-Timing header, default true) and
+# py_liant.timing.log (log record on the py_liant.timing logger, default
+# true). Streamed responses (includeme_factory(wsgi_iter=True)) are encoded
+# after the header is sent; their log record, written when the server closes
+# the response, includes the encoding.
+
+log = logging.getLogger(__name__)
+
+_current = ContextVar('py_liant.timing', default=None)
+_listening = False
+
+
+class RequestTimings:
+    def __init__(self):
+        # seconds and number of occurrences by phase, in order of appearance
+        self.phases = dict()
+        # phases in progress, innermost last
+        self.active = []
+        # executed statements, when recorded (see py_liant.profiling)
+        self.statements = None
+
+    def enter(self, phase):
+        self.active.append(phase)
+        return perf_counter()
+
+    def leave(self, phase, start):
+        duration = perf_counter() - start
+        for i in range(len(self.active) - 1, -1, -1):
+            if self.active[i] == phase:
+                del self.active[i]
+                break
+        self.add(phase, duration)
+        return duration
+
+    def add(self, phase, seconds):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def milliseconds(self):
+        return {phase: round(seconds * 1000, 3)
+                for phase, (seconds, count) in self.phases.items()}
+
+    def header(self):
+        return ', '.join(
+            f'{phase};dur={seconds * 1000:.3f}' +
+            (f';desc="{count} queries"' if phase == 'sql' else '')
+            for phase, (seconds, count) in self.phases.items())
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def timed(phase):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = timings.enter(phase)
+    try:
+        yield
+    finally:
+        timings.leave(phase, start)
+
+
+def _start(info, key, phase):
+    timings = _current.get()
+    if timings is not None:
+        info[key] = timings.enter(phase)
+
+
+def _stop(info, key, phase):
+    start = info.pop(key, None)
+    timings = _current.get()
+    if start is not None and timings is not None:
+        return timings.leave(phase, start)
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    _start(conn.info, 'py_liant.timing.sql', 'sql')
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = _stop(conn.info, 'py_liant.timing.sql', 'sql')
+    if duration is not None:
+        timings = _current.get()
+        if timings.statements is not None:
+            timings.statements.append(dict(
+                statement=statement, duration=round(duration * 1000, 3),
+                phase=timings.active[-1] if timings.active else None))
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        _stop(context.connection.info, 'py_liant.timing.sql', 'sql')
+
+
+def _before_flush(session, flush_context, instances):
+    _start(session.info, 'py_liant.timing.flush', 'flush')
+
+
+def _after_flush(session, flush_context):
+    _stop(session.info, 'py_liant.timing.flush', 'flush')
+
+
+def _before_commit(session):
+    _start(session.info, 'py_liant.timing.commit', 'commit')
+
+
+def _after_commit(session):
+    _stop(session.info, 'py_liant.timing.commit', 'commit')
+
+
+def listen():
+    # SQL, flush and commit timings for all engines and sessions
+    global _listening
+    if _listening:
+        return
+    _listening = True
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    event.listen(Session, 'before_flush', _before_flush)
+    event.listen(Session, 'after_flush_postexec', _after_flush)
+    event.listen(Session, 'before_commit', _before_commit)
+    event.listen(Session, 'after_commit', _after_commit)
+
+
+class _TimedAppIter:
+    # app_iter of a streamed response: the request's timings are current
+    # while the server iterates it, and are logged when it is closed
+    def __init__(self, app_iter, timings, start, finish):
+        self.app_iter = app_iter
+        self.iterator = iter(app_iter)
+        self.timings = timings
+        self.start = start
+        self.finish = finish
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = _current.set(self.timings)
+        try:
+            return next(self.iterator)
+        finally:
+            _current.reset(token)
+
+    def close(self):
+        try:
+            close = getattr(self.app_iter, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.timings.phases['total'] = [perf_counter() - self.start, 1]
+            self.finish()
+
+
+def timing_tween_factory(handler, registry):
+    settings = registry.settings or {}
+    header = asbool(settings.get('py_liant.timing.header', True))
+    record = asbool(settings.get('py_liant.timing.log', True))
+
+    def finish(request, timings):
+        if record:
+            log.info('%s %s %s', request.method, request.path_info,
+                     timings.header(),
+                     extra={'timings': timings.milliseconds()})
+
+    def timing_tween(request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = perf_counter()
+        try:
+            response = handler(request)
+        except BaseException:
+            timings.add('total', perf_counter() - start)
+            finish(request, timings)
+            raise
+        finally:
+            _current.reset(token)
+        timings.add('total', perf_counter() - start)
+        if header:
+            response.headers['Server-Timing'] = timings.header()
+        if record and not isinstance(response.app_iter, (list, tuple)):
+            response.app_iter = _TimedAppIter(
+                response.app_iter, timings, start,
+                lambda: finish(request, timings))
+        else:
+            finish(request, timings)
+        return response
+    return timing_tween
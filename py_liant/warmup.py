@@ -0,0 +1,42 @@
+import gc
+
+from sqlalchemy import orm
+
+from .metadata import registry
+from .pyramid import catchall_predicates
+
+# Work otherwise done by the first requests of every worker process. Run it in
+# the master process of a pre-forking server (gunicorn --preload, uWSGI
+# without lazy-apps) once the application is configured, e.g. through
+# includeme_factory(warmup=True); the workers then share its results with the
+# master, copy-on-write.
+
+
+def warmup(base_class=None, freeze=True):
+    '''
+    Configures the mappers of `base_class` and registers their view metadata,
+    imports the modules py_liant otherwise loads on first use and plans the
+    basic routes of every catchall target. With `freeze`, the objects
+    allocated so far are moved out of the garbage collector's reach
+    (gc.freeze()), so that collections in the workers do not write to, and so
+    copy, the pages they share.
+    '''
+    if base_class is not None and hasattr(base_class, 'registry'):
+        orm.configure_mappers()
+        for mapper in base_class.registry.mappers:
+            registry.register(mapper.class_)
+            # memoized by the mapper, used by the encoder and apply_changes
+            for name in ('all_orm_descriptors', 'relationships', 'composites'):
+                getattr(mapper, name)
+
+    # imported on first use otherwise
+    import dateutil.parser  # noqa: F401
+    import dateutil.tz  # noqa: F401
+    import isodate  # noqa: F401
+
+    for predicate in list(catchall_predicates):
+        predicate.warmup()
+
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
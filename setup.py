@@ -84,7 +84,9 @@ tests_require = [
     'pytest >= 3.7.4',
     'pytest-cov',
     'zope.sqlalchemy',
-    'pyramid_tm'
+    'pyramid_tm',
+    'hypothesis',
+    'aiosqlite'
 ]
 
 # Where the magic happens: